@@ -0,0 +1,98 @@
+"""
+Admission control for /webhook.
+
+Each request is classified on arrival from the number of requests already
+in flight in this process and, when the router stamps ``X-Request-Start``,
+how long it sat in the queue before reaching us:
+
+* admitted  - normal handling
+* fast_path - handled with no upstream budget, so only static screens and
+              cached results are served
+* shed      - answered at once with a canned "busy" reply
+
+A threshold of 0 disables that level.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+ADMITTED = 'admitted'
+FAST_PATH = 'fast_path'
+SHED = 'shed'
+
+
+def queue_delay_ms(header, now=None):
+    """Milliseconds since the router's ``X-Request-Start`` stamp, or None.
+
+    Accepts ``t=<value>`` or a bare value in seconds, milliseconds or
+    microseconds since the epoch (Heroku sends ms, nginx seconds.millis).
+    """
+    if not header:
+        return None
+    try:
+        value = float(header.strip().removeprefix('t='))
+    except ValueError:
+        return None
+    if value > 1e14:
+        value /= 1e6
+    elif value > 1e11:
+        value /= 1e3
+    delay = ((now or time.time()) - value) * 1000
+    return max(delay, 0.0)
+
+
+class AdmissionController:
+    """In-flight counter plus threshold-based admission decisions"""
+
+    def __init__(self, fast_path_at=0, shed_at=0, queue_fast_path_ms=0, queue_shed_ms=0, observer=None):
+        self.fast_path_at = fast_path_at
+        self.shed_at = shed_at
+        self.queue_fast_path_ms = queue_fast_path_ms
+        self.queue_shed_ms = queue_shed_ms
+        # Optional callback(decision, in_flight) for every request
+        self.observer = observer
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.counts = {ADMITTED: 0, FAST_PATH: 0, SHED: 0}
+        self._lock = threading.Lock()
+
+    def decide(self, in_flight, queued_ms=None):
+        queued_ms = queued_ms or 0
+        if (self.shed_at and in_flight >= self.shed_at) or (self.queue_shed_ms and queued_ms >= self.queue_shed_ms):
+            return SHED
+        if (self.fast_path_at and in_flight >= self.fast_path_at) or \
+                (self.queue_fast_path_ms and queued_ms >= self.queue_fast_path_ms):
+            return FAST_PATH
+        return ADMITTED
+
+    @contextmanager
+    def admit(self, queued_ms=None):
+        """Classify one request; it counts as in flight until the block exits"""
+        with self._lock:
+            decision = self.decide(self.in_flight, queued_ms)
+            self.counts[decision] += 1
+            if decision != SHED:
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            in_flight = self.in_flight
+        if self.observer is not None:
+            self.observer(decision, in_flight)
+        try:
+            yield decision
+        finally:
+            if decision != SHED:
+                with self._lock:
+                    self.in_flight -= 1
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'decisions': dict(self.counts),
+            'thresholds': {
+                'fast_path_at': self.fast_path_at,
+                'shed_at': self.shed_at,
+                'queue_fast_path_ms': self.queue_fast_path_ms,
+                'queue_shed_ms': self.queue_shed_ms,
+            },
+        }
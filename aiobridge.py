@@ -0,0 +1,70 @@
+"""
+Run the synchronous bot code on an asyncio event loop.
+
+``run_sync(func, *args)`` executes ``func`` in a greenlet. Whenever that
+code calls ``await_(awaitable)`` (the async upstream clients in asgi.py do
+this), the greenlet switches back to the event loop, which awaits the
+result and resumes the greenlet with it. A request waiting on WooCommerce
+or Claude therefore parks a greenlet instead of a worker thread, and the
+handlers themselves stay exactly the code the WSGI path runs.
+"""
+import asyncio
+import contextvars
+import sys
+import time
+
+import greenlet
+
+
+class _BridgeGreenlet(greenlet.greenlet):
+    """Greenlet whose parent is the event-loop task waiting on it"""
+
+
+def in_bridge():
+    """True when running inside ``run_sync`` (so ``await_`` is allowed)"""
+    return isinstance(greenlet.getcurrent(), _BridgeGreenlet)
+
+
+def current_task():
+    """The bridge greenlet running this code, or None outside ``run_sync``"""
+    current = greenlet.getcurrent()
+    return current if isinstance(current, _BridgeGreenlet) else None
+
+
+def await_(awaitable):
+    """Block this greenlet until ``awaitable`` completes on the event loop"""
+    current = greenlet.getcurrent()
+    if not isinstance(current, _BridgeGreenlet):
+        raise RuntimeError("await_() called outside run_sync()")
+    return current.parent.switch(awaitable)
+
+
+async def run_sync(func, *args, **kwargs):
+    """Run ``func`` in a greenlet, serving its ``await_`` calls"""
+    task = _BridgeGreenlet(func, greenlet.getcurrent())
+    # Fresh context per call: Flask's request context and the tracer live there
+    task.gr_context = contextvars.copy_context()
+    result = task.switch(*args, **kwargs)
+    while not task.dead:
+        try:
+            value = await result
+        except BaseException:
+            result = task.throw(*sys.exc_info())
+        else:
+            result = task.switch(value)
+    return result
+
+
+def sleep(seconds):
+    """time.sleep that yields to the event loop when bridged"""
+    if in_bridge():
+        await_(asyncio.sleep(seconds))
+    else:
+        time.sleep(seconds)
+
+
+def to_thread(func, *args, **kwargs):
+    """Run a blocking call in the loop's executor when bridged, inline otherwise"""
+    if in_bridge():
+        return await_(asyncio.to_thread(func, *args, **kwargs))
+    return func(*args, **kwargs)
@@ -1,22 +1,50 @@
+import time
+BOOT_STARTED = time.perf_counter()
+
 import os
-from flask import Flask, request, jsonify
+import importlib.util
+from flask import Flask, Response, request, jsonify
 from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
-from woocommerce import API
 import config
+import logsetup
+import deadline
+from admission import AdmissionController, FAST_PATH, SHED, queue_delay_ms
+from statemachine import StateMachine
+from render_cache import FragmentCache, ScreenCache, slot
+from lexicon import Lexicon
+import metrics
+from profiler import SamplingProfiler
+from tracing import SlowRequestTracer
+from clients import LazyClient
+from live_config import LiveConfig
+from promotions import PromoEngine
+from pricing import PriceTable, format_price
+from bulk_quote import NameMatcher, build_quote, looks_like_sku, parse_lines
+from order_queue import OrderQueue, idempotency_key
+import wc_standin
+from reservations import OrderIdAllocator, ReservationRegistry
+from live_feed import FeedFull, FeedHub
+import eventlog
+from funnel import FunnelCounters
+from snapshot import SnapshotDict, SnapshotStore
 import logging
 import re
 import json
 import hashlib
+import hmac
+import html
+import atexit
+import tempfile
 import smtplib
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 app = Flask(__name__)
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+# Setup logging (queued JSON lines; see logsetup.py for LOG_* settings)
+logsetup.setup_logging()
 logger = logging.getLogger(__name__)
 
 # ============================================
@@ -34,8 +62,21 @@ EMAIL_CONFIG = {
     }
 }
 
+# Emails that don't fit in the request deadline are sent from here instead
+email_outbox = ThreadPoolExecutor(max_workers=2, thread_name_prefix='email-outbox')
+EMAIL_INLINE_BUDGET = float(os.environ.get('EMAIL_INLINE_BUDGET_SECONDS', 5))
+
 def send_email(to_emails, subject, body_html, body_text=None):
-    """Send email notification"""
+    """Send email notification (deferred to the outbox when the deadline is short)"""
+    left = deadline.remaining()
+    if left is not None and left < EMAIL_INLINE_BUDGET:
+        degrade('send_email', 'deferred')
+        email_outbox.submit(deliver_email, to_emails, subject, body_html, body_text)
+        return True
+    return deliver_email(to_emails, subject, body_html, body_text)
+
+def deliver_email(to_emails, subject, body_html, body_text=None):
+    """Send email notification now"""
     try:
         if not EMAIL_CONFIG['smtp_user'] or not EMAIL_CONFIG['smtp_password']:
             logger.warning("Email not configured - skipping send")
@@ -50,209 +91,202 @@ def send_email(to_emails, subject, body_html, body_text=None):
             msg.attach(MIMEText(body_text, 'plain', 'utf-8'))
         msg.attach(MIMEText(body_html, 'html', 'utf-8'))
         
-        with smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port']) as server:
-            server.starttls()
-            server.login(EMAIL_CONFIG['smtp_user'], EMAIL_CONFIG['smtp_password'])
-            server.send_message(msg)
+        with metrics.upstream('smtp', 'send', recipients=len(to_emails) if isinstance(to_emails, list) else 1):
+            with smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port'],
+                              timeout=deadline.timeout(30)) as server:
+                server.starttls()
+                server.login(EMAIL_CONFIG['smtp_user'], EMAIL_CONFIG['smtp_password'])
+                server.send_message(msg)
         
-        logger.info(f"📧 Email sent to: {to_emails}")
+        logger.info("📧 Email sent to: %s", to_emails)
         return True
     except Exception as e:
-        logger.error(f"❌ Email error: {e}")
+        logger.error("❌ Email error: %s", e)
         return False
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+def degrade(operation, action):
+    """Count and trace a reply degraded by the request deadline"""
+    metrics.DEGRADATIONS.inc(operation=operation, action=action)
+    tracer.annotate(degraded=f"{operation}:{action}")
+    left = deadline.remaining()
+    logger.warning("⏳ Deadline: %s degraded (%s), %.0f ms left", operation, action, (left or 0) * 1000)
 
-# Initialize Twilio client
-twilio_client = Client(config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN)
+# ============================================
+# 🔌 UPSTREAM CLIENTS (built on first use)
+# ============================================
+def build_twilio_client():
+    from twilio.rest import Client
+    return Client(config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN)
+
+def build_wcapi():
+    # Every call is timed for /metrics
+    from woocommerce import API
+
+    class DeadlineAPI(API):
+        """requests timeout = what is left of the request deadline (at most ``timeout``)"""
+        timeout = property(lambda self: deadline.timeout(self.max_timeout),
+                           lambda self, value: setattr(self, 'max_timeout', value))
+
+    return metrics.InstrumentedClient(DeadlineAPI(
+        url=config.PANES_URL,
+        consumer_key=config.PANES_CONSUMER_KEY,
+        consumer_secret=config.PANES_CONSUMER_SECRET,
+        version="wc/v3",
+        timeout=30
+    ), 'woocommerce')
+
+def claude_api_key():
+    # Check both config and environment variable
+    return getattr(config, 'ANTHROPIC_API_KEY', None) or os.environ.get('ANTHROPIC_API_KEY')
 
-# Initialize WooCommerce API
-wcapi = API(
-    url=config.PANES_URL,
-    consumer_key=config.PANES_CONSUMER_KEY,
-    consumer_secret=config.PANES_CONSUMER_SECRET,
-    version="wc/v3",
-    timeout=30
-)
+def claude_configured():
+    return bool(claude_api_key()) and importlib.util.find_spec('anthropic') is not None
 
-# Initialize Claude AI
-claude_client = None
-try:
+def build_claude_client():
+    if not claude_configured():
+        return None
     from anthropic import Anthropic
-    # Check both config and environment variable
-    api_key = getattr(config, 'ANTHROPIC_API_KEY', None) or os.environ.get('ANTHROPIC_API_KEY')
-    if api_key:
-        claude_client = Anthropic(api_key=api_key)
-        logger.info("✅ Claude AI initialized successfully!")
-    else:
-        logger.warning("⚠️ ANTHROPIC_API_KEY not found - AI features disabled")
-except ImportError:
+    return Anthropic(api_key=claude_api_key())
+
+twilio_client = LazyClient('Twilio', build_twilio_client,
+                           enabled=lambda: bool(config.TWILIO_ACCOUNT_SID and config.TWILIO_AUTH_TOKEN))
+wcapi = LazyClient('WooCommerce', build_wcapi)
+claude_client = LazyClient('Claude', build_claude_client, enabled=claude_configured)
+
+if not claude_api_key():
+    logger.warning("⚠️ ANTHROPIC_API_KEY not found - AI features disabled")
+elif not claude_configured():
     logger.warning("⚠️ anthropic package not installed")
-except Exception as e:
-    logger.warning(f"⚠️ Claude AI error: {e}")
+
+# ============================================
+# 🧾 WOOCOMMERCE ORDER QUEUE
+# ============================================
+# Pickups and drive-through reservations become WooCommerce orders, written
+# in batches from a background thread. WC_ORDERS_STANDIN=1 mounts a local
+# stand-in (wc_standin.py) and points the orders client at it.
+WC_ORDERS_STANDIN = os.environ.get('WC_ORDERS_STANDIN', '').lower() in ('1', 'true', 'yes')
+WC_ORDERS_URL = os.environ.get('WC_ORDERS_URL') or (
+    f"http://127.0.0.1:{os.environ.get('PORT', 5000)}{wc_standin.PREFIX}" if WC_ORDERS_STANDIN else config.PANES_URL)
+# How far back to look for orders a timed-out batch may already have created
+ORDER_LOOKBACK = timedelta(hours=1)
+
+if WC_ORDERS_STANDIN:
+    app.register_blueprint(wc_standin.blueprint)
+    logger.warning("🧪 WooCommerce orders go to the local stand-in at %s", WC_ORDERS_URL)
+
+def build_orders_client():
+    # Blocking client: used only by the queue's worker thread, in WSGI and ASGI mode alike
+    from woocommerce import API
+    return metrics.InstrumentedClient(API(
+        url=WC_ORDERS_URL,
+        consumer_key=config.PANES_CONSUMER_KEY,
+        consumer_secret=config.PANES_CONSUMER_SECRET,
+        version="wc/v3",
+        timeout=30
+    ), 'woocommerce')
+
+orders_client = LazyClient('WooCommerce orders', build_orders_client)
+
+def submit_order_batch(payloads):
+    """POST orders/batch; returns the per-order ``create`` results"""
+    response = orders_client.post("orders/batch", {"create": payloads})
+    if response.status_code >= 400:
+        raise RuntimeError(f"orders/batch HTTP {response.status_code}")
+    return response.json().get('create', [])
+
+def find_existing_orders(keys):
+    """{idempotency key: order id} for recent orders WooCommerce already has.
+
+    Pages through every order of the lookback window (web orders included),
+    stopping early once all keys are found.
+    """
+    wanted = set(keys)
+    after = (datetime.now(timezone.utc) - ORDER_LOOKBACK).strftime('%Y-%m-%dT%H:%M:%S')
+    found = {}
+    page = 1
+    while len(found) < len(wanted):
+        response = orders_client.get("orders", params={
+            "after": after, "per_page": 100, "page": page, "_fields": "id,meta_data"})
+        orders = response.json()
+        if response.status_code >= 400 or not isinstance(orders, list):
+            # Unknown is not "absent": retrying now could create duplicates
+            raise RuntimeError(f"orders lookup HTTP {response.status_code}")
+        for order in orders:
+            key = idempotency_key(order)
+            if key in wanted:
+                found[key] = order.get('id')
+        if len(orders) < 100:
+            break
+        page += 1
+    return found
+
+order_queue = OrderQueue(
+    submit_order_batch,
+    find_existing=find_existing_orders,
+    max_batch=int(os.environ.get('ORDER_BATCH_SIZE', 20)),
+    max_wait=float(os.environ.get('ORDER_BATCH_SECONDS', 2)),
+    max_attempts=int(os.environ.get('ORDER_MAX_ATTEMPTS', 5)),
+    observer=lambda outcome, count: metrics.ORDERS.inc(count, outcome=outcome)
+)
+atexit.register(order_queue.shutdown, 5)
+
+def queue_pickup_order(product, customer, store, kind, reference=None, expires=None):
+    """Queue a store pickup / drive-through order; never waits on WooCommerce"""
+    phone = customer.get('phone', '').replace('whatsapp:', '')
+    method = 'Drive-Through' if kind == 'drive_through' else 'Παραλαβή από κατάστημα'
+    meta = [{'key': '_whatsapp_store', 'value': store['id']}, {'key': '_whatsapp_kind', 'value': kind}]
+    if reference:
+        meta.append({'key': '_whatsapp_reference', 'value': reference})
+    if expires:
+        meta.append({'key': '_whatsapp_reservation_expires', 'value': expires.isoformat(timespec='minutes')})
+    return order_queue.enqueue({
+        'status': 'on-hold',
+        'payment_method': 'cod',
+        'payment_method_title': 'Πληρωμή στο κατάστημα',
+        'set_paid': False,
+        'billing': {'phone': phone},
+        'line_items': [{'product_id': product.get('id'), 'quantity': 1}],
+        'shipping_lines': [{'method_id': 'local_pickup', 'method_title': f"{method} - {store['name']}", 'total': '0.00'}],
+        'customer_note': f"WhatsApp {reference or ''}".strip(),
+        'meta_data': meta,
+    })
+
+# ============================================
+# ⚙️ LIVE CONFIGURATION
+# ============================================
+# Stores, franchise/wholesale info, discount exclusions, promos,
+# subscription plans and categories come from store_config.json and are
+# reloaded without a restart (see live_config.py and apply_* below).
+live_config = LiveConfig(
+    os.environ.get('STORE_CONFIG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'store_config.json')),
+    check_interval=float(os.environ.get('CONFIG_CHECK_SECONDS', 2))
+)
+live_config.load()
 
 # ============================================
 # 🏪 ALL CARESTORES LOCATIONS
 # ============================================
-STORES = {
-    'chalandri': {
-        'id': 'chalandri',
-        'name': 'CARESTORES Χαλάνδρι',
-        'short_name': 'Χαλάνδρι',
-        'address': 'Λ. Πεντέλης 58, Χαλάνδρι 15233',
-        'phone': '210 680 0549',
-        'hours': {'weekdays': '09:00 - 21:00', 'saturday': '09:00 - 15:00', 'sunday': 'Κλειστά'},
-        'parking': '10 θέσεις parking',
-        'lat': '38.0217',
-        'lng': '23.8003',
-        'google_maps': 'https://maps.app.goo.gl/H8ofyNhr1vuEUJeF7',
-        'waze': 'https://waze.com/ul?ll=38.0217,23.8003&navigate=yes',
-        'drive_through': True,
-        'active': True
-    },
-    'ampelokipoi': {
-        'id': 'ampelokipoi',
-        'name': 'CARESTORES Αμπελόκηποι',
-        'short_name': 'Αμπελόκηποι',
-        'address': 'Αμπελόκηποι, Αθήνα',
-        'phone': '',
-        'hours': {'weekdays': '09:00 - 21:00', 'saturday': '09:00 - 15:00', 'sunday': 'Κλειστά'},
-        'parking': 'Διαθέσιμο parking',
-        'lat': '37.9878',
-        'lng': '23.7650',
-        'google_maps': 'https://www.google.com/maps/search/?api=1&query=CARESTORES+Αμπελόκηποι',
-        'waze': '',
-        'drive_through': False,
-        'active': True
-    },
-    'gerakas': {
-        'id': 'gerakas',
-        'name': 'CARESTORES Γέρακας',
-        'short_name': 'Γέρακας',
-        'address': 'Γέρακας, Αττική',
-        'phone': '',
-        'hours': {'weekdays': '09:00 - 21:00', 'saturday': '09:00 - 15:00', 'sunday': 'Κλειστά'},
-        'parking': 'Διαθέσιμο parking',
-        'lat': '38.0167',
-        'lng': '23.8500',
-        'google_maps': 'https://www.google.com/maps/search/?api=1&query=CARESTORES+Γέρακας',
-        'waze': '',
-        'drive_through': False,
-        'active': True
-    },
-    'cholargos': {
-        'id': 'cholargos',
-        'name': 'CARESTORES Χολαργός',
-        'short_name': 'Χολαργός',
-        'address': 'Χολαργός, Αττική',
-        'phone': '',
-        'hours': {'weekdays': '09:00 - 21:00', 'saturday': '09:00 - 15:00', 'sunday': 'Κλειστά'},
-        'parking': 'Διαθέσιμο parking',
-        'lat': '38.0044',
-        'lng': '23.7992',
-        'google_maps': 'https://www.google.com/maps/search/?api=1&query=CARESTORES+Χολαργός',
-        'waze': '',
-        'drive_through': False,
-        'active': True
-    },
-    'kalymnos': {
-        'id': 'kalymnos',
-        'name': 'CARESTORES Κάλυμνος',
-        'short_name': 'Κάλυμνος',
-        'address': 'Κάλυμνος, Δωδεκάνησα',
-        'phone': '',
-        'hours': {'weekdays': '09:00 - 21:00', 'saturday': '09:00 - 15:00', 'sunday': 'Κλειστά'},
-        'parking': 'Διαθέσιμο parking',
-        'lat': '36.9500',
-        'lng': '26.9833',
-        'google_maps': 'https://www.google.com/maps/search/?api=1&query=CARESTORES+Κάλυμνος',
-        'waze': '',
-        'drive_through': False,
-        'active': True
-    },
-    'lamia': {
-        'id': 'lamia',
-        'name': 'CARESTORES Λαμία',
-        'short_name': 'Λαμία',
-        'address': 'Λαμία, Φθιώτιδα',
-        'phone': '',
-        'hours': {'weekdays': '09:00 - 21:00', 'saturday': '09:00 - 15:00', 'sunday': 'Κλειστά'},
-        'parking': 'Διαθέσιμο parking',
-        'lat': '38.8991',
-        'lng': '22.4342',
-        'google_maps': 'https://www.google.com/maps/search/?api=1&query=CARESTORES+Λαμία',
-        'waze': '',
-        'drive_through': False,
-        'active': True
-    }
-}
+STORES = live_config['stores']
 
 # Default store
-DEFAULT_STORE = 'chalandri'
+DEFAULT_STORE = live_config['default_store']
 
 # ============================================
 # 🏢 FRANCHISE INFORMATION
 # ============================================
-FRANCHISE_INFO = {
-    'website': 'https://carestores.gr/franchise',
-    'youtube': 'https://youtu.be/eA5Lk0t7P1o?si=UJ2nG2RU0hME7M_z',
-    'email': 'franchise@carestores.gr',
-    'benefits': [
-        'Αποκλειστική περιοχή',
-        'Πλήρης εκπαίδευση',
-        'Marketing υποστήριξη',
-        'Χαμηλό κόστος εκκίνησης',
-        'Δοκιμασμένο επιχειρηματικό μοντέλο'
-    ]
-}
+FRANCHISE_INFO = live_config['franchise']
 
 # ============================================
 # 🏭 WHOLESALE / B2B INFORMATION
 # ============================================
-WHOLESALE_INFO = {
-    'website': 'https://easycaremarket.gr',
-    'b2b_portal': 'https://b2b.easycaremarket.gr',
-    'discount': '20%',
-    'min_order_free_shipping': 350,  # Minimum order for free shipping
-    'shipping_cost': 15,  # Shipping cost if below minimum
-    'target_customers': [
-        {'type': 'daycare', 'name': '🏫 Παιδικός Σταθμός'},
-        {'type': 'nursing_home', 'name': '🏥 Γηροκομείο'},
-        {'type': 'church', 'name': '⛪ Εκκλησιαστικό Ίδρυμα'},
-        {'type': 'elderly_care', 'name': '👴 Κέντρο Φροντίδας Ηλικιωμένων'},
-        {'type': 'kapi', 'name': '🏛️ ΚΑΠΗ'},
-        {'type': 'hotel', 'name': '🏨 Ξενοδοχείο'},
-        {'type': 'other', 'name': '🏢 Άλλη Επιχείρηση'}
-    ],
-    'benefits': [
-        'Έκπτωση -20%',
-        'Τιμολόγιο',
-        'Παράδοση στις αποθήκες σας',
-        'ΔΩΡΕΑΝ μεταφορικά (παραγγελίες 350€+)',
-        'Πίστωση'
-    ],
-    'contact_phone': '210 680 0549'
-}
+WHOLESALE_INFO = live_config['wholesale']
 
 # ============================================
 # ⚠️ DISCOUNT EXCLUSIONS
 # ============================================
-NO_DISCOUNT_KEYWORDS = [
-    'humana', 'βρεφικό γάλα', 'βρεφικο γαλα', 'baby formula',
-    'nan ', 'nestle nan', 'γάλα 1', 'γάλα 2', 'γάλα 3',
-    'βρεφική διατροφή', 'βρεφικη διατροφη',
-    '1ης ηλικίας', '2ης ηλικίας', '3ης ηλικίας',
-    'solgar', 'βιταμίνες solgar'
-]
-
-NO_DISCOUNT_PRODUCT_IDS = ['1446845', '1211051']
-
-NO_DISCOUNT_CATEGORIES = [
-    'βρεφικό γάλα', 'βρεφικο γαλα', 'baby formula',
-    'βρεφική διατροφή', 'solgar'
-]
+NO_DISCOUNT_KEYWORDS = live_config['no_discount']['keywords']
+NO_DISCOUNT_PRODUCT_IDS = live_config['no_discount']['product_ids']
+NO_DISCOUNT_CATEGORIES = live_config['no_discount']['categories']
 
 # ============================================
 # 🏭 B2B TAG CONFIGURATION
@@ -275,68 +309,126 @@ def is_b2b_product(product):
     return False
 
 def get_b2b_price(product):
-    """Calculate B2B price (20% discount)"""
+    """B2B price (20% discount), or None for fixed-price and unpriced products"""
+    return price_table.get(product).b2b
+
+# Last good WooCommerce product lists, served when the deadline runs short
+fallback_products = deadline.FallbackCache(maxsize=int(os.environ.get('FALLBACK_CACHE_SIZE', 500)))
+
+def fetch_with_fallback(operation, key, fetch):
+    """Run a WooCommerce fetch; on a deadline timeout serve its last good result.
+
+    Raises DeadlineExceeded when nothing is cached, so the state machine
+    answers with the handler's degraded reply.
+    """
     try:
-        price = float(product.get('price', 0))
-        if price <= 0:
-            return None
-        
-        # Apply 20% B2B discount
-        b2b_price = price * (1 - B2B_DISCOUNT)
-        
-        return round(b2b_price, 2)
-    except:
-        return None
+        result = fetch()
+    except Exception as e:
+        if not deadline.is_timeout(e):
+            raise
+        cached = fallback_products.get(key)
+        if cached is None:
+            degrade(operation, 'try_again')
+            raise deadline.DeadlineExceeded(f"{operation}: {e}") from e
+        degrade(operation, 'stale_cache')
+        return cached
+    fallback_products.put(key, result)
+    return result
+
+def fetch_tagged_products(tag_slug):
+    """Products carrying a WooCommerce tag (two calls: tag id, then products)"""
+    tags_response = wcapi.get("products/tags", params={"slug": tag_slug})
+    tags = tags_response.json()
+    
+    if not tags or not isinstance(tags, list):
+        logger.warning("%s tag not found in WooCommerce", tag_slug)
+        return []
+    
+    tag_id = tags[0].get('id')
+    if not tag_id:
+        return []
+    
+    # Get products with this tag
+    response = wcapi.get("products", params={"tag": tag_id, "per_page": 50})
+    products = response.json()
+    
+    return products if isinstance(products, list) else []
 
 def get_b2b_products():
     """Get all products with b2b tag from WooCommerce"""
     try:
-        # First get the b2b tag ID
-        tags_response = wcapi.get("products/tags", params={"slug": B2B_TAG_SLUG})
-        tags = tags_response.json()
-        
-        if not tags or not isinstance(tags, list):
-            logger.warning("B2B tag not found in WooCommerce")
-            return []
-        
-        tag_id = tags[0].get('id')
-        if not tag_id:
-            return []
-        
-        # Get products with this tag
-        response = wcapi.get("products", params={"tag": tag_id, "per_page": 50})
-        products = response.json()
-        
-        return products if isinstance(products, list) else []
+        return fetch_with_fallback('get_b2b_products', ('tag', B2B_TAG_SLUG),
+                                   lambda: fetch_tagged_products(B2B_TAG_SLUG))
+    except deadline.DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.error("Error fetching B2B products: %s", e)
+        return []
+
+def get_products_by_sku(skus):
+    """Products for a batch of SKUs, in one WooCommerce call"""
+    try:
+        return fetch_with_fallback('get_products_by_sku', ('sku', tuple(skus)), lambda: wcapi.get(
+            "products", params={"sku": ",".join(skus), "per_page": 100}).json())
+    except deadline.DeadlineExceeded:
+        raise
     except Exception as e:
-        logger.error(f"Error fetching B2B products: {e}")
+        logger.error("Error fetching products by SKU: %s", e)
         return []
 
+# WooCommerce caps per_page (and so an include= list) at 100
+STOCK_BATCH_SIZE = 100
+
+def get_stock_levels(product_ids):
+    """Stock fields for many products in batched ``products?include=`` calls.
+
+    Returns ({product id: product}, ids whose batch failed), both keyed by
+    ``stock_key``. A product the shop no longer returns is missing from the
+    first and not in the second.
+    """
+    ids = sorted({key for key in map(stock_key, product_ids) if key is not None})
+    found, failed = {}, set()
+    for start in range(0, len(ids), STOCK_BATCH_SIZE):
+        batch = ids[start:start + STOCK_BATCH_SIZE]
+        try:
+            response = wcapi.get("products", params={
+                "include": ",".join(map(str, batch)), "per_page": len(batch),
+                "_fields": "id,name,stock_status,stock_quantity,manage_stock"})
+            products = response.json()
+            if not 200 <= response.status_code < 300 or not isinstance(products, list):
+                raise ValueError(f"HTTP {response.status_code}: {str(products)[:200]}")
+        except Exception as e:
+            logger.error("Error fetching stock for %d products: %s", len(batch), e)
+            failed.update(batch)
+            continue
+        for product in products:
+            found[stock_key(product.get('id'))] = product
+    return found, failed
+
+def stock_key(product_id):
+    """Product id as get_stock_levels keys it (12 and '12' match); None if not an id"""
+    return int(product_id) if str(product_id).isdigit() else None
+
+def available_quantity(product):
+    """Units on hand: None when the shop doesn't count them, 0 when out of stock"""
+    if product is None or product.get('stock_status') == 'outofstock':
+        return 0
+    if product.get('manage_stock') and product.get('stock_quantity') is not None:
+        return max(product['stock_quantity'], 0)
+    return None
+
 def get_subscription_products():
     """Get all products with subscribe tag from WooCommerce"""
     try:
-        # First get the subscribe tag ID
-        tags_response = wcapi.get("products/tags", params={"slug": SUBSCRIBE_TAG_SLUG})
-        tags = tags_response.json()
-        
-        if not tags or not isinstance(tags, list):
-            logger.warning("Subscribe tag not found in WooCommerce")
-            return []
-        
-        tag_id = tags[0].get('id')
-        if not tag_id:
-            return []
-        
-        # Get products with this tag
-        response = wcapi.get("products", params={"tag": tag_id, "per_page": 50})
-        products = response.json()
+        products = fetch_with_fallback('get_subscription_products', ('tag', SUBSCRIBE_TAG_SLUG),
+                                       lambda: fetch_tagged_products(SUBSCRIBE_TAG_SLUG))
         
         # Filter out no-discount products
-        products = [p for p in products if not is_discount_excluded(p)] if isinstance(products, list) else []
-        
-        return products
+        return [p for p in products if not is_discount_excluded(p)]
+    except deadline.DeadlineExceeded:
+        raise
     except Exception as e:
-        logger.error(f"Error fetching subscription products: {e}")
+        logger.error("Error fetching subscription products: %s", e)
         return []
 
 def is_subscription_product(product):
@@ -373,34 +465,13 @@ def is_discount_excluded(product):
 # ============================================
 PROMO_ATTRIBUTE = 'whatsapp promo'
 
-ACTIVE_PROMOS = {
-    'pampers_wipes': {
-        'name': '🎁 ΔΩΡΟ Μωρομάντηλα Pampers!',
-        'description': 'Με κάθε Pampers Premium Care Jumbo Pack, ΔΩΡΟ Pampers Aqua Harmonie 48τεμ!',
-        'gift_product_id': '1446148',
-        'gift_name': 'Pampers Aqua Harmonie Μωρομάντηλα 48τεμ',
-        'valid_until': '2026-01-31',
-        'active': True,
-        'type': 'gift'
-    },
-    'epithimies_cashback': {
-        'name': '💰 Cashback από Epithimies.gr!',
-        'description': 'Επιστροφή 10€ ή 20€ σε επιλεγμένα προϊόντα!',
-        'website': 'https://epithimies.gr',
-        'valid_until': '2026-01-31',
-        'active': True,
-        'type': 'cashback'
-    },
-    'easypants_cashback': {
-        'name': '💶 EasyPants 30τεμ = Cashback 3€!',
-        'description': 'Αγόρασε EasyPants 30τεμ και πάρε 3€ επιστροφή!',
-        'product_ids': ['1446701', '1446694', '1446698'],
-        'cashback_amount': 3,
-        'valid_until': '2026-01-31',
-        'active': True,
-        'type': 'cashback'
-    }
-}
+ACTIVE_PROMOS = live_config['promos']
+
+# Compiled rules; renderers look promos up per product instead of matching names
+promo_engine = PromoEngine(ACTIVE_PROMOS, is_discount_excluded)
+
+# Retail, subscription and B2B prices per product version, in Decimal
+price_table = PriceTable(B2B_DISCOUNT, SUBSCRIPTION_DISCOUNT, is_discount_excluded)
 
 SPECIAL_PRODUCTS = {
     'kera_bed': {
@@ -409,22 +480,27 @@ SPECIAL_PRODUCTS = {
     }
 }
 
-EASYPANTS_PROMO_IDS = ['1446701', '1446694', '1446698']
-
 # ============================================
 # CUSTOMER & SESSION STORAGE
 # ============================================
-customers = {}
-sessions = {}
+# Kept across restarts when SNAPSHOT_DIR points at persistent storage:
+# restored lazily at import and again in each forked worker (gunicorn
+# post_fork, or the first request), saved periodically, on SIGTERM and at exit
+customers = SnapshotDict()
+sessions = SnapshotDict()
+state_snapshots = SnapshotStore(
+    os.environ.get('SNAPSHOT_DIR'),
+    {'customers': customers, 'sessions': sessions},
+    interval=float(os.environ.get('SNAPSHOT_INTERVAL_SECONDS', 300)),
+)
+state_snapshots.restore()
+state_snapshots.install_sigterm()
+atexit.register(state_snapshots.save, 'exit')
 
 # ============================================
 # SUBSCRIPTION PLANS
 # ============================================
-SUBSCRIPTION_PLANS = {
-    'weekly': {'days': 7, 'discount': 10, 'name': 'Εβδομαδιαία'},
-    'biweekly': {'days': 14, 'discount': 10, 'name': 'Κάθε 2 εβδομάδες'},
-    'monthly': {'days': 30, 'discount': 10, 'name': 'Μηνιαία'},
-}
+SUBSCRIPTION_PLANS = live_config['subscription_plans']
 
 PICKUP_DAYS = {
     '1': 'Δευτέρα', '2': 'Τρίτη', '3': 'Τετάρτη',
@@ -434,30 +510,87 @@ PICKUP_DAYS = {
 # ============================================
 # PRODUCT CATEGORIES
 # ============================================
-CATEGORIES = {
-    '1': {'name': '👶 Βρεφικές Πάνες', 'search': 'baby diapers πάνες μωρού pampers babylino', 'type': 'baby'},
-    '2': {'name': '👴 Πάνες Ενηλίκων', 'search': 'adult diapers πάνες ενηλίκων kera tena easypants', 'type': 'adult'},
-    '3': {'name': '🐕 Pet Πάνες & Τροφές', 'search': 'pet easypet training pads σκύλος γάτα', 'type': 'pet'},
-    '4': {'name': '🍼 Βρεφικό Γάλα', 'search': 'humana nan βρεφικό γάλα formula', 'type': 'formula', 'no_discount': True},
-    '5': {'name': '🧻 Χαρτικά', 'search': 'paper χαρτί toilet', 'type': 'general'},
-    '6': {'name': '🧼 Απορρυπαντικά', 'search': 'detergent απορρυπαντικό', 'type': 'general'},
-    '7': {'name': '💊 Βιταμίνες', 'search': 'vitamins βιταμίνες', 'type': 'vitamins', 'no_discount': True},
-    '8': {'name': '🧽 Μαντηλάκια', 'search': 'wipes μαντηλάκια', 'type': 'both'},
-    '9': {'name': '🩹 Sudocrem & Φροντίδα', 'search': 'sudocrem baby care κρέμα', 'type': 'both'},
-    '10': {'name': '🛏️ Υποσέντονα', 'search': 'υποσέντονα bed pads kera bed', 'type': 'adult'}
-}
+CATEGORIES = live_config['categories']
+
+# ============================================
+# 🔬 SAMPLING PROFILER
+# ============================================
+# Off by default. Arm at boot with PROFILE_REQUESTS / PROFILE_SECONDS or
+# at runtime through POST /admin/profile.
+profiler = SamplingProfiler(
+    interval=float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000,
+    output_dir=os.environ.get('PROFILE_DIR', '/tmp/whatsapp-profiles')
+)
+if os.environ.get('PROFILE_REQUESTS') or os.environ.get('PROFILE_SECONDS'):
+    profiler.arm(requests=os.environ.get('PROFILE_REQUESTS'), seconds=os.environ.get('PROFILE_SECONDS'))
+
+# ============================================
+# 🐢 SLOW REQUEST TRACES
+# ============================================
+tracer = SlowRequestTracer(
+    threshold_ms=float(os.environ.get('SLOW_REQUEST_MS', 2000)),
+    ring_size=int(os.environ.get('SLOW_TRACE_RING', 200)),
+    path=os.environ.get('SLOW_TRACE_FILE', '/tmp/whatsapp-slow-traces.jsonl') or None
+)
+metrics.upstream_hooks.append(tracer.record_span)
 
 # ============================================
 # MAIN WEBHOOK
 # ============================================
+# Twilio gives up on the webhook after 15 s; keep a margin for the reply
+WEBHOOK_DEADLINE_SECONDS = float(os.environ.get('WEBHOOK_DEADLINE_SECONDS', 12))
+
+# ============================================
+# 🚦 ADMISSION CONTROL
+# ============================================
+# In-flight thresholds matter under ASGI (gthread caps in-flight at the
+# thread count); queue delay needs the router's X-Request-Start header.
+# Fast path = no upstream budget: static screens and cached results only.
+def observe_admission(decision, in_flight):
+    metrics.ADMISSIONS.inc(decision=decision)
+
+admission = AdmissionController(
+    fast_path_at=int(os.environ.get('ADMISSION_FAST_PATH_AT', 200)),
+    shed_at=int(os.environ.get('ADMISSION_SHED_AT', 500)),
+    queue_fast_path_ms=float(os.environ.get('ADMISSION_QUEUE_FAST_PATH_MS', 3000)),
+    queue_shed_ms=float(os.environ.get('ADMISSION_QUEUE_SHED_MS', 8000)),
+    observer=observe_admission
+)
+
+def build_shed_twiml():
+    """Canned reply for shed requests, rendered once"""
+    resp = MessagingResponse()
+    resp.message("⏳ Έχουμε πολύ μεγάλη κίνηση αυτή τη στιγμή. Στείλε ξανά το μήνυμά σου σε 1-2 λεπτά 🙏")
+    return str(resp)
+
+SHED_TWIML = build_shed_twiml()
+
 @app.route("/webhook", methods=['POST'])
 def webhook():
     """Handle incoming WhatsApp messages"""
+    queued_ms = queue_delay_ms(request.headers.get('X-Request-Start'))
+    if queued_ms is not None:
+        metrics.QUEUE_SECONDS.observe(queued_ms / 1000)
+    with metrics.WEBHOOK_SECONDS.time(), admission.admit(queued_ms) as decision:
+        if decision == SHED:
+            return SHED_TWIML
+        budget = 0 if decision == FAST_PATH else WEBHOOK_DEADLINE_SECONDS
+        with profiler.request(), deadline.scope(budget):
+            tracer.begin(path='/webhook', admission=decision)
+            try:
+                return handle_webhook()
+            finally:
+                tracer.finish()
+
+def handle_webhook():
+    """Build the TwiML reply for one incoming message"""
     try:
         incoming_msg = request.values.get('Body', '').strip()
         from_number = request.values.get('From', '')
 
-        logger.info(f"📱 Received from {from_number}: {incoming_msg}")
+        logger.info("📱 Received from %s (%d chars)", from_number, len(incoming_msg),
+                    extra={'sampled': True, 'phone': from_number})
+        logger.debug("📱 Message body from %s: %s", from_number, incoming_msg)
 
         resp = MessagingResponse()
         msg = resp.message()
@@ -466,9 +599,18 @@ def webhook():
         
         if from_number not in sessions:
             sessions[from_number] = {'state': 'welcome'}
+        live_config.check()
+        promo_engine.check()
+        state_snapshots.start()
         session = sessions[from_number]
+        state_before = session.get('state', 'unknown')
+        count_visit(session)
+        profiler.tag(state_before)
+        tracer.annotate(**{'from': from_number, 'message_chars': len(incoming_msg),
+                           'state_before': session.get('state', 'unknown'), 'ai_mode': bool(session.get('ai_mode'))})
         
-        logger.info(f"📊 Session state: {session.get('state', 'unknown')}")
+        logger.info("📊 Session state: %s", session.get('state', 'unknown'),
+                    extra={'sampled': True, 'phone': from_number})
 
         try:
             if session.get('ai_mode') and claude_client:
@@ -476,11 +618,15 @@ def webhook():
             else:
                 response_text = route_message(incoming_msg, customer, session)
         except Exception as handler_error:
-            logger.error(f"❌ Handler error: {handler_error}", exc_info=True)
+            logger.error("❌ Handler error: %s", handler_error, exc_info=True)
             response_text = "Σφάλμα. Γράψε 'menu' για αρχικό μενού."
             session['state'] = 'menu'
 
         customer['last_interaction'] = datetime.now().isoformat()
+        tracer.annotate(state_after=session.get('state', 'unknown'))
+        record_event(eventlog.TRANSITION, customer, **{'from': state_before, 'to': session.get('state', 'unknown'),
+                                                       'ai': bool(session.get('ai_mode'))})
+        count_transition(state_before, session.get('state', 'unknown'))
         
         # Ensure response is not empty
         if not response_text or len(response_text.strip()) == 0:
@@ -488,77 +634,55 @@ def webhook():
             logger.warning("⚠️ Empty response detected, sending fallback")
         
         msg.body(response_text)
-        logger.info(f"📤 Sending ({len(response_text)} chars): {response_text[:80]}...")
+        logger.info("📤 Sending %d chars", len(response_text), extra={'sampled': True, 'phone': from_number})
+        logger.debug("📤 Reply to %s: %.80s...", from_number, response_text)
         return str(resp)
     
     except Exception as e:
-        logger.error(f"❌ Webhook error: {e}", exc_info=True)
+        logger.error("❌ Webhook error: %s", e, exc_info=True)
         resp = MessagingResponse()
         resp.message("Σφάλμα. Γράψε 'menu'.")
         return str(resp)
 
 def route_message(msg, customer, session):
     """Route message to appropriate handler"""
-    state = session.get('state', 'welcome')
-    msg_lower = msg.lower()
-    
-    # Global commands
-    if msg_lower in ['menu', 'μενού', 'αρχή', 'start', '0']:
-        session['state'] = 'menu'
-        session['ai_mode'] = False
-        return get_main_menu(customer)
-    
-    if msg_lower in ['help', 'βοήθεια', '?']:
-        return get_help_message()
-    
-    if msg_lower in ['καταστήματα', 'stores', 'αλλαγή καταστήματος']:
-        session['state'] = 'store_selection'
-        return get_store_selection_menu()
-    
-    if msg_lower in ['franchise', 'franchising', 'δικαιόχρηση']:
-        return get_franchise_menu()
-    
-    if msg_lower in ['wholesale', 'χονδρική', 'b2b', 'επαγγελματίες']:
-        session['state'] = 'wholesale'
-        return get_wholesale_menu()
-    
-    if msg_lower in ['θέση', 'location', 'διεύθυνση', 'χάρτης', 'map']:
-        return get_location_message(customer)
-    
-    if msg_lower in ['ai', 'claude', 'chat']:
-        if claude_client:
-            session['ai_mode'] = True
-            session['ai_history'] = []
-            return "🤖 AI Βοηθός ενεργοποιήθηκε!\n\nΡώτα με οτιδήποτε για πάνες, προϊόντα, τιμές!\n\n(Γράψε 'menu' για έξοδο)"
-        return "⚠️ Το AI δεν είναι διαθέσιμο αυτή τη στιγμή.\n\nΠαρακαλώ δοκιμάστε αργότερα ή γράψτε 'menu' για το μενού."
-
-    handlers = {
-        'welcome': handle_welcome,
-        'menu': handle_menu,
-        'search': handle_search,
-        'product_list': handle_product_selection,
-        'product_choice': handle_product_choice,
-        'categories': handle_categories,
-        'promos': handle_promos_menu,
-        'subscription': handle_subscription,
-        'subscription_product': handle_subscription_product,
-        'subscription_frequency': handle_subscription_frequency,
-        'subscription_day': handle_subscription_day,
-        'subscription_confirm': handle_subscription_confirm,
-        'my_account': handle_my_account,
-        'customer_service': handle_customer_service,
-        'complaint_form': handle_complaint_form,
-        'product_request': handle_product_request,
-        'feedback': handle_feedback,
-        'store_selection': handle_store_selection,
-        'franchise': handle_franchise,
-        'wholesale': handle_wholesale,
-        'wholesale_inquiry': handle_wholesale_inquiry,
-        'wholesale_phone': handle_wholesale_phone,
-    }
-    
-    handler = handlers.get(state, handle_welcome)
-    return handler(msg, customer, session)
+    return conversation.dispatch(msg, customer, session)
+
+# ============================================
+# GLOBAL COMMANDS
+# ============================================
+def command_menu(msg, customer, session):
+    """'menu' from anywhere"""
+    session['ai_mode'] = False
+    return get_main_menu(customer)
+
+def command_help(msg, customer, session):
+    """'help' from anywhere"""
+    return get_help_message()
+
+def command_stores(msg, customer, session):
+    """'καταστήματα' from anywhere"""
+    return get_store_selection_menu()
+
+def command_franchise(msg, customer, session):
+    """'franchise' from anywhere"""
+    return get_franchise_menu()
+
+def command_wholesale(msg, customer, session):
+    """'wholesale' from anywhere"""
+    return get_wholesale_menu()
+
+def command_location(msg, customer, session):
+    """'location' from anywhere"""
+    return get_location_message(customer)
+
+def command_ai(msg, customer, session):
+    """'ai' from anywhere"""
+    if claude_client:
+        session['ai_mode'] = True
+        session['ai_history'] = []
+        return "🤖 AI Βοηθός ενεργοποιήθηκε!\n\nΡώτα με οτιδήποτε για πάνες, προϊόντα, τιμές!\n\n(Γράψε 'menu' για έξοδο)"
+    return "⚠️ Το AI δεν είναι διαθέσιμο αυτή τη στιγμή.\n\nΠαρακαλώ δοκιμάστε αργότερα ή γράψτε 'menu' για το μενού."
 
 # ============================================
 # CUSTOMER MANAGEMENT
@@ -586,6 +710,12 @@ def get_customer_store(customer):
     store_id = customer.get('selected_store', DEFAULT_STORE)
     return STORES.get(store_id, STORES[DEFAULT_STORE])
 
+def get_customer_segment(customer):
+    """Get customer segment used for cached screens"""
+    if customer and customer.get('is_business', False):
+        return 'business'
+    return 'retail'
+
 def get_customer_greeting(customer):
     """Get personalized greeting"""
     name = customer.get('name')
@@ -605,8 +735,23 @@ def get_customer_greeting(customer):
 # ============================================
 # 🏪 STORE SELECTION
 # ============================================
+def build_store_names(stores):
+    """Build the store name lexicon (ids, short and full names)"""
+    names = Lexicon()
+    for store_id, store in stores.items():
+        names.add(store_id, store_id)
+        names.add(store['short_name'], store_id)
+        names.add(store['name'], store_id)
+    return names
+
+store_names = build_store_names(STORES)
+
 def get_store_selection_menu():
     """Get store selection menu"""
+    return screens.render('store_selection')
+
+def render_store_selection_menu():
+    """Render store selection menu"""
     text = """🏪 ΕΠΙΛΕΞΕ ΚΑΤΑΣΤΗΜΑ
 
 """
@@ -616,48 +761,50 @@ def get_store_selection_menu():
         drive = " 🚗" if store.get('drive_through') else ""
         text += f"{i}️⃣ {store['short_name']}{drive}\n"
     
-    text += """
+    text += f"""
 🚗 = Drive-Through διαθέσιμο
 
-Επίλεξε 1-6 (ή 'menu')"""
+Επίλεξε 1-{len(store_list)} (ή 'menu')"""
     return text
 
 def handle_store_selection(msg, customer, session):
     """Handle store selection"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-    
     store_list = list(STORES.keys())
     
     try:
         index = int(msg) - 1
-        if 0 <= index < len(store_list):
-            store_id = store_list[index]
-            customer['selected_store'] = store_id
-            store = STORES[store_id]
-            
-            session['state'] = 'menu'
-            
-            drive_text = "\n🚗 Drive-Through διαθέσιμο!" if store.get('drive_through') else ""
-            
-            return f"""✅ ΕΠΙΛΕΧΘΗΚΕ!
+        store_id = store_list[index] if 0 <= index < len(store_list) else None
+    except ValueError:
+        # Store names, with or without accents, in Greeklish or misspelled
+        store_id = store_names.lookup(msg)
+    
+    if store_id:
+        customer['selected_store'] = store_id
+        store = STORES[store_id]
+        
+        session['state'] = 'menu'
+        
+        drive_text = "\n🚗 Drive-Through διαθέσιμο!" if store.get('drive_through') else ""
+        
+        return f"""✅ ΕΠΙΛΕΧΘΗΚΕ!
 
 🏪 {store['name']}
 📍 {store['address']}
 {drive_text}
 
 Γράψε 'menu' για να συνεχίσεις!"""
-    except ValueError:
-        pass
     
-    return "Επίλεξε 1-6 (ή 'menu')"
+    return f"Επίλεξε 1-{len(store_list)} (ή 'menu')"
 
 # ============================================
 # 🏢 FRANCHISE
 # ============================================
 def get_franchise_menu():
     """Get franchise information"""
+    return screens.render('franchise')
+
+def render_franchise_menu():
+    """Render franchise information"""
     benefits = "\n".join([f"✅ {b}" for b in FRANCHISE_INFO['benefits']])
     
     return f"""🏢 FRANCHISE CARESTORES
@@ -683,10 +830,6 @@ def get_franchise_menu():
 
 def handle_franchise(msg, customer, session):
     """Handle franchise lead capture"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-    
     step = session.get('franchise_step', 'intro')
     
     if step == 'intro':
@@ -721,7 +864,7 @@ def handle_franchise(msg, customer, session):
         customer_phone = customer.get('phone', 'N/A')
         
         # Log the lead
-        logger.info(f"🏢 FRANCHISE LEAD: {name} - {phone} - {email} - {customer_phone}")
+        logger.info("🏢 FRANCHISE LEAD: %s - %s - %s - %s", name, phone, email, customer_phone)
         
         # Send email
         email_subject = f"🏢 Νέο Ενδιαφέρον Franchise - {name}"
@@ -766,6 +909,10 @@ def handle_franchise(msg, customer, session):
 # ============================================
 def get_wholesale_menu():
     """Get wholesale/B2B menu"""
+    return screens.render('wholesale')
+
+def render_wholesale_menu():
+    """Render wholesale/B2B menu"""
     return f"""🏭 ΧΟΝΔΡΙΚΗ / B2B
 
 Είστε επαγγελματίας;
@@ -792,18 +939,15 @@ def get_wholesale_menu():
 ━━━━━━━━━━━━━━━━━━━━
 
 7️⃣ 📦 ΔΕΣ ΠΡΟΪΟΝΤΑ B2B
+8️⃣ 📋 ΜΑΖΙΚΗ ΠΡΟΣΦΟΡΑ (λίστα κωδικών)
 
 🌐 {WHOLESALE_INFO['website']}
 🏢 {WHOLESALE_INFO['b2b_portal']}
 
-Επίλεξε 1-7 (ή 'menu')"""
+Επίλεξε 1-8 (ή 'menu')"""
 
 def handle_wholesale(msg, customer, session):
     """Handle wholesale menu"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-    
     # Option 7: View B2B products
     if msg == '7':
         # Mark customer as business to see B2B prices
@@ -815,6 +959,12 @@ def handle_wholesale(msg, customer, session):
             return format_b2b_product_list(products, "🏭 ΠΡΟΪΟΝΤΑ B2B")
         return "Δεν βρέθηκαν B2B προϊόντα.\n\n(Πληκτρολόγησε 'menu')"
     
+    # Option 8: bulk quote from a pasted list
+    if msg == '8':
+        customer['is_business'] = True
+        session['state'] = 'wholesale_quote'
+        return BULK_QUOTE_PROMPT
+    
     business_types = {
         '1': {'type': 'daycare', 'name': 'Παιδικός Σταθμός'},
         '2': {'type': 'nursing_home', 'name': 'Γηροκομείο'},
@@ -867,12 +1017,136 @@ def handle_wholesale(msg, customer, session):
     
     return get_wholesale_menu()
 
+BULK_QUOTE_PROMPT = """📋 ΜΑΖΙΚΗ ΠΡΟΣΦΟΡΑ B2B
+
+Στείλτε σε ΕΝΑ μήνυμα τη λίστα σας,
+ένα προϊόν ανά γραμμή (κωδικός ή όνομα):
+
+SKU123 x 10
+Pampers Premium Care Jumbo 4 x 6
+20 x Kera Bed XL
+
+(ή 'menu')"""
+
+# WhatsApp caps a message at 1600 characters; item lines get this much of it
+QUOTE_LINES_BUDGET = 1000
+
+def build_bulk_quote(items):
+    """Resolve pasted (query, quantity) items and price them at B2B rates.
+
+    SKU-looking queries are fetched in one WooCommerce call; the rest (and
+    SKUs it did not know) are matched by name against the B2B catalog.
+    """
+    skus = sorted({query for query, _ in items if looks_like_sku(query)})
+    by_sku = {}
+    if skus:
+        for product in get_products_by_sku(skus):
+            if product.get('sku'):
+                by_sku[product['sku'].lower()] = product
+
+    matcher = None
+    resolved, unresolved = [], []
+    for query, quantity in items:
+        product = by_sku.get(query.lower())
+        if product is None:
+            if matcher is None:
+                matcher = NameMatcher(get_b2b_products())
+            product = matcher.match(query)
+        if product is None:
+            unresolved.append(query)
+        else:
+            resolved.append((product, quantity))
+
+    return build_quote(resolved, unresolved, price_table.get,
+                       WHOLESALE_INFO['min_order_free_shipping'], WHOLESALE_INFO['shipping_cost'])
+
+def format_quote_line(i, line):
+    marker = "" if line.discounted else " ⚠️"
+    return (f"{i}. {line.product.get('name', 'N/A')}{marker}\n"
+            f"   {line.quantity} × {format_price(line.unit_price)}€ = {format_price(line.total)}€\n")
+
+def format_bulk_quote(quote, emailed):
+    """One-reply summary of a bulk quote, trimmed to fit a WhatsApp message"""
+    if not quote.lines:
+        return "❓ Δεν βρέθηκε κανένα προϊόν από τη λίστα.\n\nΔοκιμάστε κωδικούς (SKU) ή ονόματα προϊόντων.\n\n(ή 'menu')"
+
+    parts = ["📋 ΠΡΟΣΦΟΡΑ B2B (-20%)\n\n"]
+    used = len(parts[0])
+    for i, line in enumerate(quote.lines, 1):
+        text = format_quote_line(i, line)
+        if used + len(text) > QUOTE_LINES_BUDGET and i < len(quote.lines):
+            parts.append(f"… και {len(quote.lines) - i + 1} ακόμα (πλήρης λίστα στο email)\n")
+            break
+        parts.append(text)
+        used += len(text)
+
+    parts.append("━━━━━━━━━━━━━━━━━━━━\n")
+    parts.append(f"Προϊόντα: {format_price(quote.subtotal)}€\n")
+    if quote.shipping:
+        parts.append(f"🚚 Μεταφορικά: {format_price(quote.shipping)}€ "
+                     f"(ΔΩΡΕΑΝ από {format_price(quote.free_shipping_at)}€, "
+                     f"λείπουν {format_price(quote.missing_for_free_shipping)}€)\n")
+    else:
+        parts.append("🚚 Μεταφορικά: ΔΩΡΕΑΝ\n")
+    parts.append(f"💶 ΣΥΝΟΛΟ: {format_price(quote.total)}€\n")
+    if any(not line.discounted for line in quote.lines):
+        parts.append("⚠️ = σταθερή τιμή, χωρίς έκπτωση\n")
+
+    if quote.unresolved:
+        names = ", ".join(quote.unresolved[:10])
+        more = f" (+{len(quote.unresolved) - 10})" if len(quote.unresolved) > 10 else ""
+        parts.append(f"\n❓ Δεν βρέθηκαν: {names}{more}\n")
+
+    parts.append("\n📧 Η προσφορά στάλθηκε στην ομάδα χονδρικής.\n" if emailed else "\n📧 Η προσφορά έχει ήδη σταλεί.\n")
+    parts.append("Στείλτε νέα λίστα ή 'menu'")
+    return "".join(parts)
+
+def email_bulk_quote(quote, customer):
+    """Send the full quote to the wholesale team"""
+    rows = "".join(
+        f"<tr><td>{line.product.get('sku', '')}</td><td>{line.product.get('name', 'N/A')}</td>"
+        f"<td>{line.quantity}</td><td>{format_price(line.unit_price)}€{'' if line.discounted else ' (σταθερή)'}</td>"
+        f"<td>{format_price(line.total)}€</td></tr>"
+        for line in quote.lines)
+    unresolved = "".join(f"<li>{query}</li>" for query in quote.unresolved)
+    email_html = f"""
+        <h2>📋 Μαζική Προσφορά B2B</h2>
+        <hr>
+        <p><strong>Τύπος Επιχείρησης:</strong> {customer.get('business_type', 'N/A')}</p>
+        <p><strong>WhatsApp:</strong> {customer.get('phone', 'N/A')}</p>
+        <table border="1" cellpadding="4">
+        <tr><th>SKU</th><th>Προϊόν</th><th>Ποσότητα</th><th>Τιμή</th><th>Σύνολο</th></tr>
+        {rows}
+        </table>
+        <p><strong>Προϊόντα:</strong> {format_price(quote.subtotal)}€</p>
+        <p><strong>Μεταφορικά:</strong> {format_price(quote.shipping)}€</p>
+        <p><strong>Σύνολο:</strong> {format_price(quote.total)}€</p>
+        {f"<p><strong>Δεν βρέθηκαν:</strong></p><ul>{unresolved}</ul>" if unresolved else ""}
+        <p><strong>Ημερομηνία:</strong> {datetime.now().strftime("%d/%m/%Y %H:%M")}</p>
+        """
+    send_email([EMAIL_CONFIG['store_emails']['support']],
+               f"📋 Μαζική Προσφορά B2B - {format_price(quote.total)}€", email_html)
+
+def handle_wholesale_quote(msg, customer, session):
+    """Handle a pasted bulk-quote list: one lookup, one reply, one email"""
+    items = parse_lines(msg)
+    if not items:
+        return BULK_QUOTE_PROMPT
+
+    quote = build_bulk_quote(items)
+    logger.info("📋 B2B QUOTE: %d items, %d unresolved, %s€ - %s", len(quote.lines), len(quote.unresolved),
+                format_price(quote.total), customer.get('phone', 'N/A'))
+
+    # Re-sending the same list must not email the team twice
+    digest = hashlib.md5(repr(sorted(items)).encode()).hexdigest()
+    emailed = bool(quote.lines) and session.get('last_quote') != digest
+    if emailed:
+        email_bulk_quote(quote, customer)
+        session['last_quote'] = digest
+    return format_bulk_quote(quote, emailed)
+
 def handle_wholesale_inquiry(msg, customer, session):
     """Handle wholesale inquiry"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-    
     if msg == '1':
         session['state'] = 'wholesale_phone'
         return """📞 Στείλτε τηλέφωνο ή email:
@@ -905,7 +1179,7 @@ def handle_wholesale_inquiry(msg, customer, session):
         biz = session.get('business_info', {})
         customer_phone = customer.get('phone', 'N/A')
         
-        logger.info(f"🏭 B2B LEAD: {biz.get('name')} - {msg} - {customer_phone}")
+        logger.info("🏭 B2B LEAD: %s - %s - %s", biz.get('name'), msg, customer_phone)
         
         # Send email notification
         email_subject = f"🏭 Νέο B2B Lead - {biz.get('name', 'Επαγγελματίας')}"
@@ -939,10 +1213,6 @@ def handle_wholesale_inquiry(msg, customer, session):
 
 def handle_wholesale_phone(msg, customer, session):
     """Handle B2B phone/email capture"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-    
     # Clean input
     contact = msg.strip()
     biz = session.get('business_info', {})
@@ -960,7 +1230,7 @@ def handle_wholesale_phone(msg, customer, session):
         customer_phone = customer.get('phone', 'N/A')
         
         # LOG THE B2B LEAD
-        logger.info(f"🏭 B2B LEAD: {business_name} - {contact} - {customer_phone}")
+        logger.info("🏭 B2B LEAD: %s - %s - %s", business_name, contact, customer_phone)
         
         # Save to customer profile
         customer['b2b_contact'] = contact
@@ -1014,8 +1284,13 @@ def handle_wholesale_phone(msg, customer, session):
 # ============================================
 def get_main_menu(customer):
     """Get personalized main menu"""
-    greeting = get_customer_greeting(customer)
     store = get_customer_store(customer)
+    return screens.render('main_menu', store_id=store['id'], greeting=get_customer_greeting(customer))
+
+def render_main_menu(store_id):
+    """Render main menu for a store (greeting is a slot)"""
+    store = STORES[store_id]
+    greeting = slot('greeting')
     
     store_text = f"📍 {store['short_name']}"
     if store.get('drive_through'):
@@ -1054,7 +1329,7 @@ def handle_menu(msg, customer, session):
         if products:
             session['state'] = 'product_list'
             session['products'] = products
-            return format_product_list(products, "🔥 Δημοφιλή", check_promo=True)
+            return format_product_list(products, "🔥 Δημοφιλή")
         return "Σφάλμα!"
 
     elif msg == '3':
@@ -1101,6 +1376,11 @@ def handle_menu(msg, customer, session):
 def get_location_message(customer):
     """Get store location"""
     store = get_customer_store(customer)
+    return screens.render('location', store_id=store['id'])
+
+def render_location_message(store_id):
+    """Render store location"""
+    store = STORES[store_id]
     
     drive_text = "\n🚗 DRIVE-THROUGH διαθέσιμο!" if store.get('drive_through') else ""
     parking_text = f"\n🅿️ {store['parking']}" if store.get('parking') else ""
@@ -1151,7 +1431,7 @@ STORES: Χαλάνδρι, Αμπελόκηποι, Γέρακας, Χολαργό
 
 PRODUCTS: Baby diapers, Adult incontinence, Pet products, Baby formula (Humana, NAN - NO DISCOUNTS), Wipes, Sudocrem, Vitamins (Solgar - NO DISCOUNTS)
 
-PROMOS: Pampers Jumbo = FREE wipes, EasyPants 30pcs = 3€ cashback
+PROMOS: {'; '.join(promo.name for promo in promo_engine.active()) or 'none right now'}
 
 B2B/WHOLESALE: For daycares, nursing homes, churches, KAPI - 15-30% discounts
 Website: easycaremarket.gr, b2b.easycaremarket.gr
@@ -1167,20 +1447,36 @@ RULES: Answer in Greek, be concise, mention promos when relevant, NEVER suggest
         session['ai_history'].append({"role": "user", "content": msg})
         history = session['ai_history'][-10:]
         
-        response = claude_client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=400,
-            system=f"You are a WhatsApp assistant for CARESTORES. Respond in Greek. Be friendly and concise.\n\n{context}",
-            messages=history
-        )
-        
+        ai_started = time.perf_counter()
+        with metrics.upstream('claude', 'messages.create', model="claude-sonnet-4-20250514") as span:
+            response = claude_client.messages.create(
+                model="claude-sonnet-4-20250514",
+                max_tokens=400,
+                system=f"You are a WhatsApp assistant for CARESTORES. Respond in Greek. Be friendly and concise.\n\n{context}",
+                messages=history,
+                timeout=deadline.timeout(60)
+            )
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                span['input_tokens'] = getattr(usage, 'input_tokens', None)
+                span['output_tokens'] = getattr(usage, 'output_tokens', None)
+        
+        record_event(eventlog.AI_CALL, customer, ok=True, ms=round((time.perf_counter() - ai_started) * 1000),
+                     tokens_in=span.get('input_tokens'), tokens_out=span.get('output_tokens'))
         ai_response = response.content[0].text
         session['ai_history'].append({"role": "assistant", "content": ai_response})
         
         return f"🤖 {ai_response}\n\n('menu')"
         
     except Exception as e:
-        logger.error(f"AI error: {e}")
+        record_event(eventlog.AI_CALL, customer, ok=False, error=type(e).__name__)
+        if deadline.is_timeout(e):
+            # Stay in AI mode; drop the question so a resend isn't duplicated
+            degrade('handle_ai_conversation', 'try_again')
+            if session.get('ai_history') and session['ai_history'][-1]['role'] == 'user':
+                session['ai_history'].pop()
+            return "🤖 Ο βοηθός αργεί να απαντήσει. Στείλε ξανά την ερώτησή σου ή γράψε 'menu'."
+        logger.error("AI error: %s", e)
         session['ai_mode'] = False
         return "Σφάλμα AI. Γράψε 'menu'."
 
@@ -1189,33 +1485,23 @@ RULES: Answer in Greek, be concise, mention promos when relevant, NEVER suggest
 # ============================================
 def get_categories_menu():
     """Get categories menu"""
-    return """📦 ΚΑΤΗΓΟΡΙΕΣ
-
-1️⃣ 👶 Βρεφικές Πάνες
-2️⃣ 👴 Πάνες Ενηλίκων
-3️⃣ 🐕 Pet Πάνες & Τροφές
-4️⃣ 🍼 Βρεφικό Γάλα ⚠️
-5️⃣ 🧻 Χαρτικά
-6️⃣ 🧼 Απορρυπαντικά
-7️⃣ 💊 Βιταμίνες ⚠️
-8️⃣ 🧽 Μαντηλάκια
-9️⃣ 🩹 Sudocrem & Φροντίδα
-🔟 🛏️ Υποσέντονα
+    return screens.render('categories')
 
-⚠️ = Χωρίς εκπτώσεις
+NUMBER_EMOJIS = ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣', '8️⃣', '9️⃣', '🔟']
 
-Επίλεξε 1-10"""
+def render_categories_menu():
+    """Render categories menu (⚠️ marks categories without discounts)"""
+    lines = []
+    for key, category in CATEGORIES.items():
+        number = NUMBER_EMOJIS[int(key) - 1] if int(key) <= len(NUMBER_EMOJIS) else f"{key}."
+        warning = ' ⚠️' if category.get('no_discount') else ''
+        lines.append(f"{number} {category['name']}{warning}")
+    return "📦 ΚΑΤΗΓΟΡΙΕΣ\n\n" + "\n".join(lines) + f"\n\n⚠️ = Χωρίς εκπτώσεις\n\nΕπίλεξε 1-{len(CATEGORIES)}"
 
 def handle_categories(msg, customer, session):
     """Handle category selection"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-
-    cat_map = {'1': '1', '2': '2', '3': '3', '4': '4', '5': '5', '6': '6', '7': '7', '8': '8', '9': '9', '10': '10'}
-    
-    if msg in cat_map and cat_map[msg] in CATEGORIES:
-        category = CATEGORIES[cat_map[msg]]
+    if msg in CATEGORIES:
+        category = CATEGORIES[msg]
         products = search_products(category['search'])
         
         if products:
@@ -1224,35 +1510,28 @@ def handle_categories(msg, customer, session):
             session['current_category'] = category
             
             no_discount = category.get('no_discount', False)
-            return format_product_list(products, f"📦 {category['name']}", check_promo=True, no_discount_category=no_discount)
+            return format_product_list(products, f"📦 {category['name']}", no_discount_category=no_discount)
         return "Δεν βρέθηκαν προϊόντα."
 
-    return "Επίλεξε 1-10"
+    return f"Επίλεξε 1-{len(CATEGORIES)}"
 
 # ============================================
 # SEARCH
 # ============================================
 def handle_search(msg, customer, session):
     """Handle product search"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-
     products = search_products(msg)
+    record_event(eventlog.SEARCH, customer, q=msg[:100], n=len(products))
 
     if products:
         session['state'] = 'product_list'
         session['products'] = products
-        return format_product_list(products, f"🔍 '{msg}'", check_promo=True)
+        return format_product_list(products, f"🔍 '{msg}'")
 
     return f"Δεν βρέθηκαν για '{msg}'\n\nΔοκίμασε: pampers, humana, kera\n\nΓράψε 'menu'"
 
 def handle_product_selection(msg, customer, session):
     """Handle product selection"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-
     if msg.lower() in ['more', 'περισσότερα']:
         page = session.get('current_page', 1) + 1
         session['current_page'] = page
@@ -1269,6 +1548,8 @@ def handle_product_selection(msg, customer, session):
         if 0 <= adjusted_index < len(products):
             product = products[adjusted_index]
             session['selected_product'] = product
+            record_event(eventlog.PRODUCT_VIEW, customer, p=product.get('id'),
+                         flow='subscription' if session.get('after_product') else 'shop')
             
             # If coming from subscription flow, go directly to frequency
             if session.get('after_product') == 'subscription_frequency':
@@ -1288,19 +1569,118 @@ def handle_product_selection(msg, customer, session):
     except ValueError:
         return "Στείλε αριθμό!"
 
-def generate_order_id():
-    """Generate unique order ID"""
-    import random
-    timestamp = datetime.now().strftime("%H%M")
-    random_part = random.randint(100, 999)
-    return f"DT-{timestamp}-{random_part}"
+# ============================================
+# 📒 INTERACTION EVENT LOG
+# ============================================
+# Analytics trail (see eventlog.py for the format and the report CLI)
+event_log = eventlog.open_event_log()
+
+def record_event(kind, customer=None, **fields):
+    """Log one interaction for the customer (pseudonymous id + selected store)"""
+    if customer is None:
+        event_log.record(kind, **fields)
+        return
+    event_log.record(kind, user=eventlog.user_key(customer.get('phone')),
+                     store=customer.get('selected_store', DEFAULT_STORE), **fields)
+
+# ============================================
+# 📈 LIVE FUNNEL
+# ============================================
+# Rolling per-minute counts; workers share them through FUNNEL_DIR
+funnel = FunnelCounters(
+    window=int(os.environ.get('FUNNEL_WINDOW_MINUTES', 60)),
+    directory=os.environ.get('FUNNEL_DIR') or os.path.join(tempfile.gettempdir(), 'carestores-funnel'),
+    publish_every=float(os.environ.get('FUNNEL_PUBLISH_SECONDS', 10)),
+)
+
+# State entered -> funnel stage (browsing by category, search or promos counts as 'category').
+# The 'menu' stage is the start of a visit (first message, or the first after
+# FUNNEL_VISIT_GAP idle, as in the event-log report), not every return to the menu.
+FUNNEL_VISIT_GAP = 30 * 60
+FUNNEL_STATES = {
+    'categories': 'category',
+    'search': 'category',
+    'promos': 'category',
+    'product_choice': 'product',
+}
+
+def funnel_step(stage):
+    funnel.step(stage)
+    metrics.FUNNEL_STEPS.inc(stage=stage)
+
+def count_visit(session):
+    """Count the 'menu' stage if this message starts a visit; stamps the session"""
+    now = time.time()
+    last = session.get('funnel_seen')
+    session['funnel_seen'] = now
+    if last is None or now - last > FUNNEL_VISIT_GAP:
+        funnel_step('menu')
+
+def count_transition(old, new):
+    """Update the funnel for one session['state'] change"""
+    if old == new:
+        return
+    funnel.transition(old, new)
+    stage = FUNNEL_STATES.get(new)
+    if new == 'subscription_frequency' and old == 'product_list':
+        # Picking from a subscription list skips the product view
+        stage = 'product'
+    if stage is not None:
+        funnel_step(stage)
+
+# ============================================
+# 📡 STAFF LIVE FEED
+# ============================================
+# Orders, reservations and subscriptions are pushed to the store's dashboard
+# over Server-Sent Events as they happen; the emails stay as the record.
+# Open streams (and FEED_MAX_SUBSCRIBERS) are for ASGI; under gthread the
+# dashboard polls every FEED_POLL_SECONDS instead of holding a thread.
+def feed_snapshot(store_id):
+    """What a dashboard reloads on a reset event: the store's held reservations"""
+    return {'pending': [r.to_dict() for r in reservations.for_store(store_id)]}
+
+feed_hub = FeedHub(
+    replay=int(os.environ.get('FEED_REPLAY', 200)),
+    heartbeat=float(os.environ.get('FEED_HEARTBEAT_SECONDS', 15)),
+    max_subscribers=int(os.environ.get('FEED_MAX_SUBSCRIBERS', 50)),
+    poll_retry=float(os.environ.get('FEED_POLL_SECONDS', 5)),
+    snapshot=feed_snapshot,
+)
+
+def feed_token(store_id):
+    """Per-store dashboard token, derived from API_SECRET_KEY (None without one)"""
+    secret = getattr(config, 'API_SECRET_KEY', None)
+    if not secret:
+        return None
+    return hmac.new(secret.encode(), f"feed:{store_id}".encode(), hashlib.sha256).hexdigest()[:32]
+
+def feed_authorized(store_id):
+    """Store staff with the store's token, or an admin request"""
+    expected = feed_token(store_id)
+    token = request.args.get('token', '')
+    return is_admin_request() or (expected is not None and hmac.compare_digest(token, expected))
+
+def publish_order_event(store_id, kind, data):
+    try:
+        feed_hub.publish(store_id, kind, data)
+    except Exception as e:
+        logger.error("❌ Feed publish failed: %s", e)
+
+# ============================================
+# 🚗 DRIVE-THROUGH RESERVATIONS
+# ============================================
+DRIVE_THROUGH_HOLD = timedelta(hours=3)
+
+def observe_reservation(reservation):
+    """Reservation status change (expired by the sweeper, collected, cancelled)"""
+    metrics.RESERVATIONS.inc(status=reservation.status)
+    publish_order_event(reservation.store_id, 'reservation', reservation.to_dict())
+
+order_ids = OrderIdAllocator('DT')
+reservations = ReservationRegistry(order_ids, path=os.environ.get('RESERVATIONS_DB'), on_change=observe_reservation)
 
 def handle_product_choice(msg, customer, session):
     """Handle product purchase choice (one-off vs subscription vs drive-through)"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-    
     product = session.get('selected_product')
     if not product:
         session['state'] = 'menu'
@@ -1308,14 +1688,14 @@ def handle_product_choice(msg, customer, session):
     
     store = get_customer_store(customer)
     name = product.get('name', 'N/A')
-    price = product.get('price', '0')
+    price = format_price(price_table.get(product).retail, '0')
     
     if msg == '1':
         # One-off purchase - show store info for pickup
         customer_phone = customer.get('phone', 'N/A')
         
         # Log order
-        logger.info(f"🛒 ORDER: {name} - {price}€ - {customer_phone}")
+        logger.info("🛒 ORDER: %s - %s€ - %s", name, price, customer_phone)
         
         # Send email notification
         email_subject = f"🛒 Νέα Παραγγελία - {name}"
@@ -1333,6 +1713,11 @@ def handle_product_choice(msg, customer, session):
         
         store_email = EMAIL_CONFIG['store_emails'].get(store['id'], EMAIL_CONFIG['store_emails']['chalandri'])
         send_email([store_email, EMAIL_CONFIG['store_emails']['support']], email_subject, email_html)
+        queue_pickup_order(product, customer, store, 'pickup')
+        record_event(eventlog.ORDER, customer, via='pickup', p=product.get('id'), price=price)
+        funnel_step('purchase')
+        publish_order_event(store['id'], 'pickup', {
+            'product_id': product.get('id'), 'product_name': name, 'price': price, 'phone': customer_phone})
         
         session['state'] = 'menu'
         return f"""🛒 ΑΓΟΡΑ: {name}
@@ -1361,12 +1746,15 @@ def handle_product_choice(msg, customer, session):
     
     elif msg == '3' and store.get('drive_through'):
         # Drive-through reservation
-        order_id = generate_order_id()
-        expires = datetime.now() + timedelta(hours=3)
+        reservation = reservations.add(store['id'], customer['phone'], product.get('id'), name, price,
+                                       DRIVE_THROUGH_HOLD.total_seconds())
+        metrics.RESERVATIONS.inc(status=reservation.status)
+        order_id = reservation.order_id
+        expires = datetime.fromtimestamp(reservation.expires)
         expires_str = expires.strftime("%H:%M")
         
         # Log the reservation
-        logger.info(f"🚗 DRIVE-THROUGH ORDER: {order_id} - {name} - {price}€ - {customer['phone']}")
+        logger.info("🚗 DRIVE-THROUGH ORDER: %s - %s - %s€ - %s", order_id, name, price, customer['phone'])
         
         # Prepare email
         customer_phone = customer.get('phone', 'N/A')
@@ -1388,6 +1776,12 @@ def handle_product_choice(msg, customer, session):
         # Send emails
         store_email = EMAIL_CONFIG['store_emails'].get(store['id'], EMAIL_CONFIG['store_emails']['chalandri'])
         send_email([store_email, EMAIL_CONFIG['store_emails']['support']], email_subject, email_html)
+        reservation.order_key = queue_pickup_order(product, customer, store, 'drive_through',
+                                                   reference=order_id, expires=expires)
+        reservations.attach_order(order_id, reservation.order_key)
+        publish_order_event(store['id'], 'reservation', reservation.to_dict())
+        record_event(eventlog.ORDER, customer, via='drive_through', p=product.get('id'), price=price, id=order_id)
+        funnel_step('purchase')
         
         session['state'] = 'menu'
         return f"""✅ ΚΡΑΤΗΣΗ ΕΠΙΒΕΒΑΙΩΘΗΚΕ!
@@ -1420,68 +1814,79 @@ def handle_product_choice(msg, customer, session):
 # ============================================
 # PRODUCT FORMATTING
 # ============================================
+@metrics.timed_render
 def format_b2b_product_list(products, title):
     """Format B2B product list with 20% discount"""
     if not products:
         return "Δεν βρέθηκαν B2B προϊόντα 😔"
     
-    text = f"🏭 {title}\n"
-    text += f"━━━━━━━━━━━━━━━━━━━━\n"
-    text += f"💰 Έκπτωση: -20%\n"
-    text += f"🚚 ΔΩΡΕΑΝ μεταφορικά 350€+\n"
-    text += f"━━━━━━━━━━━━━━━━━━━━\n\n"
+    parts = [
+        f"🏭 {title}\n",
+        "━━━━━━━━━━━━━━━━━━━━\n",
+        "💰 Έκπτωση: -20%\n",
+        "🚚 ΔΩΡΕΑΝ μεταφορικά 350€+\n",
+        "━━━━━━━━━━━━━━━━━━━━\n\n",
+    ]
     
     for i, product in enumerate(products[:15], 1):
-        name = product.get('name', 'N/A')
-        retail_price = product.get('price', '0')
-        stock = product.get('stock_status', 'outofstock')
-        stock_emoji = "✅" if stock == "instock" else "❌"
-        
-        # Calculate B2B price (20% off)
-        b2b_price = get_b2b_price(product)
-        b2b_str = f"{b2b_price}€" if b2b_price else "N/A"
-        
-        text += f"{i}. {name}\n"
-        text += f"   💶 B2B: {b2b_str} (Λιανική: {retail_price}€) {stock_emoji}\n\n"
+        parts.append(f"{i}. ")
+        parts.append(fragments.get(product, 'b2b', render_b2b_fragment))
     
-    text += "━━━━━━━━━━━━━━━━━━━━\n"
-    text += "Αριθμό για λεπτομέρειες\n"
-    text += "('menu' | 'wholesale')"
+    parts.append("━━━━━━━━━━━━━━━━━━━━\n")
+    parts.append("Αριθμό για λεπτομέρειες\n")
+    parts.append("('menu' | 'wholesale')")
     
-    return text
+    return "".join(parts)
 
+def render_b2b_fragment(product):
+    """Render one product line of the B2B list"""
+    name = product.get('name', 'N/A')
+    retail_price = format_price(price_table.get(product).retail, '0')
+    stock = product.get('stock_status', 'outofstock')
+    stock_emoji = "✅" if stock == "instock" else "❌"
+    
+    b2b_price = get_b2b_price(product)
+    b2b_str = f"{b2b_price}€" if b2b_price else "N/A"
+    
+    return f"{name}\n   💶 B2B: {b2b_str} (Λιανική: {retail_price}€) {stock_emoji}\n\n"
+
+@metrics.timed_render
 def format_subscription_product_list(products, title):
     """Format subscription product list with 10% discount"""
     if not products:
         return "Δεν βρέθηκαν προϊόντα συνδρομής 😔"
     
-    text = f"🔄 {title}\n"
-    text += f"━━━━━━━━━━━━━━━━━━━━\n"
-    text += f"💰 Έκπτωση: -10% ΠΑΝΤΑ\n"
-    text += f"━━━━━━━━━━━━━━━━━━━━\n\n"
+    parts = [
+        f"🔄 {title}\n",
+        "━━━━━━━━━━━━━━━━━━━━\n",
+        "💰 Έκπτωση: -10% ΠΑΝΤΑ\n",
+        "━━━━━━━━━━━━━━━━━━━━\n\n",
+    ]
     
     for i, product in enumerate(products[:15], 1):
-        name = product.get('name', 'N/A')
-        try:
-            retail_price = float(product.get('price', '0'))
-            sub_price = round(retail_price * 0.90, 2)
-        except:
-            retail_price = 0
-            sub_price = 0
-        
-        stock = product.get('stock_status', 'outofstock')
-        stock_emoji = "✅" if stock == "instock" else "❌"
-        
-        text += f"{i}. {name}\n"
-        text += f"   🔄 Συνδρομή: {sub_price}€ (Λιαν: {retail_price}€) {stock_emoji}\n\n"
+        parts.append(f"{i}. ")
+        parts.append(fragments.get(product, 'subscription', render_subscription_fragment))
     
-    text += "━━━━━━━━━━━━━━━━━━━━\n"
-    text += "Αριθμό για επιλογή προϊόντος\n"
-    text += "('menu')"
+    parts.append("━━━━━━━━━━━━━━━━━━━━\n")
+    parts.append("Αριθμό για επιλογή προϊόντος\n")
+    parts.append("('menu')")
     
-    return text
+    return "".join(parts)
 
-def format_product_list(products, title, page=1, check_promo=False, no_discount_category=False):
+def render_subscription_fragment(product):
+    """Render one product line of the subscription list"""
+    name = product.get('name', 'N/A')
+    prices = price_table.get(product)
+    retail_price = format_price(prices.retail, '0')
+    sub_price = format_price(prices.subscription, '0')
+    
+    stock = product.get('stock_status', 'outofstock')
+    stock_emoji = "✅" if stock == "instock" else "❌"
+    
+    return f"{name}\n   🔄 Συνδρομή: {sub_price}€ (Λιαν: {retail_price}€) {stock_emoji}\n\n"
+
+@metrics.timed_render
+def format_product_list(products, title, page=1, no_discount_category=False):
     """Format product list"""
     if not products:
         return "Δεν βρέθηκαν 😔"
@@ -1494,104 +1899,114 @@ def format_product_list(products, title, page=1, check_promo=False, no_discount_
     if not page_products:
         return "Δεν υπάρχουν άλλα."
 
-    easypants_ids = ACTIVE_PROMOS.get('easypants_cashback', {}).get('product_ids', [])
-
-    text = f"📦 {title}\n"
+    parts = [f"📦 {title}\n"]
     if len(products) > per_page:
-        text += f"(Σελ. {page}/{(len(products)-1)//per_page + 1})\n"
+        parts.append(f"(Σελ. {page}/{(len(products)-1)//per_page + 1})\n")
     
     if no_discount_category:
-        text += "⚠️ Χωρίς εκπτώσεις\n"
+        parts.append("⚠️ Χωρίς εκπτώσεις\n")
     
-    text += "\n"
+    parts.append("\n")
 
     for i, product in enumerate(page_products, start + 1):
-        name = product.get('name', 'N/A')
-        price = product.get('price', '0')
-        stock = product.get('stock_status', 'outofstock')
-        stock_emoji = "✅" if stock == "instock" else "❌"
-        product_id = str(product.get('id', ''))
-        
-        indicators = ""
-        excluded = is_discount_excluded(product)
-        
-        if excluded:
-            indicators += " ⚠️"
-        
-        if check_promo and not excluded:
-            name_lower = name.lower()
-            if 'jumbo' in name_lower and 'premium' in name_lower:
-                indicators += " 🎁"
-        
-        if product_id in easypants_ids:
-            indicators += " 💶3€"
-        
-        text += f"{i}. {name}{indicators}\n   💰 {price}€ {stock_emoji}\n\n"
+        parts.append(f"{i}. ")
+        parts.append(fragments.get(product, 'retail', render_retail_fragment))
 
-    text += "Αριθμό για λεπτομέρειες\n"
+    parts.append("Αριθμό για λεπτομέρειες\n")
     if end < len(products):
-        text += "'more' για περισσότερα\n"
-    text += "('menu')"
+        parts.append("'more' για περισσότερα\n")
+    parts.append("('menu')")
 
-    return text
+    return "".join(parts)
+
+def render_retail_fragment(product):
+    """Render one product line of the retail list"""
+    name = product.get('name', 'N/A')
+    price = format_price(price_table.get(product).retail, '0')
+    stock = product.get('stock_status', 'outofstock')
+    stock_emoji = "✅" if stock == "instock" else "❌"
+    
+    indicators = ""
+    if is_discount_excluded(product):
+        indicators += " ⚠️"
+    
+    for promo in promo_engine.for_product(product):
+        if promo.badge:
+            indicators += f" {promo.badge}"
+    
+    return f"{name}{indicators}\n   💰 {price}€ {stock_emoji}\n\n"
 
+@metrics.timed_render
 def format_product_details(product, customer=None):
     """Format product details with purchase options"""
     name = product.get('name', 'N/A')
-    price = product.get('price', '0')
+    prices = price_table.get(product)
+    price = format_price(prices.retail, '0')
     stock = product.get('stock_status', 'outofstock')
-    product_id = str(product.get('id', ''))
-    name_lower = name.lower()
     
     excluded = is_discount_excluded(product)
     store = get_customer_store(customer) if customer else STORES[DEFAULT_STORE]
     is_b2b = is_b2b_product(product)
-    is_business_customer = customer and customer.get('is_business', False)
-    has_drive_through = store.get('drive_through', False)
+    segment = get_customer_segment(customer)
 
     text = f"📦 {name}\n\n"
     text += f"💰 Τιμή: {price}€\n"
     
     # Show B2B price if product has b2b tag AND customer is business
-    if is_b2b and is_business_customer:
+    if is_b2b and segment == 'business':
         b2b_price = get_b2b_price(product)
         if b2b_price:
-            text += f"🏭 B2B: {b2b_price}€ (-20%)\n"
+            text += screens.render('product_b2b_line', segment=segment, b2b_price=b2b_price)
     elif is_b2b:
-        text += f"🏭 Διαθέσιμο για B2B\n"
+        text += screens.render('product_b2b_line', segment=segment)
     
     text += f"📊 {'Διαθέσιμο ✅' if stock == 'instock' else 'Εξαντλήθηκε ❌'}\n"
 
     if excluded:
-        text += "\n⚠️ Σταθερή τιμή - χωρίς εκπτώσεις.\n"
-        text += f"\n📍 {store['short_name']}\n"
-        if has_drive_through:
-            text += f"\n1️⃣ 🚗 Κράτηση Drive-Through (3 ώρες)"
-        text += "\n('menu' για αρχικό)"
+        text += screens.render('product_footer_fixed', store_id=store['id'])
     else:
-        easypants_ids = EASYPANTS_PROMO_IDS
-        if product_id in easypants_ids:
-            text += "\n💶 CASHBACK 3€!\n"
-        
-        if 'jumbo' in name_lower and 'premium' in name_lower and 'pampers' in name_lower:
-            text += "\n🎁 ΔΩΡΟ Pampers Aqua Harmonie!\n"
+        for promo in promo_engine.for_product(product):
+            if promo.detail:
+                text += f"\n{promo.detail}\n"
         
-        sub_price = float(price) * 0.9
-        text += f"""
+        text += screens.render('product_footer', store_id=store['id'], price=price,
+                               sub_price=format_price(prices.subscription, '0'))
+
+    return text
+
+def render_product_b2b_line(segment):
+    """Render the B2B price line of product details"""
+    if segment == 'business':
+        return f"🏭 B2B: {slot('b2b_price')}€ (-20%)\n"
+    return "🏭 Διαθέσιμο για B2B\n"
+
+def render_product_footer_fixed(store_id):
+    """Render product details footer for fixed-price products"""
+    store = STORES[store_id]
+    text = "\n⚠️ Σταθερή τιμή - χωρίς εκπτώσεις.\n"
+    text += f"\n📍 {store['short_name']}\n"
+    if store.get('drive_through', False):
+        text += f"\n1️⃣ 🚗 Κράτηση Drive-Through (3 ώρες)"
+    text += "\n('menu' για αρχικό)"
+    return text
+
+def render_product_footer(store_id):
+    """Render product details purchase options (prices are slots)"""
+    store = STORES[store_id]
+    text = f"""
 ━━━━━━━━━━━━━━━━━━━━
 ΤΙ ΘΕΛΕΤΕ ΝΑ ΚΑΝΕΤΕ;
 
-1️⃣ 🛒 Μία αγορά ({price}€)
-2️⃣ 🔄 Συνδρομή ({sub_price:.2f}€ -10%)"""
-        
-        if has_drive_through:
-            text += f"\n3️⃣ 🚗 Drive-Through κράτηση"
-        
-        text += f"""
+1️⃣ 🛒 Μία αγορά ({slot('price')}€)
+2️⃣ 🔄 Συνδρομή ({slot('sub_price')}€ -10%)"""
+    
+    if store.get('drive_through', False):
+        text += f"\n3️⃣ 🚗 Drive-Through κράτηση"
+    
+    text += f"""
 
 📍 {store['short_name']}
 ('menu' για αρχικό)"""
-
     return text
 
 # ============================================
@@ -1599,23 +2014,18 @@ def format_product_details(product, customer=None):
 # ============================================
 def get_all_promos_message():
     """Get all promotions"""
-    return f"""🎁 ΠΡΟΣΦΟΡΕΣ!
-
-━━━━━━━━━━━━━━━━━━━━
-🎁 Pampers Premium Care Jumbo
-= ΔΩΡΟ Aqua Harmonie 48τεμ!
-━━━━━━━━━━━━━━━━━━━━
-
-━━━━━━━━━━━━━━━━━━━━
-💶 EasyPants 30τεμ = 3€ Cashback!
-━━━━━━━━━━━━━━━━━━━━
-
-━━━━━━━━━━━━━━━━━━━━
-💰 Epithimies.gr Cashback 10€/20€!
-🌐 https://epithimies.gr
-━━━━━━━━━━━━━━━━━━━━
-
-⚠️ Βρεφικό γάλα & Solgar 
+    return screens.render('promos')
+
+def render_all_promos_message():
+    """Render all promotions running today"""
+    banners = [promo.banner for promo in promo_engine.active() if promo.banner]
+    text = "🎁 ΠΡΟΣΦΟΡΕΣ!\n\n"
+    if banners:
+        for banner in banners:
+            text += f"━━━━━━━━━━━━━━━━━━━━\n{banner}\n━━━━━━━━━━━━━━━━━━━━\n\n"
+    else:
+        text += "Δεν υπάρχουν ενεργές προσφορές αυτή τη στιγμή.\n\n"
+    return text + """⚠️ Βρεφικό γάλα & Solgar 
 χωρίς εκπτώσεις.
 
 1️⃣ Δες προϊόντα
@@ -1625,16 +2035,12 @@ def get_all_promos_message():
 
 def handle_promos_menu(msg, customer, session):
     """Handle promos"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-    
     if msg == '1':
         products = get_sale_products()
         if products:
             session['state'] = 'product_list'
             session['products'] = products
-            return format_product_list(products, "💰 Προσφορές", check_promo=True)
+            return format_product_list(products, "💰 Προσφορές")
         return "Δεν βρέθηκαν."
     elif msg == '2':
         session['state'] = 'search'
@@ -1647,6 +2053,10 @@ def handle_promos_menu(msg, customer, session):
 # ============================================
 def get_subscription_intro(customer):
     """Get subscription intro"""
+    return screens.render('subscription_intro')
+
+def render_subscription_intro():
+    """Render subscription intro"""
     return """🔄 ΣΥΝΔΡΟΜΗ -10%
 
 ✅ 10% ΕΚΠΤΩΣΗ πάντα
@@ -1665,10 +2075,6 @@ def get_subscription_intro(customer):
 
 def handle_subscription(msg, customer, session):
     """Handle subscription"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-
     if msg == '1':
         # Get products with subscribe tag
         products = get_subscription_products()
@@ -1708,10 +2114,6 @@ def handle_subscription(msg, customer, session):
 
 def handle_subscription_product(msg, customer, session):
     """Handle subscription product"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-
     search_map = {
         '1': 'baby diapers pampers babylino',
         '2': 'adult diapers kera tena easypants',
@@ -1739,10 +2141,6 @@ def handle_subscription_product(msg, customer, session):
 
 def handle_subscription_frequency(msg, customer, session):
     """Handle subscription frequency"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-
     product = session.get('selected_product', {})
 
     if not session.get('sub_frequency_shown'):
@@ -1766,25 +2164,13 @@ def handle_subscription_frequency(msg, customer, session):
     if msg in freq_map:
         session['sub_frequency'] = freq_map[msg]
         session['state'] = 'subscription_day'
-        return """📆 ΗΜΕΡΑ
-
-1️⃣ Δευτέρα
-2️⃣ Τρίτη
-3️⃣ Τετάρτη
-4️⃣ Πέμπτη
-5️⃣ Παρασκευή
-6️⃣ Σάββατο
-
-Επίλεξε 1-6"""
+        days = "\n".join(f"{key}️⃣ {day}" for key, day in PICKUP_DAYS.items())
+        return f"📆 ΗΜΕΡΑ\n\n{days}\n\nΕπίλεξε 1-{len(PICKUP_DAYS)}"
 
     return "Επίλεξε 1-3"
 
 def handle_subscription_day(msg, customer, session):
     """Handle subscription day"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-
     if msg in PICKUP_DAYS:
         session['sub_day'] = PICKUP_DAYS[msg]
         session['state'] = 'subscription_confirm'
@@ -1792,20 +2178,19 @@ def handle_subscription_day(msg, customer, session):
         product = session.get('selected_product', {})
         freq_name, freq_days, freq_text = session.get('sub_frequency', ('biweekly', 14, '2 εβδομάδες'))
         
-        price = float(product.get('price', 0))
-        discounted = price * 0.9
+        prices = price_table.get(product)
         
         return f"""✅ ΕΠΙΒΕΒΑΙΩΣΗ
 
 📦 {product.get('name', 'N/A')}
-💰 {price:.2f}€ → {discounted:.2f}€
+💰 {format_price(prices.retail, '0.00')}€ → {format_price(prices.subscription, '0.00')}€
 📅 {freq_text}
 📆 {session['sub_day']}
 
 1️⃣ ✅ OK
 2️⃣ ❌ Ακύρωση"""
 
-    return "Επίλεξε 1-6"
+    return f"Επίλεξε 1-{len(PICKUP_DAYS)}"
 
 def handle_subscription_confirm(msg, customer, session):
     """Handle subscription confirm"""
@@ -1817,7 +2202,7 @@ def handle_subscription_confirm(msg, customer, session):
             'id': hashlib.md5(f"{customer['phone']}{datetime.now()}".encode()).hexdigest()[:8],
             'product_id': product.get('id'),
             'product_name': product.get('name'),
-            'price': float(product.get('price', 0)) * 0.9,
+            'price': float(price_table.get(product).subscription or 0),
             'frequency': freq_name,
             'pickup_day': session.get('sub_day'),
             'next_pickup': calculate_next_pickup(session.get('sub_day')),
@@ -1825,7 +2210,10 @@ def handle_subscription_confirm(msg, customer, session):
         }
         
         customer['subscriptions'].append(subscription)
-        logger.info(f"✅ Subscription: {subscription}")
+        record_event(eventlog.SUBSCRIPTION, customer, p=product.get('id'), price=subscription['price'],
+                     every=freq_name)
+        funnel_step('subscription')
+        logger.info("✅ Subscription: %s", subscription)
         
         session['state'] = 'menu'
         store = get_customer_store(customer)
@@ -1850,6 +2238,8 @@ def handle_subscription_confirm(msg, customer, session):
         
         store_email = EMAIL_CONFIG['store_emails'].get(store['id'], EMAIL_CONFIG['store_emails']['chalandri'])
         send_email([store_email, EMAIL_CONFIG['store_emails']['support']], email_subject, email_html)
+        publish_order_event(store['id'], 'subscription', dict(
+            subscription, price=f"{subscription['price']:.2f}", frequency=freq_text, phone=customer_phone))
         
         return f"""🎉 ΕΝΕΡΓΗ!
 
@@ -1902,10 +2292,6 @@ def get_account_info(customer):
 
 def handle_my_account(msg, customer, session):
     """Handle account"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-    
     if msg == '1':
         session['state'] = 'subscription'
         return get_subscription_intro(customer)
@@ -1917,6 +2303,10 @@ def handle_my_account(msg, customer, session):
 
 def get_customer_service_menu():
     """Get customer service"""
+    return screens.render('customer_service')
+
+def render_customer_service_menu():
+    """Render customer service"""
     return f"""📞 ΕΞΥΠΗΡΕΤΗΣΗ
 
 1️⃣ 🤖 AI Βοηθός
@@ -1931,22 +2321,18 @@ def get_customer_service_menu():
 
 def handle_customer_service(msg, customer, session):
     """Handle customer service"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-
     if msg == '1':
         if claude_client:
             session['ai_mode'] = True
             session['ai_history'] = []
             customer_phone = customer.get('phone', 'N/A')
-            logger.info(f"🤖 AI SESSION STARTED: {customer_phone}")
+            logger.info("🤖 AI SESSION STARTED: %s", customer_phone)
             return "🤖 AI Βοηθός ενεργοποιήθηκε!\n\nΡώτα με οτιδήποτε!\n\n(Γράψε 'menu' για έξοδο)"
         else:
             # Log AI request when not available
             customer_phone = customer.get('phone', 'N/A')
             store = get_customer_store(customer)
-            logger.warning(f"⚠️ AI REQUESTED BUT NOT AVAILABLE: {customer_phone}")
+            logger.warning("⚠️ AI REQUESTED BUT NOT AVAILABLE: %s", customer_phone)
             
             # Send email to support about AI request
             email_subject = f"🤖 Αίτημα AI Βοήθειας"
@@ -1980,10 +2366,6 @@ def handle_customer_service(msg, customer, session):
 
 def handle_complaint_form(msg, customer, session):
     """Handle complaint with email notification"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-
     step = session.get('complaint_step', 'type')
 
     if step == 'type':
@@ -2000,7 +2382,7 @@ def handle_complaint_form(msg, customer, session):
         store = get_customer_store(customer)
         
         # Log complaint
-        logger.info(f"📢 COMPLAINT: {complaint_type} - {msg} - {customer_phone}")
+        logger.info("📢 COMPLAINT: %s - %s - %s", complaint_type, msg, customer_phone)
         
         # Send email to support
         email_subject = f"📢 Παράπονο Πελάτη - {complaint_type}"
@@ -2028,14 +2410,10 @@ def handle_complaint_form(msg, customer, session):
 
 def handle_product_request(msg, customer, session):
     """Handle product request with email notification"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-
     customer_phone = customer.get('phone', 'N/A')
     store = get_customer_store(customer)
     
-    logger.info(f"🎯 PRODUCT REQUEST: {msg} - {customer_phone}")
+    logger.info("🎯 PRODUCT REQUEST: %s - %s", msg, customer_phone)
     
     # Send email notification
     email_subject = f"🎯 Αίτημα Προϊόντος"
@@ -2060,17 +2438,13 @@ def handle_product_request(msg, customer, session):
 
 def handle_feedback(msg, customer, session):
     """Handle feedback with email notification"""
-    if msg.lower() == 'menu':
-        session['state'] = 'menu'
-        return get_main_menu(customer)
-
     if msg in ['1', '2', '3', '4', '5']:
         customer_phone = customer.get('phone', 'N/A')
         store = get_customer_store(customer)
         stars = int(msg)
         star_display = '⭐' * stars
         
-        logger.info(f"⭐ FEEDBACK: {msg} stars - {customer_phone}")
+        logger.info("⭐ FEEDBACK: %s stars - %s", msg, customer_phone)
         
         # Send email notification
         email_subject = f"⭐ Αξιολόγηση Πελάτη - {stars}/5"
@@ -2096,6 +2470,10 @@ def handle_feedback(msg, customer, session):
 # ============================================
 def get_help_message():
     """Get help"""
+    return screens.render('help')
+
+def render_help_message():
+    """Render help"""
     return """❓ ΒΟΗΘΕΙΑ
 
 • 'menu' - Μενού
@@ -2107,30 +2485,195 @@ def get_help_message():
 
 def search_products(query):
     """Search products"""
-    try:
+    def fetch():
         response = wcapi.get("products", params={"search": query, "per_page": 20})
         result = response.json()
         return result if isinstance(result, list) else []
+    try:
+        return fetch_with_fallback('search_products', ('search', query.lower()), fetch)
+    except deadline.DeadlineExceeded:
+        raise
     except Exception as e:
-        logger.error(f"Search error: {e}")
+        logger.error("Search error: %s", e)
         return []
 
 def get_popular_products():
     """Get popular"""
     try:
-        response = wcapi.get("products", params={"per_page": 20, "orderby": "popularity"})
-        return response.json()
+        return fetch_with_fallback('get_popular_products', ('popular',), lambda: wcapi.get(
+            "products", params={"per_page": 20, "orderby": "popularity"}).json())
+    except deadline.DeadlineExceeded:
+        raise
     except:
         return []
 
 def get_sale_products():
     """Get sale"""
     try:
-        response = wcapi.get("products", params={"per_page": 20, "on_sale": True})
-        return response.json()
+        return fetch_with_fallback('get_sale_products', ('sale',), lambda: wcapi.get(
+            "products", params={"per_page": 20, "on_sale": True}).json())
+    except deadline.DeadlineExceeded:
+        raise
     except:
         return []
 
+# ============================================
+# 🧾 SCREEN CACHE
+# ============================================
+screens = ScreenCache()
+
+screens.register('main_menu', render_main_menu, per_store=True)
+screens.register('location', render_location_message, per_store=True)
+screens.register('store_selection', render_store_selection_menu)
+screens.register('franchise', render_franchise_menu)
+screens.register('wholesale', render_wholesale_menu)
+screens.register('categories', render_categories_menu)
+screens.register('promos', render_all_promos_message)
+screens.register('subscription_intro', render_subscription_intro)
+screens.register('customer_service', render_customer_service_menu)
+screens.register('help', render_help_message)
+screens.register('product_b2b_line', render_product_b2b_line, per_segment=True)
+screens.register('product_footer', render_product_footer, per_store=True)
+screens.register('product_footer_fixed', render_product_footer_fixed, per_store=True)
+
+screens.warm(list(STORES.keys()), segments=('retail', 'business'))
+
+# Per-product list fragments, keyed by (id, date_modified, list type)
+fragments = FragmentCache(maxsize=int(os.environ.get('FRAGMENT_CACHE_SIZE', 20000)))
+
+# ============================================
+# ⚙️ CONFIG RELOAD
+# ============================================
+# Each section swaps its globals and rebuilds only what was derived from it;
+# stores and default_store are applied together so they always match
+STORE_SCREENS = ('main_menu', 'location', 'store_selection', 'franchise', 'product_footer', 'product_footer_fixed')
+
+def apply_stores(_):
+    global STORES, DEFAULT_STORE, store_names
+    stores, default_store = live_config['stores'], live_config['default_store']
+    if stores is STORES and default_store == DEFAULT_STORE:
+        return  # Both sections changed; the first call applied them
+    names = build_store_names(stores)
+    # STORES first: DEFAULT_STORE must never name a store it lacks
+    STORES, DEFAULT_STORE, store_names = stores, default_store, names
+    screens.refresh(STORE_SCREENS, list(stores.keys()))
+
+def apply_franchise(franchise):
+    global FRANCHISE_INFO
+    FRANCHISE_INFO = franchise
+    screens.refresh(('franchise',), list(STORES.keys()))
+
+def apply_wholesale(wholesale):
+    global WHOLESALE_INFO
+    WHOLESALE_INFO = wholesale
+    screens.refresh(('wholesale',), list(STORES.keys()))
+
+def apply_no_discount(no_discount):
+    global NO_DISCOUNT_KEYWORDS, NO_DISCOUNT_PRODUCT_IDS, NO_DISCOUNT_CATEGORIES
+    NO_DISCOUNT_KEYWORDS = no_discount['keywords']
+    NO_DISCOUNT_PRODUCT_IDS = no_discount['product_ids']
+    NO_DISCOUNT_CATEGORIES = no_discount['categories']
+    price_table.invalidate()
+    promo_engine.invalidate()
+
+def apply_promos(promos):
+    global ACTIVE_PROMOS
+    ACTIVE_PROMOS = promos
+    promo_engine.load(promos)
+
+def promos_changed():
+    # New rules or a promo started/ended: badges, details and the promos screen
+    fragments.invalidate()
+    screens.refresh(('promos',), list(STORES.keys()))
+
+def apply_subscription_plans(plans):
+    global SUBSCRIPTION_PLANS
+    SUBSCRIPTION_PLANS = plans
+
+def apply_categories(categories):
+    global CATEGORIES
+    CATEGORIES = categories
+    screens.refresh(('categories',), list(STORES.keys()))
+
+live_config.on_change('stores', apply_stores)
+live_config.on_change('default_store', apply_stores)
+live_config.on_change('franchise', apply_franchise)
+live_config.on_change('wholesale', apply_wholesale)
+live_config.on_change('no_discount', apply_no_discount)
+live_config.on_change('promos', apply_promos)
+promo_engine.on_change(promos_changed)
+live_config.on_change('subscription_plans', apply_subscription_plans)
+live_config.on_change('categories', apply_categories)
+
+# ============================================
+# 🔀 CONVERSATION STATE MACHINE
+# ============================================
+def observe_handler(state, seconds):
+    """State machine observer: handler latency metric and trace annotation"""
+    metrics.HANDLER_SECONDS.observe(seconds, state=state)
+    tracer.annotate(handler=conversation.handler_name(state), handler_ms=round(seconds * 1000, 1))
+
+def degraded_try_again(msg, customer, session):
+    """Degraded reply: the deadline ran out before an upstream answered"""
+    return "⏳ Αργούμε λίγο να απαντήσουμε. Στείλε ξανά το μήνυμά σου σε λίγο ή γράψε 'menu'."
+
+def degraded_popular_instead(msg, customer, session):
+    """Degraded reply while browsing: the last good popular list instead, if there is one"""
+    products = fallback_products.get(('popular',))
+    if not products:
+        return degraded_try_again(msg, customer, session)
+    degrade('browse', 'popular_instead')
+    session['state'] = 'product_list'
+    session['products'] = products
+    return ("⏳ Αργούμε λίγο να φέρουμε αυτά τα προϊόντα. Δοκίμασε ξανά σε λίγο, μέχρι τότε:\n\n"
+            + format_product_list(products, "🔥 Δημοφιλή"))
+
+conversation = StateMachine(
+    default_state='welcome',
+    observer=observe_handler,
+    degrade_on=(deadline.DeadlineExceeded,),
+    degraded=degraded_try_again,
+    on_degraded=lambda key, exc: tracer.annotate(degraded_handler=conversation.handler_name(key))
+)
+
+conversation.command(['menu', 'μενού', 'αρχή', 'start', '0'], command_menu, target='menu')
+conversation.command(['help', 'βοήθεια', '?'], command_help)
+conversation.command(['καταστήματα', 'stores', 'αλλαγή καταστήματος'], command_stores, target='store_selection')
+conversation.command(['franchise', 'franchising', 'δικαιόχρηση'], command_franchise)
+conversation.command(['wholesale', 'χονδρική', 'b2b', 'επαγγελματίες'], command_wholesale, target='wholesale')
+conversation.command(['θέση', 'location', 'διεύθυνση', 'χάρτης', 'map'], command_location)
+conversation.command(['ai', 'claude', 'chat'], command_ai)
+
+conversation.state('welcome', handle_welcome, transitions=['menu'])
+conversation.state('menu', handle_menu, transitions=[
+    'search', 'product_list', 'promos', 'categories', 'subscription', 'my_account',
+    'customer_service', 'store_selection', 'franchise', 'wholesale'])
+conversation.state('search', handle_search, transitions=['product_list'], free_text=True,
+                   degraded=degraded_popular_instead)
+conversation.state('product_list', handle_product_selection, transitions=['product_choice', 'subscription_frequency', 'menu'])
+conversation.state('product_choice', handle_product_choice, transitions=['subscription_frequency', 'menu'])
+conversation.state('categories', handle_categories, transitions=['product_list'], degraded=degraded_popular_instead)
+conversation.state('promos', handle_promos_menu, transitions=['product_list', 'search'],
+                   degraded=degraded_popular_instead)
+conversation.state('subscription', handle_subscription, transitions=['product_list', 'subscription_product'])
+conversation.state('subscription_product', handle_subscription_product, transitions=['product_list', 'search'])
+conversation.state('subscription_frequency', handle_subscription_frequency, transitions=['subscription_day'])
+conversation.state('subscription_day', handle_subscription_day, transitions=['subscription_confirm'])
+conversation.state('subscription_confirm', handle_subscription_confirm, transitions=['menu'])
+conversation.state('my_account', handle_my_account, transitions=['subscription', 'store_selection'])
+conversation.state('customer_service', handle_customer_service, transitions=['complaint_form', 'product_request', 'feedback'])
+conversation.state('complaint_form', handle_complaint_form, transitions=['menu'], free_text=True)
+conversation.state('product_request', handle_product_request, transitions=['menu'], free_text=True)
+conversation.state('feedback', handle_feedback, transitions=['menu'])
+conversation.state('store_selection', handle_store_selection, transitions=['menu'])
+conversation.state('franchise', handle_franchise, transitions=['menu'], free_text=True)
+conversation.state('wholesale', handle_wholesale, transitions=['product_list', 'wholesale_inquiry', 'wholesale_quote'])
+conversation.state('wholesale_inquiry', handle_wholesale_inquiry, transitions=['wholesale_phone', 'product_list', 'menu'], free_text=True)
+conversation.state('wholesale_phone', handle_wholesale_phone, transitions=['menu'], free_text=True)
+conversation.state('wholesale_quote', handle_wholesale_quote, free_text=True)
+
+conversation.compile()
+
 # ============================================
 # ROUTES
 # ============================================
@@ -2141,12 +2684,17 @@ def health():
         "status": "ok",
         "version": "3.4-MultiStore-Franchise-B2B",
         "stores": list(STORES.keys()),
-        "ai_enabled": claude_client is not None
+        "ai_enabled": bool(claude_client)
     }
 
 @app.route("/", methods=['GET'])
 def home():
-    """Home"""
+    """Home (the store dashboard with ?store=<id>&token=<feed token>)"""
+    store_id = request.args.get('store')
+    if store_id:
+        if store_id not in STORES or not feed_authorized(store_id):
+            return "Unauthorized", 401
+        return render_store_dashboard(store_id)
     store_list = "".join([f"<li>{s['name']}</li>" for s in STORES.values()])
     ai_status = "✅ Enabled" if claude_client else "❌ Disabled (no API key)"
     email_status = "✅ Configured" if EMAIL_CONFIG.get('smtp_user') else "❌ Not configured"
@@ -2183,18 +2731,101 @@ def home():
     </p>
     """
 
+STORE_DASHBOARD_HTML = """<!doctype html>
+<html lang="el"><head><meta charset="utf-8"><title>🚗 %(store_name)s</title>
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<style>
+body { font-family: sans-serif; margin: 1.5em; }
+table { border-collapse: collapse; width: 100%%; }
+td, th { border-bottom: 1px solid #ddd; padding: .4em; text-align: left; }
+.late { color: #b00; } #status { float: right; color: #888; }
+</style></head><body>
+<span id="status">…</span>
+<h1>🚗 Drive-Through: %(store_name)s</h1>
+<table><thead><tr><th>Order ID</th><th>Προϊόν</th><th>Τιμή</th><th>Πελάτης</th><th>Λήξη</th></tr></thead>
+<tbody id="pending"></tbody></table>
+<h2>Τελευταίες κινήσεις</h2>
+<ul id="recent"></ul>
+<script>
+const pending = new Map(%(pending)s.map(r => [r.order_id, r]));
+const hhmm = t => new Date(t * 1000).toLocaleTimeString('el-GR', {hour: '2-digit', minute: '2-digit'});
+const cell = text => { const td = document.createElement('td'); td.textContent = text; return td; };
+function render() {
+  const rows = [...pending.values()].sort((a, b) => a.expires - b.expires).map(r => {
+    const tr = document.createElement('tr');
+    [r.order_id, r.product_name, r.price + '€', r.phone, hhmm(r.expires)].forEach(v => tr.appendChild(cell(v)));
+    if (r.expires * 1000 < Date.now() + 15 * 60000) tr.className = 'late';
+    return tr;
+  });
+  document.getElementById('pending').replaceChildren(...rows);
+}
+function note(text) {
+  const li = document.createElement('li');
+  li.textContent = new Date().toLocaleTimeString('el-GR') + ' ' + text;
+  document.getElementById('recent').prepend(li);
+}
+const feed = new EventSource(%(feed_url)s);
+feed.onopen = () => document.getElementById('status').textContent = '● live';
+feed.onerror = () => document.getElementById('status').textContent = '○ reconnecting';
+feed.addEventListener('reservation', e => {
+  const r = JSON.parse(e.data);
+  if (r.status === 'held') pending.set(r.order_id, r); else pending.delete(r.order_id);
+  note(`🚗 ${r.order_id} ${r.product_name}: ${r.status}`);
+  render();
+});
+feed.addEventListener('pickup', e => { const d = JSON.parse(e.data); note(`🛒 ${d.product_name} (${d.price}€) ${d.phone}`); });
+feed.addEventListener('subscription', e => { const d = JSON.parse(e.data); note(`🔄 ${d.product_name} ${d.frequency} ${d.phone}`); });
+feed.addEventListener('restock', e => { const d = JSON.parse(e.data); d.items.forEach(i => note(`📦 Restock ${d.pickup_date}: ${i.name} (${i.available}/${i.needed_all_stores}, εδώ ${i.needed})`)); });
+feed.addEventListener('reset', e => {
+  pending.clear();
+  JSON.parse(e.data).pending.forEach(r => pending.set(r.order_id, r));
+  note('↻');
+  render();
+});
+render();
+setInterval(render, 60000);
+</script></body></html>"""
+
+def render_store_dashboard(store_id):
+    """Pending drive-through pickups, kept current by the store's SSE feed"""
+    pending = json.dumps([r.to_dict() for r in reservations.for_store(store_id)], ensure_ascii=False)
+    feed_url = f"/api/stores/{store_id}/feed?token={request.args.get('token', '')}&last_event_id={feed_hub.last_id(store_id)}"
+    return STORE_DASHBOARD_HTML % {
+        'store_name': html.escape(STORES[store_id]['name']),
+        'pending': pending.replace('</', '<\\/'),
+        'feed_url': json.dumps(feed_url),
+    }
+
 @app.route("/api/status", methods=['GET'])
 def get_status():
     """Get bot status"""
     return jsonify({
         "status": "running",
         "version": "3.4",
-        "ai_enabled": claude_client is not None,
+        "ai_enabled": bool(claude_client),
         "email_configured": bool(EMAIL_CONFIG.get('smtp_user')),
         "stores_count": len(STORES),
-        "active_sessions": len(sessions)
+        "active_sessions": len(sessions),
+        "fragment_cache": fragments.stats(),
+        "promotions": promo_engine.stats(),
+        "price_table": price_table.stats(),
+        "reservations": reservations.stats(),
+        "live_feed": feed_hub.stats(),
+        "event_log": event_log.stats(),
+        "snapshots": state_snapshots.stats(),
+        "admission": admission.stats()
     })
 
+@app.route("/metrics", methods=['GET'])
+def get_metrics():
+    """Prometheus metrics"""
+    return metrics.registry.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+@app.route("/api/state-stats", methods=['GET'])
+def get_state_stats():
+    """Get per-state handler counts and latency"""
+    return jsonify(conversation.stats())
+
 @app.route("/api/stores", methods=['GET'])
 def get_stores():
     """Get all stores"""
@@ -2210,31 +2841,252 @@ def get_wholesale():
     """Get wholesale info"""
     return jsonify(WHOLESALE_INFO)
 
+def is_admin_request():
+    """Check the X-API-Key header against config.API_SECRET_KEY"""
+    api_key = request.headers.get('X-API-Key')
+    return hasattr(config, 'API_SECRET_KEY') and api_key == config.API_SECRET_KEY
+
+@app.route("/admin/profile", methods=['GET', 'POST'])
+def admin_profile():
+    """Arm/stop the sampling profiler or fetch its collapsed stacks.
+
+    POST requests=N and/or seconds=S to arm, stop=1 to stop early.
+    GET ?format=folded returns the last run ready for flamegraph.pl.
+    Profiling is per worker process.
+    """
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or request.values
+        if params.get('stop'):
+            profiler.disarm()
+        else:
+            try:
+                profiler.arm(requests=params.get('requests'), seconds=params.get('seconds'))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        return jsonify(profiler.status())
+    
+    if request.args.get('format') == 'folded':
+        result = profiler.last_result
+        if not result:
+            return "No profile collected yet\n", 404, {'Content-Type': 'text/plain; charset=utf-8'}
+        return result['folded'] + "\n", 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    return jsonify(profiler.status())
+
+@app.route("/admin/traces", methods=['GET'])
+def admin_traces():
+    """Recent slow /webhook traces (newest first)"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({
+        "threshold_ms": tracer.threshold_ms,
+        "recorded": tracer.recorded,
+        "traces": tracer.recent(limit)
+    })
+
+@app.route("/admin/config", methods=['GET', 'POST'])
+def admin_config():
+    """Live config status; POST re-reads store_config.json now"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    if request.method == 'POST':
+        applied = live_config.reload()
+        return jsonify({"applied": applied, **live_config.status()}), (200 if applied else 422)
+    return jsonify(live_config.status())
+
+@app.route("/api/reservations/<order_id>", methods=['GET'])
+def get_reservation(order_id):
+    """Look up a drive-through reservation by the order id the customer shows"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    reservation = reservations.get(order_id)
+    if reservation is None:
+        return jsonify({"error": "Not found", "order_id": order_id}), 404
+    return jsonify(reservation.to_dict())
+
+@app.route("/api/reservations/<order_id>/collect", methods=['POST'])
+def collect_reservation(order_id):
+    """Mark a held reservation as picked up"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    reservation = reservations.collect(order_id)
+    if reservation is None:
+        current = reservations.get(order_id)
+        return jsonify({"error": "Not held", "status": current.status if current else None}), 409 if current else 404
+    return jsonify(reservation.to_dict())
+
+@app.route("/api/stores/<store_id>/reservations", methods=['GET'])
+def store_reservations(store_id):
+    """A store's reservations (held by default; ?status=all for every one still tracked)"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    if store_id not in STORES:
+        return jsonify({"error": "Unknown store"}), 404
+    status = request.args.get('status', 'held')
+    return jsonify([r.to_dict() for r in reservations.for_store(store_id, None if status == 'all' else status)])
+
+@app.route("/api/stores/<store_id>/feed", methods=['GET'])
+def store_feed(store_id):
+    """Server-Sent Events stream of the store's orders, reservations and subscriptions"""
+    if store_id not in STORES:
+        return jsonify({"error": "Unknown store"}), 404
+    if not feed_authorized(store_id):
+        return jsonify({"error": "Unauthorized"}), 401
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or ''
+    try:
+        body = feed_hub.stream(store_id, last_id)
+    except FeedFull as e:
+        return jsonify({"error": str(e)}), 503
+    return Response(body, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route("/api/stores/<store_id>/dashboard", methods=['GET'])
+def store_dashboard_link(store_id):
+    """The store's dashboard link for staff (admin only)"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    if store_id not in STORES or feed_token(store_id) is None:
+        return jsonify({"error": "Unknown store"}), 404
+    return jsonify({"store": store_id, "url": f"{request.host_url}?store={store_id}&token={feed_token(store_id)}"})
+
+@app.route("/admin/orders", methods=['GET', 'POST'])
+def admin_orders():
+    """WooCommerce order queue status; POST flushes what is due now"""
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    if request.method == 'POST':
+        return jsonify(dict(order_queue.status(), flushed=order_queue.flush_due()))
+    return jsonify(order_queue.status())
+
+@app.route("/admin/funnel", methods=['GET'])
+def admin_funnel():
+    """Live funnel over the last ?minutes= (default: the whole window), summed over all workers
+
+    ?scope=worker limits it to the worker answering.
+    """
+    if not is_admin_request():
+        return jsonify({"error": "Unauthorized"}), 401
+    minutes = request.args.get('minutes', '')
+    return jsonify(funnel.report(int(minutes) if minutes.isdigit() else None,
+                                 merge=request.args.get('scope') != 'worker'))
+
 @app.route("/api/send-reminders", methods=['POST'])
 def send_reminders():
     """Send reminders"""
-    api_key = request.headers.get('X-API-Key')
-    if not hasattr(config, 'API_SECRET_KEY') or api_key != config.API_SECRET_KEY:
+    if not is_admin_request():
         return jsonify({"error": "Unauthorized"}), 401
     
     tomorrow = (datetime.now() + timedelta(days=1)).strftime('%d/%m/%Y')
-    sent = 0
+    due = [(phone, get_customer_store(customer), sub)
+           for phone, customer in list(customers.items())
+           for sub in customer.get('subscriptions', [])
+           if sub.get('next_pickup') == tomorrow and sub.get('status') == 'active']
+    
+    # One stock lookup per 100 distinct products, not one per subscription
+    stock, unknown = get_stock_levels(sub.get('product_id') for _, _, sub in due)
+    demand = {}
+    for _, store, sub in due:
+        key = (store['id'], stock_key(sub.get('product_id')))
+        demand[key] = demand.get(key, 0) + 1
     
-    for phone, customer in customers.items():
-        store = get_customer_store(customer)
-        for sub in customer.get('subscriptions', []):
-            if sub.get('next_pickup') == tomorrow and sub.get('status') == 'active':
-                try:
-                    twilio_client.messages.create(
-                        body=f"⏰ Αύριο: {sub['product_name']} - {sub['price']:.2f}€\n📍 {store['address']}",
-                        from_=config.TWILIO_WHATSAPP_NUMBER,
-                        to=phone
-                    )
-                    sent += 1
-                except Exception as e:
-                    logger.error(f"Reminder error: {e}")
-    
-    return jsonify({"sent": sent})
+    sent = 0
+    out_of_stock = 0
+    # Units still free for the reminders that follow (stock is shop-wide)
+    left = {product_id: available_quantity(product) for product_id, product in stock.items()}
+    for phone, store, sub in due:
+        product_id = stock_key(sub.get('product_id'))
+        if product_id is None or product_id in unknown:
+            in_stock = True
+        else:
+            available = left.get(product_id, 0)
+            in_stock = available is None or available > 0
+            if in_stock and available is not None:
+                left[product_id] = available - 1
+        if in_stock:
+            body = f"⏰ Αύριο: {sub['product_name']} - {sub['price']:.2f}€\n📍 {store['address']}"
+        else:
+            out_of_stock += 1
+            body = (f"⏰ Αύριο: {sub['product_name']}\n"
+                    f"⚠️ Προσωρινά εξαντλημένο - το κατάστημα το παραγγέλνει και θα σε ενημερώσουμε μόλις έρθει.\n"
+                    f"📍 {store['address']}\n📞 {store.get('phone') or '210 680 0549'}")
+        try:
+            with metrics.upstream('twilio', 'messages.create', to=phone):
+                twilio_client.messages.create(
+                    body=body,
+                    from_=config.TWILIO_WHATSAPP_NUMBER,
+                    to=phone
+                )
+            sent += 1
+        except Exception as e:
+            logger.error("Reminder error: %s", e)
+    
+    restock = build_restock_lists(demand, stock, unknown)
+    stores = {store['id']: store for _, store, _ in due}
+    for store_id, items in restock.items():
+        send_restock_list(stores[store_id], items, tomorrow)
+    
+    return jsonify({"sent": sent, "due": len(due), "out_of_stock": out_of_stock,
+                    "stock_unknown": len(unknown), "restock": restock})
+
+def build_restock_lists(demand, stock, unknown):
+    """Per store: products whose shop-wide stock won't cover tomorrow's pickups at all stores.
+
+    WooCommerce counts one stock for every store, so the demand of all stores
+    is summed before comparing; each store that needs a short product gets it
+    on its list, with the total shortfall.
+    """
+    totals = {}
+    for (store_id, product_id), needed in demand.items():
+        totals[product_id] = totals.get(product_id, 0) + needed
+    restock = {}
+    for (store_id, product_id), needed in demand.items():
+        if product_id is None or product_id in unknown:
+            continue
+        product = stock.get(product_id)
+        available = available_quantity(product)
+        if available is None or available >= totals[product_id]:
+            continue
+        restock.setdefault(store_id, []).append({
+            'product_id': product_id,
+            'name': product.get('name') if product else None,
+            'needed': needed,
+            'needed_all_stores': totals[product_id],
+            'available': available,
+            'short': totals[product_id] - available,
+            'status': product.get('stock_status') if product else 'missing',
+        })
+    return restock
+
+def send_restock_list(store, items, pickup_date):
+    """Email (and push to the live feed) a store's restock list for tomorrow's pickups"""
+    rows = "".join(
+        f"<tr><td>{html.escape(item['name'] or str(item['product_id']))}</td>"
+        f"<td>{item['needed']}</td><td>{item['needed_all_stores']}</td><td>{item['available']}</td>"
+        f"<td>{item['short']}</td></tr>"
+        for item in items)
+    email_html = f"""
+    <h2>📦 Restock για συνδρομές {pickup_date}</h2>
+    <p><strong>Κατάστημα:</strong> {store['name']}</p>
+    <table border="1" cellpadding="4" cellspacing="0">
+        <tr><th>Προϊόν</th><th>Χρειάζονται</th><th>Όλα τα καταστήματα</th><th>Διαθέσιμα</th><th>Λείπουν</th></tr>
+        {rows}
+    </table>
+    """
+    store_email = EMAIL_CONFIG['store_emails'].get(store['id'], EMAIL_CONFIG['store_emails']['chalandri'])
+    send_email([store_email], f"📦 Restock: {len(items)} προϊόντα για {pickup_date}", email_html)
+    publish_order_event(store['id'], 'restock', {'pickup_date': pickup_date, 'items': items})
+
+# ============================================
+# ⏱️ BOOT TIME
+# ============================================
+# Everything above (screens, lexicons, state machine) is built here, once;
+# under gunicorn --preload that happens in the master and workers share it
+IMPORT_SECONDS = time.perf_counter() - BOOT_STARTED
+metrics.BOOT_SECONDS.set(IMPORT_SECONDS, phase='import')
+logger.info("⏱️ App imported in %.0f ms", IMPORT_SECONDS * 1000)
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=getattr(config, 'DEVELOPMENT', False))
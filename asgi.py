@@ -0,0 +1,345 @@
+"""
+ASGI serving mode.
+
+    uvicorn asgi:app --workers 2
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+
+Every route of the Flask app (/webhook, /api/*, ...) is served from an
+asyncio event loop. Each request runs the unchanged WSGI code in its own
+greenlet (see aiobridge.py), and the upstream clients are swapped for async
+ones: aiohttp for WooCommerce, AsyncAnthropic for Claude and Twilio's
+aiohttp client. SMTP has no async client here, so its blocking calls run in
+the loop's thread pool. While a conversation waits on an upstream only its
+greenlet is parked, so one process holds thousands of in-flight requests.
+Responses without a Content-Length (the staff SSE feed) are sent chunk by
+chunk as the app yields them.
+"""
+import asyncio
+import io
+import json
+import logging
+import smtplib
+import sys
+import types
+
+import aiohttp
+
+import aiobridge
+import deadline
+from aiobridge import await_
+
+import app as bot
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1024 * 1024
+
+
+# ============================================
+# ASYNC UPSTREAM CLIENTS
+# ============================================
+class BridgedResponse:
+    """The parts of requests.Response the bot reads"""
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _query_params(params):
+    # Match requests' encoding: drop None, str() scalars, repeat keys for lists
+    pairs = []
+    for key, value in (params or {}).items():
+        for item in (value if isinstance(value, (list, tuple)) else [value]):
+            if item is not None:
+                pairs.append((key, str(item)))
+    return pairs
+
+
+class AsyncWooCommerce:
+    """woocommerce.API look-alike whose calls are awaited on the event loop"""
+
+    def __init__(self, url, consumer_key, consumer_secret, version="wc/v3", timeout=30):
+        self.base_url = f"{url.rstrip('/')}/wp-json/{version}/"
+        self.auth = aiohttp.BasicAuth(consumer_key, consumer_secret)
+        self.max_timeout = timeout
+        self._session = None
+
+    async def _request(self, method, endpoint, timeout, data=None, params=None):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                auth=self.auth,
+                headers={'User-Agent': 'WooCommerce-Python-REST-API/3.0.0', 'Accept': 'application/json'})
+        async with self._session.request(method, self.base_url + endpoint.lstrip('/'),
+                                         params=_query_params(params), json=data,
+                                         timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            return BridgedResponse(response.status, await response.read(), response.headers)
+
+    def _call(self, method, endpoint, data=None, params=None):
+        # The timeout is sized here, inside the request's context
+        return await_(self._request(method, endpoint, deadline.timeout(self.max_timeout), data, params))
+
+    def get(self, endpoint, **kwargs):
+        return self._call('GET', endpoint, params=kwargs.get('params'))
+
+    def post(self, endpoint, data, **kwargs):
+        return self._call('POST', endpoint, data=data, params=kwargs.get('params'))
+
+    def put(self, endpoint, data, **kwargs):
+        return self._call('PUT', endpoint, data=data, params=kwargs.get('params'))
+
+    def delete(self, endpoint, **kwargs):
+        return self._call('DELETE', endpoint, params=kwargs.get('params'))
+
+    def options(self, endpoint, **kwargs):
+        return self._call('OPTIONS', endpoint, params=kwargs.get('params'))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncClaude:
+    """``client.messages.create(...)`` backed by AsyncAnthropic"""
+
+    def __init__(self, api_key):
+        from anthropic import AsyncAnthropic
+        self._client = AsyncAnthropic(api_key=api_key)
+        self.messages = types.SimpleNamespace(create=self._create)
+
+    def _create(self, **kwargs):
+        return await_(self._client.messages.create(**kwargs))
+
+    async def close(self):
+        await self._client.close()
+
+
+class AsyncTwilio:
+    """``client.messages.create(...)`` backed by Twilio's aiohttp client"""
+
+    def __init__(self, account_sid, auth_token):
+        from twilio.http.async_http_client import AsyncTwilioHttpClient
+        from twilio.rest import Client
+        self._http = AsyncTwilioHttpClient()
+        self._client = Client(account_sid, auth_token, http_client=self._http)
+        self.messages = types.SimpleNamespace(create=self._create)
+
+    def _create(self, **kwargs):
+        return await_(self._client.messages.create_async(**kwargs))
+
+    async def close(self):
+        await self._http.close()
+
+
+class ThreadedSMTP:
+    """smtplib.SMTP whose blocking calls run in the loop's thread pool"""
+
+    def __init__(self, *args, **kwargs):
+        self._smtp = aiobridge.to_thread(smtplib.SMTP, *args, **kwargs)
+
+    def __getattr__(self, name):
+        method = getattr(self._smtp, name)
+        return lambda *args, **kwargs: aiobridge.to_thread(method, *args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        aiobridge.to_thread(self._smtp.__exit__, *exc)
+
+
+# Async clients built so far, closed on shutdown
+_opened = []
+
+
+def _opening(client):
+    if client is not None:
+        _opened.append(client)
+    return client
+
+
+def build_async_wcapi():
+    return bot.metrics.InstrumentedClient(_opening(AsyncWooCommerce(
+        url=bot.config.PANES_URL,
+        consumer_key=bot.config.PANES_CONSUMER_KEY,
+        consumer_secret=bot.config.PANES_CONSUMER_SECRET,
+        version="wc/v3",
+        timeout=30
+    )), 'woocommerce')
+
+
+def build_async_claude():
+    return _opening(AsyncClaude(bot.claude_api_key())) if bot.claude_configured() else None
+
+
+def build_async_twilio():
+    return _opening(AsyncTwilio(bot.config.TWILIO_ACCOUNT_SID, bot.config.TWILIO_AUTH_TOKEN))
+
+
+def install_async_clients():
+    """Point the bot's lazy clients at the async implementations"""
+    bot.wcapi.reset(factory=build_async_wcapi)
+    bot.claude_client.reset(factory=build_async_claude)
+    bot.twilio_client.reset(factory=build_async_twilio)
+    bot.smtplib = types.SimpleNamespace(SMTP=ThreadedSMTP)
+    logger.info("⚡ ASGI mode: async upstream clients installed")
+
+
+async def close_async_clients():
+    while _opened:
+        client = _opened.pop()
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning("Closing %s failed: %s", type(client).__name__, e)
+
+
+# ============================================
+# ASGI -> WSGI IN A GREENLET
+# ============================================
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope (PEP 3333)"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def response_start(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    }
+
+
+def call_wsgi(wsgi_app, environ, send, client):
+    """Run the WSGI app in the greenlet and send its response.
+
+    A body with a Content-Length goes out in one message; a streamed one
+    (no length) is sent as it is produced, until ``client['gone']``.
+    """
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = status
+        started['headers'] = headers
+
+    result = wsgi_app(environ, start_response)
+    try:
+        if any(name.lower() == 'content-length' for name, _ in started['headers']):
+            body = b''.join(result)
+            await_(send(response_start(started['status'], started['headers'])))
+            await_(send({'type': 'http.response.body', 'body': body}))
+            return
+        await_(send(response_start(started['status'], started['headers'])))
+        for chunk in result:
+            if client['gone']:
+                return
+            if chunk:
+                await_(send({'type': 'http.response.body', 'body': chunk, 'more_body': True}))
+        await_(send({'type': 'http.response.body', 'body': b''}))
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+async def read_body(receive):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def watch_disconnect(receive, client):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    client['gone'] = True
+
+
+class BridgeApp:
+    """ASGI application serving a WSGI app through aiobridge"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        body = await read_body(receive)
+        if body is None:
+            await send({'type': 'http.response.start', 'status': 413, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        client = {'gone': False}
+        watcher = asyncio.ensure_future(watch_disconnect(receive, client))
+        try:
+            await aiobridge.run_sync(call_wsgi, self.wsgi_app, build_environ(scope, body), send, client)
+        finally:
+            watcher.cancel()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_async_clients()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+install_async_clients()
+app = BridgeApp(bot.app)
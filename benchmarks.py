@@ -0,0 +1,150 @@
+"""
+Micro-benchmarks for catalog formatting and pricing hot paths.
+
+    python benchmarks.py                          # 1k, 10k, 50k products
+    python benchmarks.py --sizes 1000 --repeat 3
+    python benchmarks.py --compare benchmarks-abc1234.json
+
+Times ``is_discount_excluded``, ``get_b2b_price``, ``format_product_list``,
+``format_b2b_product_list``, ``format_subscription_product_list`` and
+``format_product_details`` over synthetic catalogs. Everything that goes
+through the price table or the fragment cache is measured cold (both emptied
+before every repeat) and warm. Results are written as
+JSON tagged with the git commit so runs can be compared across commits.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import synthetic
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_bot():
+    """Import the bot without touching any upstream"""
+    os.environ.setdefault('TWILIO_ACCOUNT_SID', 'AC' + '0' * 32)
+    os.environ.setdefault('TWILIO_AUTH_TOKEN', 'benchmark')
+    import logging
+    logging.disable(logging.INFO)
+    import app as bot
+    return bot
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def measure(func, items, repeat, before=None):
+    """Run ``func`` over ``items`` ``repeat`` times; return ns per call stats"""
+    runs = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        started = time.perf_counter_ns()
+        for item in items:
+            func(item)
+        runs.append((time.perf_counter_ns() - started) / max(len(items), 1))
+    return {
+        'calls': len(items),
+        'min_ns': round(min(runs), 1),
+        'median_ns': round(statistics.median(runs), 1),
+        'max_ns': round(max(runs), 1),
+    }
+
+
+def chunks(products, size):
+    return [products[i:i + size] for i in range(0, len(products), size)]
+
+
+def run_suite(bot, catalog, repeat):
+    customer = bot.get_or_create_customer('whatsapp:+300000000000')
+    business = dict(customer, is_business=True)
+    pages = chunks(catalog, 20)
+    b2b_pages = chunks(catalog, 15)
+
+    def cold():
+        bot.price_table.invalidate()
+        bot.fragments.invalidate()
+
+    results = {
+        'is_discount_excluded': measure(bot.is_discount_excluded, catalog, repeat),
+    }
+    cached_benches = {
+        'get_b2b_price': (bot.get_b2b_price, catalog),
+        'format_product_details': (lambda p: bot.format_product_details(p, customer), catalog),
+        'format_product_details_business': (lambda p: bot.format_product_details(p, business), catalog),
+        'format_product_list': (lambda page: bot.format_product_list(page, 'Bench'), pages),
+        'format_product_list_page2': (lambda page: bot.format_product_list(page, 'Bench', page=2), pages),
+        'format_b2b_product_list': (lambda page: bot.format_b2b_product_list(page, 'Bench'), b2b_pages),
+        'format_subscription_product_list': (
+            lambda page: bot.format_subscription_product_list(page, 'Bench'), b2b_pages),
+    }
+    for name, (func, items) in cached_benches.items():
+        results[f'{name}[cold]'] = measure(func, items, repeat, before=cold)
+        results[f'{name}[warm]'] = measure(func, items, repeat)
+    return results
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, encoding='utf-8') as fh:
+        baseline = json.load(fh)
+    print(f"\nvs {baseline.get('commit')} ({baseline_path}):")
+    for size, benches in current['results'].items():
+        old = baseline.get('results', {}).get(size, {})
+        for name, stats in benches.items():
+            if name in old and old[name]['median_ns']:
+                ratio = stats['median_ns'] / old[name]['median_ns']
+                flag = '  REGRESSION' if ratio > 1.10 else ''
+                print(f"  {size:>6} {name:<42} x{ratio:5.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sizes', default='1000,10000,50000', help='comma-separated catalog sizes')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='JSON output path (default benchmarks-<commit>.json)')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    args = parser.parse_args(argv)
+
+    bot = load_bot()
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': {},
+    }
+    for size in [int(s) for s in args.sizes.split(',')]:
+        catalog = synthetic.generate_catalog(size, seed=args.seed)
+        results = run_suite(bot, catalog, args.repeat)
+        report['results'][str(size)] = results
+        print(f"\n{size} products")
+        for name, stats in results.items():
+            print(f"  {name:<42} {stats['median_ns'] / 1000:>10.2f} µs/call  (min {stats['min_ns'] / 1000:.2f})")
+
+    output = args.output or os.path.join(HERE, f'benchmarks-{commit}.json')
+    with open(output, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nSaved {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
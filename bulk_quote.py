@@ -0,0 +1,155 @@
+"""
+Bulk B2B quotes from a pasted list.
+
+A wholesale customer pastes one item per line, a SKU or a product name with
+a quantity in any of the usual spellings::
+
+    SKU123 x 10
+    10 x Pampers Premium Care Jumbo 4
+    Kera Bed XL - 5 τεμ
+
+Numbers that belong to the product name stay in it: 'x' needs spaces on
+both sides to mean "times" ('75×90' is a size), and a pack size at the end
+of a name ('30τμχ') only counts as a quantity after a separator.
+
+``parse_lines`` turns the text into (query, quantity) pairs, the bot resolves
+every SKU-looking query in one WooCommerce call, ``NameMatcher`` resolves the
+rest against the B2B catalog locally, and ``build_quote`` prices the lot and
+applies the free-shipping threshold.
+"""
+import re
+from decimal import Decimal
+from typing import NamedTuple
+
+from lexicon import normalize
+
+MAX_LINES = 50
+MAX_QUANTITY = 10000
+
+# A bare trailing number is a size ('Pampers Jumbo 4') unless the query is a SKU,
+# and so is '75×90' or a trailing '30τμχ' (pack size) without a separator before it
+_LEADING_QTY = re.compile(r'^(\d{1,5})\s*(?:x|×|\*|τεμ\.?|τμχ\.?|pcs)\s+(.+)$', re.IGNORECASE)
+_TRAILING_QTY = re.compile(r'^(.+?)(?:\s+[x×*]\s+|\s*[:=,;]\s*|\s+-\s*)(\d{1,5})\s*(?:τεμ\.?|τμχ\.?|τεμάχια|pcs)?$',
+                           re.IGNORECASE)
+_SKU_QTY = re.compile(r'^(\S+)\s+(\d{1,5})$')
+_BULLET = re.compile(r'^\s*(?:[-•*]|\d{1,2}[.)])\s+')
+_SKU = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._/-]*\d[A-Za-z0-9._/-]*$')
+
+
+def parse_line(line):
+    """(query, quantity) for one pasted line, or None if it is blank"""
+    line = _BULLET.sub('', line).strip()
+    if not line:
+        return None
+    match = _LEADING_QTY.match(line)
+    if match:
+        return match.group(2).strip(), min(int(match.group(1)), MAX_QUANTITY)
+    match = _TRAILING_QTY.match(line)
+    if not match:
+        match = _SKU_QTY.match(line)
+        if match and not looks_like_sku(match.group(1)):
+            match = None
+    if match:
+        return match.group(1).strip(), min(int(match.group(2)), MAX_QUANTITY)
+    return line, 1
+
+
+def parse_lines(text):
+    """Parsed items of a pasted list (at most MAX_LINES), blank lines skipped"""
+    items = []
+    for line in text.splitlines():
+        item = parse_line(line)
+        if item is not None and item[1] > 0:
+            items.append(item)
+    return items[:MAX_LINES]
+
+
+def looks_like_sku(query):
+    return ' ' not in query and bool(_SKU.match(query))
+
+
+class NameMatcher:
+    """Resolve free-form product names against a product list.
+
+    Names are folded with the lexicon's Greek/Greeklish normalisation, so
+    'παμπερς jumbo 4' and 'Pampers Jumbo 4' meet on the same tokens; the
+    product sharing the most query tokens wins, ties going to the shorter
+    name. At least half of the query's tokens must match.
+    """
+
+    def __init__(self, products):
+        self._entries = [(set(normalize(p.get('name', '')).split()), p) for p in products]
+
+    def match(self, query):
+        tokens = set(normalize(query).split())
+        if not tokens:
+            return None
+        best, best_key = None, None
+        for name_tokens, product in self._entries:
+            shared = len(tokens & name_tokens)
+            if shared * 2 < len(tokens):
+                continue
+            key = (shared, -len(name_tokens))
+            if best_key is None or key > best_key:
+                best, best_key = product, key
+        return best
+
+
+class QuoteLine(NamedTuple):
+    product: dict
+    quantity: int
+    unit_price: Decimal
+    discounted: bool
+
+    @property
+    def total(self):
+        return self.unit_price * self.quantity
+
+
+class Quote(NamedTuple):
+    lines: list
+    unresolved: list
+    subtotal: Decimal
+    shipping: Decimal
+    free_shipping_at: Decimal
+
+    @property
+    def total(self):
+        return self.subtotal + self.shipping
+
+    @property
+    def missing_for_free_shipping(self):
+        return max(self.free_shipping_at - self.subtotal, Decimal('0'))
+
+
+def build_quote(resolved, unresolved, prices, min_order_free_shipping, shipping_cost):
+    """Price resolved (product, quantity) pairs.
+
+    ``prices(product)`` returns a pricing.Prices; products without a B2B
+    price (fixed-price ones) are quoted at retail. Items of the same product
+    are merged.
+    """
+    merged = {}
+    for product, quantity in resolved:
+        key = product.get('id')
+        if key in merged:
+            merged[key][1] += quantity
+        else:
+            merged[key] = [product, quantity]
+
+    lines = []
+    for product, quantity in merged.values():
+        product_prices = prices(product)
+        unit = product_prices.b2b
+        discounted = unit is not None
+        if unit is None:
+            unit = product_prices.retail
+        if unit is None:
+            unresolved.append(product.get('name', str(product.get('id'))))
+            continue
+        lines.append(QuoteLine(product, quantity, unit, discounted))
+
+    subtotal = sum((line.total for line in lines), Decimal('0'))
+    free_at = Decimal(str(min_order_free_shipping))
+    shipping = Decimal('0') if not lines or subtotal >= free_at else Decimal(str(shipping_cost))
+    return Quote(lines, unresolved, subtotal, shipping, free_at)
@@ -0,0 +1,82 @@
+"""
+Lazily built upstream clients.
+
+SDK imports and client construction happen on first use instead of at
+import time, so gunicorn workers boot fast and a preloading master never
+opens connections that forked workers would then share.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class LazyClient:
+    """Thread-safe proxy that builds its client on first attribute access.
+
+    ``factory`` returns the client (or None when it is not configured);
+    ``enabled`` is a cheap check used for truthiness before the client has
+    been built, e.g. "is there an API key".
+    """
+
+    def __init__(self, name, factory, enabled=None):
+        self._name = name
+        self._factory = factory
+        self._enabled = enabled
+        self._client = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        """Return the client, building it once; None if unavailable"""
+        client = self._client
+        if client is not None or self._failed:
+            return client
+        with self._lock:
+            if self._client is None and not self._failed:
+                try:
+                    self._client = self._factory()
+                except Exception as e:
+                    logger.warning("⚠️ %s client unavailable: %s", self._name, e)
+                    self._client = None
+                self._failed = self._client is None
+                if self._client is not None:
+                    logger.info("✅ %s client initialized", self._name)
+            return self._client
+
+    def set(self, client):
+        """Install a ready-made client (tests, load tests)"""
+        with self._lock:
+            self._client = client
+            self._failed = client is None
+
+    def reset(self, factory=None):
+        """Drop the client (and optionally swap the factory); the next use builds a new one"""
+        with self._lock:
+            if factory is not None:
+                self._factory = factory
+            self._client = None
+            self._failed = False
+
+    @property
+    def initialized(self):
+        return self._client is not None
+
+    def __bool__(self):
+        if self._client is not None:
+            return True
+        if self._failed:
+            return False
+        if self._enabled is not None:
+            return bool(self._enabled())
+        return self.resolve() is not None
+
+    def __getattr__(self, attr):
+        client = self.resolve()
+        if client is None:
+            raise RuntimeError(f"{self._name} client is not available")
+        return getattr(client, attr)
+
+    def __repr__(self):
+        state = 'ready' if self._client is not None else ('unavailable' if self._failed else 'lazy')
+        return f"<LazyClient {self._name} ({state})>"
@@ -0,0 +1,98 @@
+"""
+Per-request time budget.
+
+Twilio waits a fixed time for the webhook's TwiML. ``scope(seconds)`` starts
+a deadline for the current request (a contextvar, so it follows the request
+through threads' and greenlets' own contexts), upstream wrappers size their
+timeouts with ``timeout(cap)``, and a call that cannot fit in what is left
+raises ``DeadlineExceeded`` so the handler can fall back to a degraded reply.
+"""
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Below this an upstream call is not worth starting
+MIN_UPSTREAM_SECONDS = 0.25
+
+_current = contextvars.ContextVar('whatsapp_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Not enough of the request budget left for an upstream call"""
+
+
+class Deadline:
+    """Absolute expiry on the monotonic clock"""
+
+    __slots__ = ('budget', 'expires')
+
+    def __init__(self, seconds):
+        self.budget = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+
+@contextmanager
+def scope(seconds):
+    """Run the block under a deadline ``seconds`` from now"""
+    token = _current.set(Deadline(seconds))
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def remaining():
+    """Seconds left for this request, or None outside a deadline"""
+    deadline = _current.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def timeout(cap, minimum=MIN_UPSTREAM_SECONDS):
+    """Timeout for an upstream call: what is left of the budget, at most ``cap``"""
+    left = remaining()
+    if left is None:
+        return cap
+    if left < minimum:
+        raise DeadlineExceeded(f"{max(left, 0) * 1000:.0f} ms left")
+    return min(cap, left)
+
+
+def is_timeout(exc):
+    """True for deadline misses and the timeouts upstream clients raise"""
+    # requests' Timeout/ReadTimeout, anthropic's APITimeoutError, ...
+    return isinstance(exc, (DeadlineExceeded, TimeoutError)) or 'Timeout' in type(exc).__name__
+
+
+class FallbackCache:
+    """Last good upstream answers, served when the deadline runs short"""
+
+    def __init__(self, maxsize=500):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,371 @@
+"""
+Append-only interaction event log, and the CLI that aggregates it.
+
+The bot calls ``EventLog.record(kind, ...)`` for state transitions,
+searches, product views, orders, subscriptions and AI calls. Records are
+buffered in memory and a writer thread appends them once a second as
+compact JSON lines (short keys: ``t`` time, ``k`` kind, ``u`` hashed user,
+``s`` store) to ``events-<pid>-<started>-<n>.jsonl`` in ``EVENT_LOG_DIR``;
+a file is closed and a new one started past ``EVENT_LOG_MAX_MB``. Each
+worker writes its own files, so lines never interleave.
+
+    python eventlog.py report /tmp/carestores-events
+    python eventlog.py report events/ --since 2026-01-01 --json
+    python eventlog.py cat events/ --kind search
+
+``report`` streams the files merged in time order and keeps memory bounded
+however large the log is: funnels are counted per session (30 minutes of
+inactivity ends one) with at most ``--max-sessions`` open at a time, and
+zero-result searches are ranked with a fixed-size Space-Saving sketch.
+"""
+import argparse
+import atexit
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+TRANSITION = 'transition'
+SEARCH = 'search'
+PRODUCT_VIEW = 'product_view'
+ORDER = 'order'
+SUBSCRIPTION = 'subscription'
+AI_CALL = 'ai_call'
+
+FILE_PREFIX = 'events-'
+FILE_SUFFIX = '.jsonl'
+
+
+def user_key(phone):
+    """Stable pseudonymous id for a phone number (the log never holds numbers)"""
+    return hashlib.blake2b(str(phone).encode(), digest_size=8).hexdigest()
+
+
+# ============================================
+# WRITER
+# ============================================
+class EventLog:
+    """Buffered, size-rotated JSONL writer; one file series per process"""
+
+    def __init__(self, directory, max_bytes=32 * 1024 * 1024, flush_every=1.0, max_buffer=50000, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.flush_every = flush_every
+        self.max_buffer = max_buffer
+        self.enabled = enabled
+        self.written = 0
+        self.dropped = 0
+        self.files = 0
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Also runs in a forked child: the parent's buffer, file and thread are not ours
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._writer = None
+        self._file = None
+        self._file_bytes = 0
+        self._series = f"{os.getpid()}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        self._numbers = itertools.count(1)
+
+    def record(self, kind, user=None, store=None, **fields):
+        """Queue one event; never blocks on disk"""
+        if not self.enabled:
+            return
+        entry = {'t': round(time.time(), 3), 'k': kind}
+        if user is not None:
+            entry['u'] = user
+        if store is not None:
+            entry['s'] = store
+        entry.update(fields)
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                return
+            self._buffer.append(entry)
+            if self._writer is None or not self._writer.is_alive():
+                # Started on first use, so a preloading master never owns the thread
+                self._writer = threading.Thread(target=self._run, name='event-log', daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_every)
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far"""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        data = ''.join(json.dumps(entry, ensure_ascii=False, separators=(',', ':'), default=str) + '\n'
+                       for entry in batch).encode('utf-8')
+        try:
+            if self._file is None or self._file_bytes + len(data) > self.max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+        except OSError as e:
+            self.dropped += len(batch)
+            logger.error("❌ Event log write failed: %s", e)
+            return
+        self._file_bytes += len(data)
+        self.written += len(batch)
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{FILE_PREFIX}{self._series}-{next(self._numbers):04d}{FILE_SUFFIX}")
+        self._file = open(path, 'ab')
+        self._file_bytes = self._file.tell()
+        self.files += 1
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'directory': self.directory,
+            'written': self.written,
+            'buffered': len(self._buffer),
+            'dropped': self.dropped,
+            'files': self.files,
+        }
+
+
+def open_event_log():
+    """The bot's event log, configured from the environment"""
+    log = EventLog(
+        directory=os.environ.get('EVENT_LOG_DIR') or os.path.join(tempfile.gettempdir(), 'carestores-events'),
+        max_bytes=int(float(os.environ.get('EVENT_LOG_MAX_MB', 32)) * 1024 * 1024),
+        flush_every=float(os.environ.get('EVENT_LOG_FLUSH_SECONDS', 1)),
+        enabled=os.environ.get('EVENT_LOG', '1') != '0',
+    )
+    atexit.register(log.close)
+    return log
+
+
+# ============================================
+# READER
+# ============================================
+def log_files(paths):
+    """Event files under ``paths`` grouped per writer series, each in write order"""
+    series = {}
+    for path in paths:
+        names = [os.path.join(path, name) for name in os.listdir(path)] if os.path.isdir(path) else [path]
+        for name in names:
+            base = os.path.basename(name)
+            if base.startswith(FILE_PREFIX) and base.endswith(FILE_SUFFIX):
+                # events-<pid>-<started>-<n>.jsonl: everything before <n> names the series
+                series.setdefault(base.rsplit('-', 1)[0], []).append(name)
+    return [sorted(files) for _, files in sorted(series.items())]
+
+
+def _read_series(files):
+    for path in files:
+        with open(path, encoding='utf-8') as handle:
+            for line in handle:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # a torn last line from a killed worker
+
+
+def read_events(paths, since=None, until=None, kinds=None):
+    """Events from all writers merged by time, streamed"""
+    merged = heapq.merge(*(_read_series(files) for files in log_files(paths)), key=lambda e: e.get('t', 0))
+    for event in merged:
+        t = event.get('t', 0)
+        if since is not None and t < since:
+            continue
+        if until is not None and t >= until:
+            continue
+        if kinds and event.get('k') not in kinds:
+            continue
+        yield event
+
+
+# ============================================
+# AGGREGATION
+# ============================================
+class SpaceSaving:
+    """Approximate top-k counter in ``capacity`` slots (Metwally et al.)"""
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, item):
+        if item in self.counts:
+            self.counts[item] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = 1
+        else:
+            smallest = min(self.counts, key=self.counts.get)
+            self.counts[item] = self.counts.pop(smallest) + 1
+
+    def top(self, n):
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:n]
+
+
+FUNNEL = ('visit', PRODUCT_VIEW, 'checkout')
+
+
+class Report:
+    """Single-pass aggregates over a time-ordered event stream"""
+
+    def __init__(self, session_gap=1800, max_sessions=100000, top_capacity=1000):
+        self.session_gap = session_gap
+        self.max_sessions = max_sessions
+        self.events = 0
+        self.kinds = {}
+        self.funnel = dict.fromkeys(FUNNEL, 0)
+        self.sessions = OrderedDict()  # user -> (last seen, furthest funnel stage index)
+        self.zero_results = SpaceSaving(top_capacity)
+        self.searches = 0
+        self.orders = {}
+        self.ai = {'calls': 0, 'failed': 0, 'ms': 0}
+        self.first = None
+        self.last = None
+
+    def add(self, event):
+        kind = event.get('k')
+        t = event.get('t', 0)
+        self.events += 1
+        self.kinds[kind] = self.kinds.get(kind, 0) + 1
+        self.first = t if self.first is None else self.first
+        self.last = t
+
+        if kind == SEARCH:
+            self.searches += 1
+            if not event.get('n'):
+                self.zero_results.add(' '.join(str(event.get('q', '')).lower().split()))
+        elif kind in (ORDER, SUBSCRIPTION):
+            channel = event.get('via', kind) if kind == ORDER else SUBSCRIPTION
+            store = self.orders.setdefault(event.get('s') or '?', {})
+            store[channel] = store.get(channel, 0) + 1
+        elif kind == AI_CALL:
+            self.ai['calls'] += 1
+            self.ai['failed'] += 0 if event.get('ok', True) else 1
+            self.ai['ms'] += event.get('ms', 0)
+
+        user = event.get('u')
+        if user is not None:
+            self._advance(user, t, kind)
+
+    def _stage(self, kind):
+        if kind in (ORDER, SUBSCRIPTION):
+            return 2
+        if kind == PRODUCT_VIEW:
+            return 1
+        return 0
+
+    def _advance(self, user, t, kind):
+        # Close sessions idle past the gap (the oldest are at the front)
+        while self.sessions:
+            oldest, (seen, stage) = next(iter(self.sessions.items()))
+            if t - seen <= self.session_gap and len(self.sessions) < self.max_sessions:
+                break
+            self._close(self.sessions.pop(oldest)[1])
+        current = self.sessions.pop(user, None)
+        stage = max(current[1] if current else 0, self._stage(kind))
+        self.sessions[user] = (t, stage)
+
+    def _close(self, stage):
+        for index in range(stage + 1):
+            self.funnel[FUNNEL[index]] += 1
+
+    def finish(self):
+        while self.sessions:
+            self._close(self.sessions.popitem(last=False)[1][1])
+        return self
+
+    def to_dict(self, top=20):
+        visits = self.funnel['visit'] or 1
+        return {
+            'events': self.events,
+            'from': datetime.fromtimestamp(self.first).isoformat(timespec='seconds') if self.first else None,
+            'to': datetime.fromtimestamp(self.last).isoformat(timespec='seconds') if self.last else None,
+            'kinds': self.kinds,
+            'funnel': [{'stage': stage, 'sessions': count, 'rate': round(count / visits, 4)}
+                       for stage, count in self.funnel.items()],
+            'searches': self.searches,
+            'zero_result_searches': [{'query': query, 'count': count} for query, count in self.zero_results.top(top)],
+            'orders_by_store': self.orders,
+            'ai': dict(self.ai, avg_ms=round(self.ai['ms'] / self.ai['calls']) if self.ai['calls'] else None),
+        }
+
+
+def print_report(report, out=sys.stdout):
+    out.write(f"📊 {report['events']} events, {report['from']} → {report['to']}\n\n")
+    out.write("Funnel (sessions)\n")
+    for step in report['funnel']:
+        out.write(f"  {step['stage']:<14}{step['sessions']:>10}  {step['rate']:>7.1%}\n")
+    out.write(f"\nZero-result searches ({report['searches']} searches)\n")
+    for item in report['zero_result_searches']:
+        out.write(f"  {item['count']:>6}  {item['query']}\n")
+    out.write("\nOrders by store\n")
+    for store, channels in sorted(report['orders_by_store'].items()):
+        detail = ', '.join(f"{channel} {count}" for channel, count in sorted(channels.items()))
+        out.write(f"  {store:<14}{sum(channels.values()):>6}  ({detail})\n")
+    ai = report['ai']
+    out.write(f"\nAI calls: {ai['calls']} ({ai['failed']} failed, avg {ai['avg_ms']} ms)\n")
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name in ('report', 'cat'):
+        command = commands.add_parser(name)
+        command.add_argument('paths', nargs='+', help='event log directories or files')
+        command.add_argument('--since', help='ISO date/time, inclusive')
+        command.add_argument('--until', help='ISO date/time, exclusive')
+    commands.choices['report'].add_argument('--json', action='store_true', help='print the report as JSON')
+    commands.choices['report'].add_argument('--top', type=int, default=20)
+    commands.choices['report'].add_argument('--max-sessions', type=int, default=100000)
+    commands.choices['cat'].add_argument('--kind', action='append', help='only these kinds (repeatable)')
+    args = parser.parse_args(argv)
+
+    events = read_events(args.paths, _timestamp(args.since), _timestamp(args.until),
+                         getattr(args, 'kind', None))
+    if args.command == 'cat':
+        for event in events:
+            sys.stdout.write(json.dumps(event, ensure_ascii=False) + '\n')
+        return 0
+
+    report = Report(max_sessions=args.max_sessions)
+    for event in events:
+        report.add(event)
+    result = report.finish().to_dict(args.top)
+    if args.json:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print_report(result)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
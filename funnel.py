@@ -0,0 +1,190 @@
+"""
+Live conversion funnel and state-transition counters.
+
+``FunnelCounters`` keeps per-minute buckets in a fixed ring of ``window``
+slots, so memory stays constant however long the process runs: a bucket is
+cleared when its slot comes round again. The bot counts every
+``session['state']`` change (``transition``) and the funnel steps menu ->
+category -> product -> purchase / subscription (``step``).
+
+Each worker also writes its ring to ``<directory>/funnel-<pid>.json`` every
+``publish_every`` seconds (write + rename, so readers never see half a
+file). ``merged()`` sums the files of every worker in that shared
+directory, including workers that have since exited, as long as their
+minutes are still inside the window.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('menu', 'category', 'product', 'purchase', 'subscription')
+_STAGE = 's:'
+_TRANSITION = 't:'
+
+
+class FunnelCounters:
+    """Per-minute rolling counters of funnel steps and state transitions"""
+
+    def __init__(self, window=60, directory=None, publish_every=10.0, clock=time.time):
+        self.window = window
+        self.directory = directory
+        self.publish_every = publish_every
+        self.clock = clock
+        self._minutes = [None] * window
+        self._counts = [{} for _ in range(window)]
+        self._lock = threading.Lock()
+        self._publisher = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The parent's counts are its own; a worker starts from zero
+        self._minutes = [None] * self.window
+        self._counts = [{} for _ in range(self.window)]
+        self._lock = threading.Lock()
+        self._publisher = None
+
+    # ----------------------------------------
+    # Counting
+    # ----------------------------------------
+    def _inc(self, key):
+        minute = int(self.clock() // 60)
+        slot = minute % self.window
+        with self._lock:
+            if self._minutes[slot] != minute:
+                self._minutes[slot] = minute
+                self._counts[slot] = {}
+            counts = self._counts[slot]
+            counts[key] = counts.get(key, 0) + 1
+        if self.directory and (self._publisher is None or not self._publisher.is_alive()):
+            self._start_publisher()
+
+    def step(self, stage):
+        self._inc(_STAGE + stage)
+
+    def transition(self, old, new):
+        self._inc(f"{_TRANSITION}{old}>{new}")
+
+    def buckets(self):
+        """{minute: {key: count}} for the minutes still inside the window"""
+        oldest = int(self.clock() // 60) - self.window + 1
+        with self._lock:
+            return {minute: dict(counts) for minute, counts in zip(self._minutes, self._counts)
+                    if minute is not None and minute >= oldest}
+
+    # ----------------------------------------
+    # Sharing across workers
+    # ----------------------------------------
+    def _start_publisher(self):
+        with self._lock:
+            if self._publisher is not None and self._publisher.is_alive():
+                return
+            # Started on first use, so a preloading master never owns the thread
+            self._publisher = threading.Thread(target=self._run, name='funnel-publisher', daemon=True)
+            self._publisher.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.publish_every)
+            self.publish()
+
+    def _path(self):
+        return os.path.join(self.directory, f"funnel-{os.getpid()}.json")
+
+    def publish(self):
+        """Write this worker's buckets to the shared directory"""
+        if not self.directory:
+            return
+        path = self._path()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(f"{path}.tmp", 'w') as handle:
+                json.dump({'pid': os.getpid(), 'written': self.clock(), 'buckets': self.buckets()}, handle)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning("⚠️ Funnel counters not published: %s", e)
+
+    def merged(self):
+        """(buckets summed over all workers, number of workers included)"""
+        if not self.directory:
+            return self.buckets(), 1
+        self.publish()
+        oldest = int(self.clock() // 60) - self.window + 1
+        total, workers = {}, 0
+        try:
+            names = [name for name in os.listdir(self.directory)
+                     if name.startswith('funnel-') and name.endswith('.json')]
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as handle:
+                    data = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            if data.get('written', 0) < (oldest - 1) * 60:
+                # Nothing of that worker is left in the window
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            workers += 1
+            for minute, counts in data.get('buckets', {}).items():
+                if int(minute) < oldest:
+                    continue
+                bucket = total.setdefault(int(minute), {})
+                for key, count in counts.items():
+                    bucket[key] = bucket.get(key, 0) + count
+        return total, workers
+
+    # ----------------------------------------
+    # Report
+    # ----------------------------------------
+    def report(self, minutes=None, merge=True):
+        minutes = min(minutes or self.window, self.window)
+        buckets, workers = self.merged() if merge else (self.buckets(), 1)
+        oldest = int(self.clock() // 60) - minutes + 1
+        stages = dict.fromkeys(STAGES, 0)
+        transitions = {}
+        per_minute = []
+        for minute in sorted(buckets):
+            if minute < oldest:
+                continue
+            row = {'minute': time.strftime('%Y-%m-%dT%H:%M', time.localtime(minute * 60))}
+            for key, count in buckets[minute].items():
+                if key.startswith(_STAGE):
+                    stage = key[len(_STAGE):]
+                    stages[stage] = stages.get(stage, 0) + count
+                    row[stage] = count
+                else:
+                    transitions[key[len(_TRANSITION):]] = transitions.get(key[len(_TRANSITION):], 0) + count
+            per_minute.append(row)
+
+        funnel = []
+        top = stages['menu']
+        previous = None
+        for stage in STAGES:
+            count = stages[stage]
+            # Purchase and subscription both follow the product view
+            base = stages['product'] if stage == 'subscription' else previous
+            funnel.append({
+                'stage': stage,
+                'count': count,
+                'from_previous': round(count / base, 4) if base else None,
+                'from_menu': round(count / top, 4) if top else None,
+            })
+            previous = count
+        return {
+            'window_minutes': minutes,
+            'workers': workers,
+            'funnel': funnel,
+            'transitions': [{'from': key.split('>', 1)[0], 'to': key.split('>', 1)[1], 'count': count}
+                            for key, count in sorted(transitions.items(), key=lambda item: -item[1])],
+            'per_minute': per_minute,
+        }
@@ -0,0 +1,63 @@
+"""
+Gunicorn settings.
+
+The app is imported once in the master (``preload_app``) so the screen
+cache, lexicons and compiled state machine are built a single time and
+shared copy-on-write by the forked workers. Upstream clients are lazy and
+are only created inside workers.
+
+    WEB_CONCURRENCY=1 GUNICORN_THREADS=8 GUNICORN_PRELOAD=1
+
+Keep one worker. Sessions, customers, pending reservations, the live feed
+and the caches all live in the worker's memory, so with several workers a
+customer's next message (or a staff dashboard) can land in a worker that
+has never seen them. Add threads, or run asgi.py, for more concurrency.
+
+With SNAPSHOT_DIR set, each worker restores customers and sessions after
+the fork (so a respawned worker picks up what the old one saved) and saves
+them as it exits.
+"""
+import gc
+import os
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+
+def when_ready(server):
+    # Move everything the preloaded app allocated out of the GC's reach so
+    # collections in the workers don't touch (and un-share) those pages
+    if preload_app:
+        gc.collect()
+        gc.freeze()
+        server.log.info("Preloaded app frozen: %d objects shared with workers", gc.get_freeze_count())
+    if server.cfg.workers > 1:
+        server.log.warning("%d workers: conversation state is per worker, replies will lose "
+                           "sessions unless every customer sticks to one worker", server.cfg.workers)
+
+
+def pre_fork(server, worker):
+    worker.fork_started = time.perf_counter()
+
+
+def post_fork(server, worker):
+    # The preloaded master restored at import; read the files present now
+    import app
+    app.state_snapshots.restore()
+
+
+def post_worker_init(worker):
+    import metrics
+    seconds = time.perf_counter() - worker.fork_started
+    metrics.BOOT_SECONDS.set(seconds, phase='worker')
+    worker.log.info("Worker %s booted in %.0f ms", worker.pid, seconds * 1000)
+
+
+def worker_exit(server, worker):
+    # Gunicorn owns the worker's SIGTERM handler; save customers and sessions here
+    import app
+    app.state_snapshots.save('worker_exit')
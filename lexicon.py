@@ -0,0 +1,173 @@
+"""
+Typo-tolerant lookup for menu commands and store names.
+
+Every phrase is folded to a canonical Latin skeleton (accents stripped,
+Greek transliterated, common Greeklish spellings merged), so 'μενού',
+'μενου', 'menou' and 'meno' land on the same key or within a small edit
+distance of it. Near misses are resolved through a BK-tree.
+"""
+import unicodedata
+
+# Greek -> Latin, digraphs first
+_GREEK_DIGRAPHS = [
+    ('ου', 'ou'), ('ει', 'i'), ('οι', 'i'), ('υι', 'i'), ('αι', 'e'),
+    ('αυ', 'af'), ('ευ', 'ef'), ('μπ', 'b'), ('ντ', 'd'), ('γκ', 'g'), ('γγ', 'g'),
+]
+_GREEK_LETTERS = {
+    'α': 'a', 'β': 'v', 'γ': 'g', 'δ': 'd', 'ε': 'e', 'ζ': 'z', 'η': 'i',
+    'θ': 'th', 'ι': 'i', 'κ': 'k', 'λ': 'l', 'μ': 'm', 'ν': 'n', 'ξ': 'ks',
+    'ο': 'o', 'π': 'p', 'ρ': 'r', 'σ': 's', 'ς': 's', 'τ': 't', 'υ': 'i',
+    'φ': 'f', 'χ': 'x', 'ψ': 'ps', 'ω': 'o',
+}
+# Greeklish spellings that mean the same Greek letter
+_LATIN_DIGRAPHS = [
+    ('ch', 'x'), ('kh', 'x'), ('ks', 'x'), ('8', 'th'), ('ei', 'i'), ('oi', 'i'),
+    ('ai', 'e'), ('mp', 'b'), ('nt', 'd'), ('ou', 'u'),
+]
+_LATIN_LETTERS = {'w': 'o', 'y': 'i', 'h': 'x', 'c': 'k', '3': 'e'}
+
+
+def fold_accents(text):
+    """Lowercase and strip accents/diacritics"""
+    decomposed = unicodedata.normalize('NFD', text.lower())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def normalize(text):
+    """Fold text to the canonical Latin skeleton used for matching"""
+    text = ' '.join(fold_accents(text).split())
+    for greek, latin in _GREEK_DIGRAPHS:
+        text = text.replace(greek, latin)
+    text = ''.join(_GREEK_LETTERS.get(ch, ch) for ch in text)
+    for spelling, canonical in _LATIN_DIGRAPHS:
+        text = text.replace(spelling, canonical)
+    return ''.join(_LATIN_LETTERS.get(ch, ch) for ch in text)
+
+
+def edit_distance(a, b):
+    """Levenshtein distance"""
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """Burkhard-Keller tree over normalized keys"""
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def add(self, word):
+        if self._root is None:
+            self._root = (word, {})
+            self._size = 1
+            return
+        node = self._root
+        while True:
+            distance = edit_distance(word, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                self._size += 1
+                return
+            node = child
+
+    def search(self, word, max_distance):
+        """Return [(distance, key)] within ``max_distance``, closest first"""
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            key, children = stack.pop()
+            distance = edit_distance(word, key)
+            if distance <= max_distance:
+                found.append((distance, key))
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for d, child in children.items() if low <= d <= high)
+        found.sort()
+        return found
+
+    def __len__(self):
+        return self._size
+
+
+def max_typos(key):
+    """Edit distance tolerated for a key of this length"""
+    if len(key) <= 3:
+        return 0
+    if len(key) <= 6:
+        return 1
+    return 2
+
+
+class Lexicon:
+    """Phrase -> value lookup with accent, Greeklish and typo tolerance"""
+
+    def __init__(self, phrases=None):
+        self._exact = {}
+        self._normalized = {}
+        self._tree = BKTree()
+        if phrases:
+            for phrase, value in phrases.items():
+                self.add(phrase, value)
+
+    def add(self, phrase, value):
+        self._exact[phrase.lower()] = value
+        key = normalize(phrase)
+        existing = self._normalized.get(key)
+        if existing is not None and existing != value:
+            # Two different targets fold to the same key - keep it exact-only
+            self._normalized[key] = _AMBIGUOUS
+            return
+        self._normalized[key] = value
+        if max_typos(key) and not key.isdigit():
+            self._tree.add(key)
+
+    def lookup(self, text, fuzzy=True):
+        """Return the value for ``text`` or None on a real miss"""
+        value = self._exact.get(text.lower())
+        if value is not None:
+            return value
+
+        if text.isdigit():
+            return None
+        key = normalize(text)
+        value = self._normalized.get(key)
+        if value is not None:
+            return None if value is _AMBIGUOUS else value
+
+        if not fuzzy or len(key) <= 3:
+            return None
+        matches = self._tree.search(key, 2)
+        best = None
+        for distance, candidate in matches:
+            if distance > max_typos(candidate):
+                continue
+            target = self._normalized[candidate]
+            if best is None:
+                best = (distance, target)
+            elif distance == best[0] and target != best[1]:
+                return None
+            elif distance > best[0]:
+                break
+        if best is None or best[1] is _AMBIGUOUS:
+            return None
+        return best[1]
+
+    def __len__(self):
+        return len(self._normalized)
+
+
+_AMBIGUOUS = object()
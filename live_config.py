@@ -0,0 +1,254 @@
+"""
+Hot-reloadable store, promo and category configuration.
+
+The bot's business tables live in a versioned JSON file (store_config.json).
+It is validated as a whole when loaded; a bad edit is logged and ignored,
+leaving the previous configuration in place. ``check()`` is cheap enough to
+call on every request: at most once per ``check_interval`` it stats the file
+and only re-reads it when mtime or size changed. A new configuration is
+swapped in with a single reference assignment and listeners run only for
+the sections whose content changed.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = 1
+
+
+class ConfigError(ValueError):
+    """Configuration file is unreadable or invalid"""
+
+
+# ============================================
+# VALIDATION
+# ============================================
+def _require(condition, message):
+    if not condition:
+        raise ConfigError(message)
+
+
+def _is_str_list(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def _check_fields(where, entry, fields):
+    _require(isinstance(entry, dict), f"{where}: expected an object")
+    for field, kind in fields.items():
+        _require(field in entry, f"{where}: missing '{field}'")
+        _require(isinstance(entry[field], kind), f"{where}.{field}: expected {getattr(kind, '__name__', kind)}")
+
+
+def validate_stores(stores):
+    _require(isinstance(stores, dict) and stores, "stores: expected a non-empty object")
+    for store_id, store in stores.items():
+        where = f"stores.{store_id}"
+        _check_fields(where, store, {
+            'id': str, 'name': str, 'short_name': str, 'address': str, 'phone': str, 'hours': dict,
+            'parking': str, 'google_maps': str, 'waze': str, 'drive_through': bool, 'active': bool,
+        })
+        _require(store['id'] == store_id, f"{where}.id: must equal the key")
+        _check_fields(f"{where}.hours", store['hours'], {'weekdays': str, 'saturday': str, 'sunday': str})
+
+
+def validate_franchise(franchise):
+    _check_fields('franchise', franchise, {'website': str, 'youtube': str, 'email': str, 'benefits': list})
+    _require(_is_str_list(franchise['benefits']), "franchise.benefits: expected a list of strings")
+
+
+def validate_wholesale(wholesale):
+    _check_fields('wholesale', wholesale, {
+        'website': str, 'b2b_portal': str, 'discount': str, 'min_order_free_shipping': (int, float),
+        'shipping_cost': (int, float), 'target_customers': list, 'benefits': list, 'contact_phone': str,
+    })
+    for i, target in enumerate(wholesale['target_customers']):
+        _check_fields(f"wholesale.target_customers[{i}]", target, {'type': str, 'name': str})
+    _require(_is_str_list(wholesale['benefits']), "wholesale.benefits: expected a list of strings")
+
+
+def validate_no_discount(no_discount):
+    _require(isinstance(no_discount, dict), "no_discount: expected an object")
+    for key in ('keywords', 'product_ids', 'categories'):
+        _require(_is_str_list(no_discount.get(key)), f"no_discount.{key}: expected a list of strings")
+
+
+PROMO_MATCHERS = ('product_ids', 'name_all', 'tags', 'categories')
+
+
+def validate_promos(promos):
+    _require(isinstance(promos, dict), "promos: expected an object")
+    for promo_id, promo in promos.items():
+        where = f"promos.{promo_id}"
+        _check_fields(where, promo, {'name': str, 'description': str, 'valid_until': str, 'active': bool, 'type': str})
+        for field in ('valid_from', 'valid_until'):
+            if field in promo:
+                try:
+                    date.fromisoformat(promo[field])
+                except (TypeError, ValueError):
+                    raise ConfigError(f"{where}.{field}: expected YYYY-MM-DD") from None
+        if 'valid_from' in promo:
+            _require(promo['valid_from'] <= promo['valid_until'], f"{where}: valid_from is after valid_until")
+        match = promo.get('match', {})
+        _require(isinstance(match, dict), f"{where}.match: expected an object")
+        for key, value in match.items():
+            _require(key in PROMO_MATCHERS, f"{where}.match.{key}: expected one of {', '.join(PROMO_MATCHERS)}")
+            _require(_is_str_list(value), f"{where}.match.{key}: expected a list of strings")
+        for field in ('badge', 'detail', 'banner'):
+            _require(isinstance(promo.get(field, ''), str), f"{where}.{field}: expected str")
+
+
+def validate_subscription_plans(plans):
+    _require(isinstance(plans, dict) and plans, "subscription_plans: expected a non-empty object")
+    for plan_id, plan in plans.items():
+        where = f"subscription_plans.{plan_id}"
+        _check_fields(where, plan, {'days': int, 'discount': (int, float), 'name': str})
+        _require(plan['days'] > 0, f"{where}.days: must be positive")
+        _require(0 <= plan['discount'] <= 100, f"{where}.discount: must be a percentage")
+
+
+def validate_categories(categories):
+    _require(isinstance(categories, dict) and categories, "categories: expected a non-empty object")
+    expected = [str(i) for i in range(1, len(categories) + 1)]
+    _require(list(categories) == expected, f"categories: keys must be {expected[0]}..{expected[-1]} in order")
+    for key, category in categories.items():
+        _check_fields(f"categories.{key}", category, {'name': str, 'search': str, 'type': str})
+
+
+SECTIONS = {
+    'default_store': lambda value: _require(isinstance(value, str), "default_store: expected a string"),
+    'stores': validate_stores,
+    'franchise': validate_franchise,
+    'wholesale': validate_wholesale,
+    'no_discount': validate_no_discount,
+    'promos': validate_promos,
+    'subscription_plans': validate_subscription_plans,
+    'categories': validate_categories,
+}
+
+
+def validate(data):
+    """Raise ConfigError unless ``data`` is a complete, consistent configuration"""
+    _require(isinstance(data, dict), "config: expected an object")
+    _require(data.get('schema') == SCHEMA, f"schema: expected {SCHEMA}, got {data.get('schema')!r}")
+    _require(isinstance(data.get('version'), int), "version: expected an integer")
+    for section, validator in SECTIONS.items():
+        _require(section in data, f"missing section '{section}'")
+        validator(data[section])
+    default = data['stores'].get(data['default_store'])
+    _require(default is not None and default['active'], "default_store: must name an active store")
+    return data
+
+
+def load_file(path):
+    """Read and validate a configuration file"""
+    try:
+        with open(path, encoding='utf-8') as fh:
+            data = json.load(fh)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"{path}: {e}") from None
+    return validate(data)
+
+
+# ============================================
+# LIVE CONFIG
+# ============================================
+class LiveConfig:
+    """Current configuration plus change detection and per-section listeners"""
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.data = None
+        self.loaded_at = None
+        self.last_error = None
+        self._stamp = None
+        self._next_check = 0.0
+        self._listeners = {}
+        self._reload_lock = threading.Lock()
+
+    def __getitem__(self, section):
+        return self.data[section]
+
+    @property
+    def version(self):
+        return self.data['version'] if self.data else None
+
+    def _file_stamp(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def load(self):
+        """Initial load; raises ConfigError so a bad file fails the boot"""
+        self.data = load_file(self.path)
+        self._stamp = self._file_stamp()
+        self.loaded_at = time.time()
+        self._next_check = time.monotonic() + self.check_interval
+        logger.info("⚙️ Config v%s loaded from %s", self.version, self.path)
+        return self.data
+
+    def on_change(self, section, callback):
+        """Call ``callback(new_value)`` whenever ``section`` changes"""
+        if section not in SECTIONS:
+            raise ConfigError(f"Unknown config section '{section}'")
+        self._listeners.setdefault(section, []).append(callback)
+
+    def check(self):
+        """Reload if the file changed; returns True when a new config was applied"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.check_interval
+        try:
+            stamp = self._file_stamp()
+        except OSError as e:
+            self.last_error = str(e)
+            return False
+        if stamp == self._stamp:
+            return False
+        return self.reload(stamp)
+
+    def reload(self, stamp=None):
+        """Re-read the file now; a bad file leaves the current config in place"""
+        # Only one thread reloads; the others keep serving the current config
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            try:
+                stamp = stamp or self._file_stamp()
+                data = load_file(self.path)
+            except (ConfigError, OSError) as e:
+                self._stamp = stamp
+                self.last_error = str(e)
+                logger.error("⚙️ Config reload rejected, keeping v%s: %s", self.version, e)
+                return False
+            old, self.data = self.data, data
+            self._stamp = stamp
+            self.loaded_at = time.time()
+            self.last_error = None
+            changed = [section for section in SECTIONS if old is None or old[section] != data[section]]
+            logger.info("⚙️ Config v%s -> v%s, changed: %s", old and old['version'], data['version'],
+                        ', '.join(changed) or 'nothing')
+            for section in changed:
+                for callback in self._listeners.get(section, ()):
+                    try:
+                        callback(data[section])
+                    except Exception as e:
+                        logger.error("⚙️ Config listener for '%s' failed: %s", section, e, exc_info=True)
+            return True
+        finally:
+            self._reload_lock.release()
+
+    def status(self):
+        return {
+            'path': self.path,
+            'version': self.version,
+            'loaded_at': datetime.fromtimestamp(self.loaded_at).isoformat(timespec='seconds') if self.loaded_at else None,
+            'last_error': self.last_error,
+            'check_interval': self.check_interval,
+        }
+
@@ -0,0 +1,223 @@
+"""
+Live order feed for store staff.
+
+``FeedHub.publish(store_id, kind, data)`` records an event (pickup,
+reservation, subscription) in the store's bounded replay buffer and wakes
+that store's subscribers. ``stream()`` is the body of a Server-Sent Events
+response: it replays what the client missed (``Last-Event-ID``), then sends
+events as they arrive, with a comment line every ``heartbeat`` seconds so
+proxies keep the connection open and a dead client is noticed.
+
+Event ids are ``<epoch>-<n>``: a counter per store, prefixed with a token
+drawn when the process (or forked worker) starts. A client whose last id
+comes from another boot or worker, or that fell further behind than the
+buffer, gets one ``reset`` event carrying a fresh ``snapshot(store_id)``
+and the current id, and continues from there.
+
+An open stream only parks the request's greenlet in ASGI mode (see
+aiobridge.py); under gunicorn's gthread workers it would hold one of the
+few threads for as long as the dashboard is open. There the feed answers
+in polling mode instead: what is new, then the response ends and the
+browser reconnects after ``poll_retry`` seconds with its Last-Event-ID.
+The hub lives in each worker process.
+"""
+import asyncio
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import deque
+
+import aiobridge
+
+logger = logging.getLogger(__name__)
+
+
+class FeedFull(Exception):
+    """No room for another subscriber in this process"""
+
+
+def _sse(event_id, kind, data):
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"id: {event_id}\nevent: {kind}\ndata: {payload}\n\n".encode('utf-8')
+
+
+class Event:
+    __slots__ = ('id', 'seq', 'store_id', 'kind', 'data', 'time')
+
+    def __init__(self, event_id, seq, store_id, kind, data):
+        self.id = event_id
+        self.seq = seq
+        self.store_id = store_id
+        self.kind = kind
+        self.data = data
+        self.time = time.time()
+
+    def encode(self):
+        return _sse(self.id, self.kind, dict(self.data, time=self.time))
+
+
+class _Waiter:
+    """Wake-up for one subscriber: a threading.Event, or an asyncio.Event when bridged"""
+
+    def __init__(self):
+        if aiobridge.in_bridge():
+            self._loop = asyncio.get_running_loop()
+            self._event = asyncio.Event()
+        else:
+            self._loop = None
+            self._event = threading.Event()
+
+    def wake(self):
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    def wait(self, timeout):
+        if self._loop is None:
+            self._event.wait(timeout)
+            self._event.clear()
+            return
+        try:
+            aiobridge.await_(asyncio.wait_for(self._event.wait(), timeout))
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+
+class FeedHub:
+    """Per-store fan-out of order events with a bounded replay buffer"""
+
+    def __init__(self, replay=200, heartbeat=15.0, max_subscribers=50, poll_retry=5.0, snapshot=None):
+        self.replay = replay
+        self.heartbeat = heartbeat
+        self.max_subscribers = max_subscribers
+        self.poll_retry = poll_retry
+        self.snapshot = snapshot
+        self.published = 0
+        self.epoch = secrets.token_hex(4)
+        self._seqs = {}
+        self._buffers = {}
+        self._waiters = {}
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Each worker numbers its own events, so it needs its own epoch
+        self.epoch = secrets.token_hex(4)
+        self._seqs = {}
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._waiters = {}
+
+    # ----------------------------------------
+    # Publishing
+    # ----------------------------------------
+    def publish(self, store_id, kind, data):
+        """Record an event for ``store_id`` and wake its subscribers"""
+        with self._lock:
+            seq = self._seqs[store_id] = self._seqs.get(store_id, 0) + 1
+            event = Event(f"{self.epoch}-{seq}", seq, store_id, kind, data)
+            buffer = self._buffers.get(store_id)
+            if buffer is None:
+                buffer = self._buffers[store_id] = deque(maxlen=self.replay)
+            buffer.append(event)
+            waiters = list(self._waiters.get(store_id, ()))
+            self.published += 1
+        for waiter in waiters:
+            waiter.wake()
+        return event
+
+    def last_id(self, store_id):
+        return f"{self.epoch}-{self._seqs.get(store_id, 0)}"
+
+    def _position(self, last_id):
+        """Sequence number of ``last_id`` in this boot; 0 for none, None for another boot's id"""
+        if not last_id:
+            return 0
+        epoch, _, seq = str(last_id).rpartition('-')
+        return int(seq) if epoch == self.epoch and seq.isdigit() else None
+
+    def since(self, store_id, last_id):
+        """(events after ``last_id``, True if the client must reset: foreign id or dropped events)"""
+        seq = self._position(last_id)
+        if seq is None:
+            return [], True
+        with self._lock:
+            buffer = list(self._buffers.get(store_id, ()))
+            current = self._seqs.get(store_id, 0)
+        if seq > current or (buffer and seq < buffer[0].seq - 1):
+            return [], True
+        return [event for event in buffer if event.seq > seq], False
+
+    def _catch_up(self, store_id, last_id):
+        """(SSE chunks the client is missing, its last id after them)"""
+        events, reset = self.since(store_id, last_id)
+        if reset:
+            # Id first: events published while the snapshot is taken are sent after it
+            current = self.last_id(store_id)
+            data = dict(self.snapshot(store_id) if self.snapshot else {}, last_id=current)
+            return [_sse(current, 'reset', data)], current
+        return [event.encode() for event in events], events[-1].id if events else last_id
+
+    # ----------------------------------------
+    # Subscribing
+    # ----------------------------------------
+    def _subscribe(self, store_id):
+        with self._lock:
+            if sum(len(waiters) for waiters in self._waiters.values()) >= self.max_subscribers:
+                raise FeedFull(f"{self.max_subscribers} feed subscribers already connected")
+            waiter = _Waiter()
+            self._waiters.setdefault(store_id, set()).add(waiter)
+        return waiter
+
+    def _unsubscribe(self, store_id, waiter):
+        with self._lock:
+            self._waiters.get(store_id, set()).discard(waiter)
+
+    def stream(self, store_id, last_id='', follow=None):
+        """SSE body for one subscriber; raises FeedFull before the first byte.
+
+        ``follow`` keeps the response open; by default only in ASGI mode,
+        otherwise the client polls (see the module docstring).
+        """
+        if follow is None:
+            follow = aiobridge.in_bridge()
+        if not follow:
+            return self._poll(store_id, last_id)
+        waiter = self._subscribe(store_id)
+        return self._stream(store_id, last_id, waiter)
+
+    def _poll(self, store_id, last_id):
+        chunks, _ = self._catch_up(store_id, last_id)
+        yield f"retry: {int(self.poll_retry * 1000)}\n: {store_id}\n\n".encode('utf-8')
+        yield from chunks
+
+    def _stream(self, store_id, last_id, waiter):
+        logger.info("📡 Feed subscriber joined %s (from event %s)", store_id, last_id)
+        try:
+            yield f"retry: 3000\n: {store_id}\n\n".encode('utf-8')
+            while True:
+                chunks, last_id = self._catch_up(store_id, last_id)
+                for chunk in chunks:
+                    yield chunk
+                if not chunks:
+                    waiter.wait(self.heartbeat)
+                    if not self.since(store_id, last_id)[0]:
+                        yield b": keepalive\n\n"
+        finally:
+            self._unsubscribe(store_id, waiter)
+            logger.info("📡 Feed subscriber left %s", store_id)
+
+    def stats(self):
+        return {
+            'epoch': self.epoch,
+            'published': self.published,
+            'subscribers': {store: len(waiters) for store, waiters in self._waiters.items() if waiters},
+            'buffered': {store: len(buffer) for store, buffer in self._buffers.items()},
+            'replay': self.replay,
+        }
@@ -0,0 +1,502 @@
+"""
+Webhook load test with stubbed upstreams.
+
+    python loadtest.py --workers 1,2,4 --threads 1,8 --users 50 --duration 20
+
+For every worker/thread combination this starts gunicorn with
+``loadtest:build_app()``, replays scripted multi-step conversations
+(menu, category, product, purchase, subscription, AI mode) against
+/webhook and reports throughput plus p50/p95/p99 per conversation state.
+Each reply is labelled with the state that actually handled it (the server
+reports it in X-Loadtest-* headers): with several workers a conversation's
+session only lives in the worker that created it, so the next message may
+start over in another worker. Shed and degraded replies are counted per
+state and kept out of the latency columns.
+
+WooCommerce, Twilio, SMTP and Anthropic are replaced by in-process stubs,
+so the run is fully offline. Stub latency is configurable:
+
+    --wc-ms 120 --claude-ms 900 --smtp-ms 300 --twilio-ms 150
+
+Use ``--url http://host:port`` to drive an already running server instead
+(labels then fall back to the scripted state and only shed replies are
+recognised), and ``--asgi`` to run the same matrix against uvicorn with ``asgi.py``
+(stub latency then parks a greenlet instead of a thread).
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from urllib.parse import urlencode, urlparse
+
+import aiobridge
+import synthetic
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# ============================================
+# STUBBED UPSTREAMS
+# ============================================
+def _sleep_ms(ms):
+    if ms > 0:
+        aiobridge.sleep(ms / 1000.0)
+
+
+class StubResponse:
+    """Minimal requests.Response stand-in"""
+
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self._data
+
+
+class StubWooCommerce:
+    """Answers the wc/v3 endpoints the bot uses from a synthetic catalog"""
+
+    TAG_IDS = {'b2b': 1, 'subscribe': 2}
+
+    def __init__(self, catalog, latency_ms=0):
+        self.catalog = catalog
+        self.latency_ms = latency_ms
+        self.by_id = {p['id']: p for p in catalog}
+        self.by_sku = {p['sku']: p for p in catalog}
+        self.by_tag = {}
+        for product in catalog:
+            for tag in product['tags']:
+                self.by_tag.setdefault(tag['id'], []).append(product)
+
+    def get(self, endpoint, params=None, **kwargs):
+        _sleep_ms(self.latency_ms)
+        params = params or {}
+        per_page = int(params.get('per_page', 10))
+        if endpoint == 'products/tags':
+            slug = params.get('slug')
+            return StubResponse([{'id': self.TAG_IDS[slug], 'slug': slug}] if slug in self.TAG_IDS else [])
+        if endpoint != 'products':
+            return StubResponse([])
+        if 'include' in params:
+            ids = [int(i) for i in str(params['include']).split(',') if i]
+            return StubResponse([self.by_id[i] for i in ids if i in self.by_id][:per_page])
+        if 'sku' in params:
+            skus = str(params['sku']).split(',')
+            return StubResponse([self.by_sku[s] for s in skus if s in self.by_sku][:per_page])
+        if 'tag' in params:
+            return StubResponse(self.by_tag.get(int(params['tag']), [])[:per_page])
+        if 'search' in params:
+            terms = [t for t in str(params['search']).lower().split() if t]
+            found = []
+            for product in self.catalog:
+                name = product['name'].lower()
+                if any(t in name for t in terms):
+                    found.append(product)
+                    if len(found) >= per_page:
+                        break
+            return StubResponse(found)
+        return StubResponse(self.catalog[:per_page])
+
+    def post(self, endpoint, data=None, **kwargs):
+        _sleep_ms(self.latency_ms)
+        if endpoint == 'orders/batch':
+            created = [dict(order, id=900000 + i) for i, order in enumerate((data or {}).get('create', []))]
+            return StubResponse({'create': created})
+        return StubResponse(data or {}, 201)
+
+    def put(self, endpoint, data=None, **kwargs):
+        _sleep_ms(self.latency_ms)
+        return StubResponse(data or {})
+
+
+class StubTwilio:
+    """twilio.rest.Client stand-in"""
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.messages = self
+
+    def create(self, **kwargs):
+        _sleep_ms(self.latency_ms)
+        return types.SimpleNamespace(sid='SMloadtest', status='queued')
+
+
+class StubClaude:
+    """anthropic.Anthropic stand-in"""
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.messages = self
+
+    def create(self, model=None, max_tokens=None, system=None, messages=None, **kwargs):
+        _sleep_ms(self.latency_ms)
+        text = "Έχουμε πάνες ενηλίκων Kera και TENA σε όλα τα καταστήματα."
+        return types.SimpleNamespace(
+            content=[types.SimpleNamespace(text=text)],
+            usage=types.SimpleNamespace(input_tokens=len(system or '') // 4, output_tokens=len(text) // 4),
+        )
+
+
+def stub_smtp_module(latency_ms=0):
+    """Module-like object whose SMTP class only sleeps"""
+
+    class StubSMTP:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def starttls(self):
+            pass
+
+        def login(self, user, password):
+            pass
+
+        def send_message(self, msg):
+            _sleep_ms(latency_ms)
+
+    return types.SimpleNamespace(SMTP=StubSMTP)
+
+
+def _env_ms(name, default):
+    return float(os.environ.get(name, default))
+
+
+def install_stubs(bot):
+    """Swap the bot module's upstream clients for offline stubs"""
+    catalog = synthetic.generate_catalog(int(os.environ.get('LOADTEST_CATALOG', 2000)))
+    bot.wcapi.set(bot.metrics.InstrumentedClient(
+        StubWooCommerce(catalog, _env_ms('LOADTEST_WC_MS', 120)), 'woocommerce'))
+    bot.twilio_client.set(StubTwilio(_env_ms('LOADTEST_TWILIO_MS', 150)))
+    bot.claude_client.set(StubClaude(_env_ms('LOADTEST_CLAUDE_MS', 900)))
+    bot.smtplib = stub_smtp_module(_env_ms('LOADTEST_SMTP_MS', 300))
+    bot.EMAIL_CONFIG['smtp_user'] = 'loadtest'
+    bot.EMAIL_CONFIG['smtp_password'] = 'loadtest'
+    return bot
+
+
+def report_outcomes(bot):
+    """Add X-Loadtest-State / X-Loadtest-Outcome headers to webhook replies"""
+    from flask import g, has_request_context, request
+
+    observe_handler = bot.conversation.observer
+    on_degraded = bot.conversation.on_degraded
+    observe_admission = bot.admission.observer
+
+    def observer(key, seconds):
+        if has_request_context():
+            g.loadtest_state = key
+        observe_handler(key, seconds)
+
+    def degraded(key, exc):
+        if has_request_context():
+            g.loadtest_degraded = True
+        on_degraded(key, exc)
+
+    def admission(decision, in_flight):
+        g.loadtest_admission = decision
+        observe_admission(decision, in_flight)
+
+    bot.conversation.observer = observer
+    bot.conversation.on_degraded = degraded
+    bot.admission.observer = admission
+
+    @bot.app.after_request
+    def tag_reply(response):
+        if request.path == '/webhook':
+            if g.get('loadtest_admission') == bot.SHED:
+                outcome = SHED
+            elif g.get('loadtest_degraded'):
+                outcome = DEGRADED
+            elif g.get('loadtest_admission') == bot.FAST_PATH:
+                outcome = FAST_PATH
+            else:
+                outcome = OK
+            response.headers['X-Loadtest-State'] = g.get('loadtest_state', '')
+            response.headers['X-Loadtest-Outcome'] = outcome
+        return response
+
+    return bot
+
+
+def build_app():
+    """WSGI factory for gunicorn: the real bot with stubbed upstreams"""
+    os.environ.setdefault('TWILIO_ACCOUNT_SID', 'AC' + '0' * 32)
+    os.environ.setdefault('TWILIO_AUTH_TOKEN', 'loadtest')
+    import app as bot
+    report_outcomes(install_stubs(bot))
+    return bot.app
+
+
+def build_asgi_app():
+    """ASGI factory for uvicorn: asgi.py with stubbed upstreams"""
+    os.environ.setdefault('TWILIO_ACCOUNT_SID', 'AC' + '0' * 32)
+    os.environ.setdefault('TWILIO_AUTH_TOKEN', 'loadtest')
+    import asgi
+    report_outcomes(install_stubs(asgi.bot))
+    return asgi.app
+
+
+# ============================================
+# CONVERSATION SCRIPTS
+# ============================================
+# (message, state the server is in when it handles the message)
+SCRIPTS = {
+    'browse_purchase': [
+        ('menu', 'cmd:menu'), ('4', 'menu'), ('1', 'categories'),
+        ('more', 'product_list'), ('3', 'product_list'), ('1', 'product_choice'),
+    ],
+    'search_drive_through': [
+        ('menu', 'cmd:menu'), ('1', 'menu'), ('pampers', 'search'),
+        ('2', 'product_list'), ('3', 'product_choice'),
+    ],
+    'popular': [
+        ('menu', 'cmd:menu'), ('2', 'menu'), ('1', 'product_list'), ('menu', 'cmd:menu'),
+    ],
+    'subscription': [
+        ('menu', 'cmd:menu'), ('5', 'menu'), ('1', 'subscription'), ('2', 'product_list'),
+        ('2', 'subscription_frequency'), ('3', 'subscription_day'), ('1', 'subscription_confirm'),
+    ],
+    'wholesale': [
+        ('wholesale', 'cmd:wholesale'), ('7', 'wholesale'), ('1', 'product_list'),
+    ],
+    'ai': [
+        ('ai', 'cmd:ai'), ('Τι πάνες ενηλίκων έχετε;', 'ai'), ('menu', 'ai'),
+    ],
+}
+
+
+OK = 'ok'
+FAST_PATH = 'fast_path'
+DEGRADED = 'degraded'
+SHED = 'shed'
+ERROR = 'error'
+OUTCOMES = (OK, FAST_PATH, DEGRADED, SHED, ERROR)
+
+SHED_TEXT = 'Έχουμε πολύ μεγάλη κίνηση'.encode('utf-8')
+ERROR_TEXT = 'Σφάλμα.'.encode('utf-8')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Thread-safe latency collection per state; only full replies count towards latency"""
+
+    def __init__(self):
+        self.samples = {}
+        self.outcomes = {}
+        self._lock = threading.Lock()
+
+    def add(self, label, seconds, outcome):
+        with self._lock:
+            counts = self.outcomes.setdefault(label, dict.fromkeys(OUTCOMES, 0))
+            counts[outcome] += 1
+            if outcome == OK:
+                self.samples.setdefault(label, []).append(seconds)
+
+    def summary(self, elapsed):
+        totals = dict.fromkeys(OUTCOMES, 0)
+        states = {}
+        for label, counts in sorted(self.outcomes.items()):
+            values = sorted(self.samples.get(label, ()))
+            states[label] = {
+                'n': sum(counts.values()),
+                'p50_ms': round(percentile(values, 50) * 1000, 1),
+                'p95_ms': round(percentile(values, 95) * 1000, 1),
+                'p99_ms': round(percentile(values, 99) * 1000, 1),
+                **{outcome: counts[outcome] for outcome in OUTCOMES if outcome != OK},
+            }
+            for outcome, count in counts.items():
+                totals[outcome] += count
+        total = sum(totals.values())
+        return {
+            'requests': total,
+            'errors': totals[ERROR],
+            'outcomes': totals,
+            'seconds': round(elapsed, 2),
+            'rps': round(total / elapsed, 1) if elapsed else 0.0,
+            'states': states,
+        }
+
+
+def classify(status, data, outcome):
+    """Outcome of one reply; ``outcome`` is the server's X-Loadtest-Outcome, if any"""
+    if status != 200 or b'<Message>' not in data or ERROR_TEXT in data:
+        return ERROR
+    if outcome in OUTCOMES:
+        return outcome
+    return SHED if SHED_TEXT in data else OK
+
+
+def post_message(host, port, body, phone, timeout):
+    """POST one Twilio-style webhook form and return (outcome, server state or None, seconds)"""
+    payload = urlencode({'Body': body, 'From': phone})
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    state = None
+    try:
+        conn.request('POST', '/webhook', payload, {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        data = response.read()
+        state = response.getheader('X-Loadtest-State') or None
+        outcome = classify(response.status, data, response.getheader('X-Loadtest-Outcome'))
+    except (OSError, http.client.HTTPException):
+        outcome = ERROR
+    finally:
+        conn.close()
+    return outcome, state, time.perf_counter() - started
+
+
+def virtual_user(user_id, host, port, stop_at, recorder, timeout):
+    phone = f"whatsapp:+3069{user_id:08d}"
+    names = list(SCRIPTS)
+    turn = user_id
+    while time.monotonic() < stop_at:
+        for message, label in SCRIPTS[names[turn % len(names)]]:
+            if time.monotonic() >= stop_at:
+                return
+            outcome, state, seconds = post_message(host, port, message, phone, timeout)
+            recorder.add(state or label, seconds, outcome)
+        turn += 1
+
+
+def drive(url, users, duration, timeout=35.0):
+    """Run ``users`` concurrent conversations for ``duration`` seconds"""
+    parsed = urlparse(url)
+    recorder = Recorder()
+    stop_at = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=virtual_user, args=(i, parsed.hostname, parsed.port or 80, stop_at, recorder, timeout),
+                         daemon=True)
+        for i in range(users)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.summary(time.perf_counter() - started)
+
+
+# ============================================
+# GUNICORN MATRIX
+# ============================================
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+        try:
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return True
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            conn.close()
+        time.sleep(0.2)
+    return False
+
+
+def start_server(workers, threads, port, env, log, asgi=False):
+    if asgi:
+        cmd = [sys.executable, '-m', 'uvicorn', '--factory', 'loadtest:build_asgi_app', '--workers', str(workers),
+               '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    else:
+        cmd = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', str(threads),
+               '-b', f'127.0.0.1:{port}', '--timeout', '60', '--log-level', 'warning', 'loadtest:build_app()']
+    return subprocess.Popen(cmd, cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def print_summary(title, summary):
+    print(f"\n=== {title} ===")
+    outcomes = summary['outcomes']
+    print(f"requests={summary['requests']} ok={outcomes[OK]} fast_path={outcomes[FAST_PATH]} "
+          f"degraded={outcomes[DEGRADED]} shed={outcomes[SHED]} errors={outcomes[ERROR]} "
+          f"seconds={summary['seconds']} throughput={summary['rps']} msg/s")
+    print(f"{'state':<26}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'fast':>7}{'degr':>7}{'shed':>7}{'err':>7}")
+    for label, row in summary['states'].items():
+        print(f"{label:<26}{row['n']:>7}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}"
+              f"{row[FAST_PATH]:>7}{row[DEGRADED]:>7}{row[SHED]:>7}{row[ERROR]:>7}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--workers', default='1,2', help='comma-separated gunicorn worker counts')
+    parser.add_argument('--threads', default='1,4', help='comma-separated gunicorn thread counts')
+    parser.add_argument('--users', type=int, default=20, help='concurrent simulated customers')
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds per combination')
+    parser.add_argument('--url', help='drive an already running server instead of spawning gunicorn')
+    parser.add_argument('--catalog', type=int, default=2000, help='synthetic catalog size')
+    parser.add_argument('--wc-ms', type=float, default=120.0)
+    parser.add_argument('--claude-ms', type=float, default=900.0)
+    parser.add_argument('--smtp-ms', type=float, default=300.0)
+    parser.add_argument('--twilio-ms', type=float, default=150.0)
+    parser.add_argument('--asgi', action='store_true', help='serve with uvicorn + asgi.py (threads ignored)')
+    parser.add_argument('--json', help='write all results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = []
+    if args.url:
+        summary = drive(args.url, args.users, args.duration)
+        print_summary(args.url, summary)
+        results.append({'url': args.url, **summary})
+    else:
+        env = dict(os.environ,
+                   LOADTEST_CATALOG=str(args.catalog),
+                   LOADTEST_WC_MS=str(args.wc_ms),
+                   LOADTEST_CLAUDE_MS=str(args.claude_ms),
+                   LOADTEST_SMTP_MS=str(args.smtp_ms),
+                   LOADTEST_TWILIO_MS=str(args.twilio_ms))
+        for workers in [int(w) for w in args.workers.split(',')]:
+            for threads in ([1] if args.asgi else [int(t) for t in args.threads.split(',')]):
+                port = free_port()
+                with tempfile.TemporaryFile() as log:
+                    server = start_server(workers, threads, port, env, log, asgi=args.asgi)
+                    try:
+                        if not wait_ready(port):
+                            server.terminate()
+                            server.wait(timeout=30)
+                            log.seek(0)
+                            print(f"{'uvicorn' if args.asgi else 'gunicorn'} w={workers} t={threads} failed to start:\n"
+                                  f"{log.read().decode(errors='replace')[-2000:]}", file=sys.stderr)
+                            continue
+                        summary = drive(f'http://127.0.0.1:{port}', args.users, args.duration)
+                    finally:
+                        server.terminate()
+                        server.wait(timeout=30)
+                mode = 'asgi' if args.asgi else f"threads={threads}"
+                print_summary(f"workers={workers} {mode}", summary)
+                results.append({'workers': workers, 'threads': None if args.asgi else threads,
+                                'asgi': args.asgi, **summary})
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fh:
+            json.dump({'args': vars(args), 'results': results}, fh, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
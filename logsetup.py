@@ -0,0 +1,164 @@
+"""
+Non-blocking structured logging.
+
+Request threads only put the ``LogRecord`` on a queue; a listener thread
+formats it (JSON by default) and writes it to stderr. Message arguments are
+%-style so nothing is formatted for records that are filtered out, and
+chatty info lines logged with ``extra={'sampled': True}`` are kept 1 in N.
+
+    LOG_LEVEL=INFO                          root level
+    LOG_LEVELS=werkzeug=WARNING,app=DEBUG   per-logger levels
+    LOG_FORMAT=json|text
+    LOG_SAMPLE_EVERY=10                     keep every Nth sampled line (1 = all)
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RESERVED = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sampled'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and extras"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep every Nth record marked ``sampled`` per call site; warnings always pass"""
+
+    def __init__(self, every=10):
+        super().__init__()
+        self.every = max(int(every), 1)
+        self._seen = {}
+
+    def filter(self, record):
+        if self.every == 1 or record.levelno > logging.INFO or not getattr(record, 'sampled', False):
+            return True
+        # Racy increments only skew which line is kept, never drop warnings
+        key = (record.name, record.msg)
+        seen = self._seen.get(key, 0)
+        self._seen[key] = seen + 1
+        if seen % self.every:
+            return False
+        record.sample_rate = self.every
+        return True
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue the record as-is; formatting happens on the listener thread.
+
+    The stdlib handler formats in ``prepare`` so records can cross process
+    boundaries; ours never leave the process.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            # Tracebacks reference live frames; render them before they change
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_levels(spec):
+    """``'werkzeug=WARNING,app=DEBUG'`` -> ``{'werkzeug': 'WARNING', 'app': 'DEBUG'}``"""
+    levels = {}
+    for item in (spec or '').split(','):
+        name, sep, level = item.partition('=')
+        if sep and name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+_state = {'handler': None, 'listener': None}
+_lock = threading.Lock()
+
+
+def _start_listener(output, formatter, maxsize):
+    records = queue.Queue(maxsize)
+    stream = logging.StreamHandler(output)
+    stream.setFormatter(formatter)
+    listener = logging.handlers.QueueListener(records, stream, respect_handler_level=False)
+    listener.start()
+    return records, listener
+
+
+def setup_logging(level=None, levels=None, fmt=None, sample_every=None, output=None, maxsize=10000):
+    """Route all logging through a queue and a background writer thread"""
+    level = (level or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+    levels = levels if levels is not None else parse_levels(os.environ.get('LOG_LEVELS', ''))
+    fmt = fmt or os.environ.get('LOG_FORMAT', 'json')
+    sample_every = sample_every or int(os.environ.get('LOG_SAMPLE_EVERY', 10))
+    output = output or sys.stderr
+    if fmt == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    with _lock:
+        if _state['listener'] is not None:
+            _state['listener'].stop()
+        records, listener = _start_listener(output, formatter, maxsize)
+        handler = LocalQueueHandler(records)
+        handler.addFilter(SamplingFilter(sample_every))
+        root = logging.getLogger()
+        for old in list(root.handlers):
+            root.removeHandler(old)
+        root.addHandler(handler)
+        root.setLevel(level)
+        for name, logger_level in levels.items():
+            logging.getLogger(name).setLevel(logger_level)
+        _state.update(handler=handler, listener=listener, output=output, formatter=formatter, maxsize=maxsize)
+    return handler
+
+
+def _restart_after_fork():
+    # The listener thread does not survive fork(); give each worker its own
+    handler = _state['handler']
+    if handler is None:
+        return
+    records, listener = _start_listener(_state['output'], _state['formatter'], _state['maxsize'])
+    handler.queue = records
+    _state['listener'] = listener
+
+
+def shutdown():
+    """Flush queued records (also runs at exit)"""
+    listener = _state['listener']
+    if listener is not None:
+        _state['listener'] = None
+        listener.stop()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+atexit.register(shutdown)
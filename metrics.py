@@ -0,0 +1,276 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+
+Histograms keep fixed buckets per label set, so an observation is a
+bisect plus a few integer increments under a lock - cheap enough to leave
+on in production. Values are per worker process.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value)
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(n, '') for n in self.label_names), 0)
+
+    def collect(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in sorted(items)]
+
+    def snapshot(self):
+        with self._lock:
+            return {'|'.join(key): value for key, value in self._values.items()}
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.label_names)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # bucket counts (+Inf last), sum, count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self):
+        with self._lock:
+            items = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+        lines = []
+        bounds = self.buckets + (float('inf'),)
+        for key, counts, total, count in sorted(items):
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return {'|'.join(key): {'count': series[2], 'sum': series[1]} for key, series in self._series.items()}
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+UPSTREAM_SECONDS = registry.histogram(
+    'whatsapp_upstream_seconds', 'Time spent in upstream calls', labels=('dependency', 'operation'))
+UPSTREAM_ERRORS = registry.counter(
+    'whatsapp_upstream_errors_total', 'Upstream calls that raised', labels=('dependency', 'operation'))
+HANDLER_SECONDS = registry.histogram(
+    'whatsapp_handler_seconds', 'Time spent in conversation state handlers', labels=('state',))
+RENDER_SECONDS = registry.histogram(
+    'whatsapp_render_seconds', 'Time spent formatting replies', labels=('renderer',),
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05))
+WEBHOOK_SECONDS = registry.histogram(
+    'whatsapp_webhook_seconds', 'Total /webhook request time')
+DEGRADATIONS = registry.counter(
+    'whatsapp_deadline_degradations_total', 'Replies degraded because the request deadline ran short',
+    labels=('operation', 'action'))
+ADMISSIONS = registry.counter(
+    'whatsapp_admission_total', 'Webhook admission decisions (admitted, fast_path, shed)', labels=('decision',))
+QUEUE_SECONDS = registry.histogram(
+    'whatsapp_queue_seconds', 'Time between the router stamping X-Request-Start and the app seeing the request')
+ORDERS = registry.counter(
+    'whatsapp_orders_total', 'Queued WooCommerce orders by outcome (created, duplicate, retried, failed)',
+    labels=('outcome',))
+RESERVATIONS = registry.counter(
+    'whatsapp_reservations_total', 'Drive-through reservations by status change (held, collected, expired, cancelled)',
+    labels=('status',))
+FUNNEL_STEPS = registry.counter(
+    'whatsapp_funnel_steps_total', 'Conversion funnel steps (menu, category, product, purchase, subscription)',
+    labels=('stage',))
+BOOT_SECONDS = registry.gauge(
+    'whatsapp_boot_seconds', 'Startup time of this process (import: app module, worker: fork to ready)',
+    labels=('phase',))
+
+
+# Callbacks(dependency, operation, started, seconds, error, attrs) run after
+# every upstream call, e.g. the slow-request tracer
+upstream_hooks = []
+
+
+@contextmanager
+def upstream(dependency, operation, **attrs):
+    """Time one upstream call.
+
+    Yields a dict the caller may fill with details only known after the
+    call (e.g. token counts); hooks receive it together with ``attrs``.
+    """
+    started = time.perf_counter()
+    details = dict(attrs)
+    error = None
+    try:
+        yield details
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        UPSTREAM_ERRORS.inc(dependency=dependency, operation=operation)
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        UPSTREAM_SECONDS.observe(seconds, dependency=dependency, operation=operation)
+        for hook in upstream_hooks:
+            hook(dependency, operation, started, seconds, error, details)
+
+
+def timed_render(func):
+    """Decorator recording formatting time under the function's name"""
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            RENDER_SECONDS.observe(time.perf_counter() - started, renderer=name)
+    return wrapper
+
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def operation_name(endpoint):
+    """Endpoint without query string or numeric ids, to bound label cardinality"""
+    return _ID_SEGMENT.sub('/:id', endpoint.split('?', 1)[0])
+
+
+class InstrumentedClient:
+    """Proxy that times every HTTP-verb call on a REST client.
+
+    ``wcapi.get("products", ...)`` is recorded as operation ``GET products``.
+    Other attributes pass straight through.
+    """
+
+    _VERBS = ('get', 'post', 'put', 'delete', 'options')
+
+    def __init__(self, client, dependency):
+        self._client = client
+        self._dependency = dependency
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in self._VERBS:
+            return attr
+        dependency = self._dependency
+        verb = name.upper()
+
+        def call(endpoint, *args, **kwargs):
+            with upstream(dependency, f"{verb} {operation_name(endpoint)}",
+                          endpoint=endpoint, params=kwargs.get('params')):
+                return attr(endpoint, *args, **kwargs)
+        return call
@@ -0,0 +1,273 @@
+"""
+Background WooCommerce order writer.
+
+Handlers ``enqueue()`` an order and return at once; a worker thread collects
+orders and sends them to ``orders/batch`` when ``max_batch`` are waiting or
+the oldest has waited ``max_wait`` seconds. Each order carries an
+idempotency key in its meta data. Orders the batch rejects or that fail with
+the whole request are retried with exponential backoff, and before a retry
+``find_existing(keys)`` is asked which of them WooCommerce already has (a
+timed-out batch may have been applied), so a retry never creates a
+duplicate. After ``max_attempts`` an order is parked in ``failed`` for an
+operator to look at.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_META_KEY = '_whatsapp_idempotency_key'
+
+# WooCommerce accepts at most 100 objects per batch request
+MAX_BATCH = 100
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def idempotency_key(order):
+    for meta in order.get('meta_data', []):
+        if meta.get('key') == IDEMPOTENCY_META_KEY:
+            return meta.get('value')
+    return None
+
+
+class PendingOrder:
+    """An order waiting to be written, with its retry bookkeeping"""
+
+    __slots__ = ('key', 'payload', 'queued_at', 'attempts', 'not_before', 'last_error')
+
+    def __init__(self, key, payload):
+        self.key = key
+        self.payload = payload
+        self.queued_at = time.time()
+        self.attempts = 0
+        self.not_before = 0.0
+        self.last_error = None
+
+
+class OrderQueue:
+    """Size/time-batched writer for ``orders/batch``.
+
+    ``submit_batch(payloads)`` performs the request and returns WooCommerce's
+    ``create`` list (one result per payload, in order). ``find_existing(keys)``
+    returns {key: order id} for keys WooCommerce already holds. ``observer``
+    is called as observer(outcome, count) with outcome created, duplicate,
+    retried or failed.
+    """
+
+    def __init__(self, submit_batch, find_existing=None, max_batch=20, max_wait=2.0,
+                 max_attempts=5, backoff=2.0, max_failed=200, max_created=10000, observer=None):
+        self.submit_batch = submit_batch
+        self.find_existing = find_existing
+        self.max_batch = min(max_batch, MAX_BATCH)
+        self.max_wait = max_wait
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.observer = observer
+        # Recent idempotency key -> WooCommerce order id
+        self.created = OrderedDict()
+        self.max_created = max_created
+        self.failed = deque(maxlen=max_failed)
+        self.batches = 0
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._stopping = False
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    # ----------------------------------------
+    # Producer side
+    # ----------------------------------------
+    def enqueue(self, payload, key=None):
+        """Queue an order for creation; returns its idempotency key at once"""
+        key = key or idempotency_key(payload) or new_idempotency_key()
+        if idempotency_key(payload) is None:
+            payload = dict(payload, meta_data=list(payload.get('meta_data', [])) +
+                           [{'key': IDEMPOTENCY_META_KEY, 'value': key}])
+        with self._cond:
+            if key in self.created or any(order.key == key for order in self._pending):
+                return key
+            self._pending.append(PendingOrder(key, payload))
+            self._ensure_worker()
+            self._cond.notify()
+        return key
+
+    def _ensure_worker(self):
+        # Started on first use, so a preloading master never owns the thread
+        if self._worker is None or not self._worker.is_alive():
+            self._stopping = False
+            self._worker = threading.Thread(target=self._run, name='order-queue', daemon=True)
+            self._worker.start()
+
+    def _after_fork(self):
+        self._cond = threading.Condition()
+        self._worker = None
+
+    # ----------------------------------------
+    # Worker side
+    # ----------------------------------------
+    def _take_batch(self):
+        """Wait for a batch to be due and pop it (None once stopped and drained)"""
+        with self._cond:
+            while True:
+                now = time.time()
+                ready = [order for order in self._pending if order.not_before <= now]
+                if ready and (self._stopping or len(ready) >= self.max_batch
+                              or now - min(order.queued_at for order in ready) >= self.max_wait):
+                    batch = ready[:self.max_batch]
+                    for order in batch:
+                        self._pending.remove(order)
+                    return batch
+                if self._stopping and not ready:
+                    return None
+                if ready:
+                    timeout = self.max_wait - (now - min(order.queued_at for order in ready))
+                elif self._pending:
+                    timeout = min(order.not_before for order in self._pending) - now
+                else:
+                    timeout = None
+                self._cond.wait(timeout if timeout is None else max(timeout, 0.01))
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                self.flush(batch)
+            except Exception as e:
+                logger.error("❌ Order batch crashed: %s", e, exc_info=True)
+                self._retry(batch, str(e))
+
+    def flush(self, batch):
+        """Write one batch of pending orders"""
+        if any(order.attempts for order in batch) and self.find_existing is not None:
+            batch = self._drop_existing(batch)
+            if not batch:
+                return
+        for order in batch:
+            order.attempts += 1
+        self.batches += 1
+        try:
+            results = self.submit_batch([order.payload for order in batch])
+        except Exception as e:
+            logger.warning("⚠️ Order batch of %d failed: %s", len(batch), e)
+            self._retry(batch, str(e))
+            return
+
+        retry = []
+        for order, result in zip(batch, results or []):
+            error = (result or {}).get('error')
+            if result and result.get('id') and not error:
+                self._created(order, result['id'])
+            else:
+                retry.append(order)
+                order.last_error = (error or {}).get('message', 'no result')
+        retry.extend(batch[len(results or []):])
+        if retry:
+            self._retry(retry, None)
+        logger.info("🧾 Order batch: %d created, %d to retry", len(batch) - len(retry), len(retry))
+
+    def _drop_existing(self, batch):
+        try:
+            existing = self.find_existing([order.key for order in batch]) or {}
+        except Exception as e:
+            # Resubmitting blind could duplicate an applied batch; try again later
+            logger.warning("⚠️ Order lookup before retry failed: %s", e)
+            for order in batch:
+                order.attempts += 1
+            self._retry(batch, f"lookup before retry failed: {e}")
+            return []
+        remaining = []
+        for order in batch:
+            if order.key in existing:
+                self._created(order, existing[order.key], outcome='duplicate')
+            else:
+                remaining.append(order)
+        return remaining
+
+    def _created(self, order, order_id, outcome='created'):
+        self.created[order.key] = order_id
+        if len(self.created) > self.max_created:
+            self.created.popitem(last=False)
+        self._observe(outcome, 1)
+
+    def _retry(self, orders, error):
+        given_up = []
+        with self._cond:
+            for order in orders:
+                if error is not None:
+                    order.last_error = error
+                if order.attempts >= self.max_attempts:
+                    given_up.append(order)
+                    continue
+                order.not_before = time.time() + self.backoff * (2 ** (order.attempts - 1))
+                self._pending.append(order)
+            self._cond.notify()
+        for order in given_up:
+            self.failed.append(order)
+            logger.error("❌ Order %s dropped after %d attempts: %s", order.key, order.attempts, order.last_error)
+        self._observe('retried', len(orders) - len(given_up))
+        self._observe('failed', len(given_up))
+
+    def _observe(self, outcome, count):
+        if self.observer is not None and count:
+            self.observer(outcome, count)
+
+    # ----------------------------------------
+    # Control
+    # ----------------------------------------
+    def flush_due(self):
+        """Submit every order that is due now, here, and leave the worker running.
+
+        Orders waiting out a retry backoff stay queued for the worker.
+        Returns how many orders were submitted.
+        """
+        sent = 0
+        while True:
+            with self._cond:
+                now = time.time()
+                batch = [order for order in self._pending if order.not_before <= now][:self.max_batch]
+                for order in batch:
+                    self._pending.remove(order)
+            if not batch:
+                return sent
+            try:
+                self.flush(batch)
+            except Exception as e:
+                logger.error("❌ Order batch crashed: %s", e, exc_info=True)
+                self._retry(batch, str(e))
+            sent += len(batch)
+
+    def shutdown(self, timeout=10):
+        """Stop the worker after it flushed what is due (process exit); returns the orders left behind"""
+        with self._cond:
+            worker = self._worker
+            if worker is not None:
+                self._stopping = True
+                self._cond.notify()
+        if worker is not None:
+            worker.join(timeout)
+        left = list(self._pending)
+        for order in left:
+            logger.error("❌ Order %s not written at shutdown (%d attempts, retry in %.0f s): %s", order.key,
+                         order.attempts, max(order.not_before - time.time(), 0), order.last_error)
+        return left
+
+    def status(self):
+        return {
+            'pending': len(self._pending),
+            'created': len(self.created),
+            'failed': [{'key': order.key, 'attempts': order.attempts, 'error': order.last_error}
+                       for order in self.failed],
+            'batches': self.batches,
+            'max_batch': self.max_batch,
+            'max_wait_seconds': self.max_wait,
+        }
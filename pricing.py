@@ -0,0 +1,111 @@
+"""
+Price table.
+
+Every price the bot shows is derived from a product's WooCommerce ``price``:
+retail as is, subscription and B2B with a percentage off. ``PriceTable``
+computes all three once per product version in ``Decimal`` (rounded half-up
+to the cent, the way the shop rounds), keeps them in a bounded cache and
+serves them by lookup, so lists, details, confirmations and emails all show
+the same figures.
+
+Fixed-price products (``is_excluded``) get no subscription or B2B discount.
+"""
+import threading
+from collections import OrderedDict
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import NamedTuple, Optional
+
+from render_cache import product_version
+
+CENT = Decimal('0.01')
+
+RETAIL = 'retail'
+SUBSCRIPTION = 'subscription'
+BUSINESS = 'business'
+
+
+def to_decimal(value):
+    """Price string/number as a cent-rounded Decimal, or None if it is not a price"""
+    try:
+        price = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        return None
+    if not price.is_finite():
+        return None
+    return price.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def format_price(price, missing='N/A'):
+    """'12.30' for a Decimal, ``missing`` for None"""
+    return missing if price is None else f"{price:.2f}"
+
+
+class Prices(NamedTuple):
+    """A product's prices per customer tier (None when it has no price)"""
+    retail: Optional[Decimal]
+    subscription: Optional[Decimal]
+    b2b: Optional[Decimal]
+
+    def for_tier(self, tier):
+        return {RETAIL: self.retail, SUBSCRIPTION: self.subscription, BUSINESS: self.b2b}[tier]
+
+
+NO_PRICES = Prices(None, None, None)
+
+
+class PriceTable:
+    """Per-product Decimal prices, keyed by (product id, product version)"""
+
+    def __init__(self, b2b_discount, subscription_discount, is_excluded, maxsize=20000):
+        self.b2b_factor = 1 - Decimal(str(b2b_discount))
+        self.subscription_factor = 1 - Decimal(str(subscription_discount))
+        self.is_excluded = is_excluded
+        self.maxsize = maxsize
+        self._prices = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def compute(self, product):
+        retail = to_decimal(product.get('price', ''))
+        if retail is None or retail <= 0:
+            return NO_PRICES
+        if self.is_excluded(product):
+            return Prices(retail, retail, None)
+        return Prices(
+            retail,
+            (retail * self.subscription_factor).quantize(CENT, rounding=ROUND_HALF_UP),
+            (retail * self.b2b_factor).quantize(CENT, rounding=ROUND_HALF_UP),
+        )
+
+    def get(self, product):
+        """Prices for ``product``, computed once per product version"""
+        key = (product.get('id'), product_version(product), product.get('price'))
+        prices = self._prices.get(key)
+        if prices is not None:
+            self.hits += 1
+            with self._lock:
+                try:
+                    self._prices.move_to_end(key)
+                except KeyError:
+                    pass  # evicted or invalidated meanwhile
+            return prices
+
+        self.misses += 1
+        prices = self.compute(product)
+        with self._lock:
+            self._prices[key] = prices
+            if len(self._prices) > self.maxsize:
+                self._prices.popitem(last=False)
+        return prices
+
+    def price(self, product, tier=RETAIL):
+        return self.get(product).for_tier(tier)
+
+    def invalidate(self):
+        """Drop all prices (e.g. after the discount exclusions change)"""
+        with self._lock:
+            self._prices = OrderedDict()
+
+    def stats(self):
+        return {'size': len(self._prices), 'hits': self.hits, 'misses': self.misses}
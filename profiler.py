@@ -0,0 +1,195 @@
+"""
+On-demand sampling profiler for live webhook traffic.
+
+Armed for the next N requests or a time window, a background thread
+samples the stacks of the requests in flight every few milliseconds and
+aggregates them as collapsed stacks (``frame;frame;frame count``), ready
+for flamegraph.pl or speedscope. Each stack is rooted at the session
+state of the request being served.
+
+Under gunicorn a request is its thread. In ASGI mode every request runs in
+its own greenlet on the event-loop thread (aiobridge.py), so requests are
+tracked by greenlet: a parked one is sampled from its saved frame, the one
+running at that moment from the loop thread's frame.
+
+When disarmed the per-request cost is a single attribute check.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import aiobridge
+
+logger = logging.getLogger(__name__)
+
+
+def _request_key():
+    """The bridge greenlet serving this request, or its thread"""
+    task = aiobridge.current_task()
+    return task if task is not None else threading.get_ident()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Stack sampler limited to threads and greenlets serving profiled requests"""
+
+    def __init__(self, interval=0.005, output_dir=None, max_depth=64):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.max_depth = max_depth
+        self.armed = False
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._counts = {}
+        self._remaining = None
+        self._until = None
+        self._started = None
+        self._sampler = None
+        self._wake = threading.Event()
+        self.samples = 0
+        self.last_result = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    # ----------------------------------------
+    # Control
+    # ----------------------------------------
+    def arm(self, requests=None, seconds=None):
+        """Profile the next ``requests`` requests and/or ``seconds`` seconds"""
+        if not requests and not seconds:
+            raise ValueError("Give a request count or a time window")
+        with self._lock:
+            self._counts = {}
+            self.samples = 0
+            self._remaining = int(requests) if requests else None
+            self._until = time.monotonic() + float(seconds) if seconds else None
+            self._started = time.time()
+            self.armed = True
+            self._wake.set()
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._sampler.start()
+        logger.info("Profiler armed: requests=%s seconds=%s", requests, seconds)
+
+    def disarm(self):
+        """Stop profiling and publish what was collected"""
+        with self._lock:
+            if not self.armed:
+                return self.last_result
+            self.armed = False
+            self._wake.clear()
+            counts, self._counts = self._counts, {}
+            samples = self.samples
+        self.last_result = self._publish(counts, samples)
+        return self.last_result
+
+    def status(self):
+        return {
+            'armed': self.armed,
+            'remaining_requests': self._remaining,
+            'remaining_seconds': round(self._until - time.monotonic(), 1) if self._until and self.armed else None,
+            'samples': self.samples,
+            'interval_ms': self.interval * 1000,
+            'last_file': self.last_result['file'] if self.last_result else None,
+        }
+
+    # ----------------------------------------
+    # Request hooks
+    # ----------------------------------------
+    @contextmanager
+    def request(self):
+        """Wrap one webhook request"""
+        if not self.armed:
+            yield
+            return
+        key = _request_key()
+        with self._lock:
+            self._requests[key] = ('state=unknown', threading.get_ident())
+        try:
+            yield
+        finally:
+            finished = False
+            with self._lock:
+                self._requests.pop(key, None)
+                if self._remaining is not None:
+                    self._remaining -= 1
+                    finished = self._remaining <= 0
+            if finished:
+                self.disarm()
+
+    def tag(self, state):
+        """Tag the current request's samples with its session state"""
+        if self.armed:
+            key = _request_key()
+            if key in self._requests:
+                self._requests[key] = (f"state={state}", threading.get_ident())
+
+    def _after_fork(self):
+        # Armed in a preloading master: the sampler thread stayed behind
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._sampler = None
+        if self.armed:
+            self._sampler = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._sampler.start()
+
+    # ----------------------------------------
+    # Sampling
+    # ----------------------------------------
+    def _run(self):
+        # Sleeps on the event while disarmed, so it costs nothing between sessions
+        while True:
+            self._wake.wait()
+            if not self.armed:
+                continue
+            if self._until is not None and time.monotonic() >= self._until:
+                self.disarm()
+                continue
+            self._sample()
+            time.sleep(self.interval)
+
+    def _sample(self):
+        requests = dict(self._requests)
+        if not requests:
+            return
+        frames = sys._current_frames()
+        with self._lock:
+            for key, (tag, ident) in requests.items():
+                if isinstance(key, int):
+                    frame = frames.get(ident)
+                else:
+                    # A parked greenlet keeps its frame; the running one has none
+                    frame = key.gr_frame
+                    if frame is None and not key.dead:
+                        frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(tag)
+                key = ';'.join(reversed(stack))
+                self._counts[key] = self._counts.get(key, 0) + 1
+                self.samples += 1
+
+    def _publish(self, counts, samples):
+        folded = '\n'.join(f"{stack} {count}" for stack, count in sorted(counts.items()))
+        path = None
+        if self.output_dir and counts:
+            os.makedirs(self.output_dir, exist_ok=True)
+            stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+            path = os.path.join(self.output_dir, f"profile-{stamp}-{os.getpid()}.folded")
+            with open(path, 'w', encoding='utf-8') as fh:
+                fh.write(folded + '\n')
+        logger.info("Profiler finished: %d samples, %d stacks -> %s", samples, len(counts), path)
+        return {'file': path, 'samples': samples, 'stacks': len(counts), 'folded': folded,
+                'started': self._started, 'finished': time.time()}
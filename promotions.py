@@ -0,0 +1,182 @@
+"""
+Promotion rules.
+
+Each promo in the ``promos`` config section is a declarative rule: which
+products it applies to (``match``: product ids, name keywords, tag or
+category slugs), when it runs (``valid_from`` / ``valid_until``, both
+inclusive dates) and how it is shown (``badge`` in product lists,
+``detail`` in product details, ``banner`` on the promotions screen).
+
+``PromoEngine`` compiles the rules once per config change into matchers plus
+a product-id index. Explicit product ids go straight into the index; pattern
+rules are evaluated the first time a product version is seen and the result
+is stored in the same index, so renderers do a single dict lookup. The
+engine also tracks the next date at which a promo starts or ends and
+recompiles when it is crossed, so expired promos drop out on their own.
+"""
+import logging
+import threading
+from datetime import date, timedelta
+
+from render_cache import product_version
+
+logger = logging.getLogger(__name__)
+
+
+class Promo:
+    """One compiled promotion rule"""
+
+    __slots__ = ('id', 'name', 'type', 'badge', 'detail', 'banner',
+                 'valid_from', 'valid_until', 'product_ids', 'name_all', 'tags', 'categories')
+
+    def __init__(self, promo_id, spec):
+        match = spec.get('match', {})
+        self.id = promo_id
+        self.name = spec['name']
+        self.type = spec['type']
+        self.badge = spec.get('badge')
+        self.detail = spec.get('detail')
+        self.banner = spec.get('banner')
+        self.valid_from = date.fromisoformat(spec['valid_from']) if spec.get('valid_from') else None
+        self.valid_until = date.fromisoformat(spec['valid_until'])
+        self.product_ids = frozenset(match.get('product_ids', ()))
+        self.name_all = tuple(keyword.lower() for keyword in match.get('name_all', ()))
+        self.tags = frozenset(match.get('tags', ()))
+        self.categories = frozenset(match.get('categories', ()))
+
+    @property
+    def has_patterns(self):
+        return bool(self.name_all or self.tags or self.categories)
+
+    def running_on(self, day):
+        return (self.valid_from is None or self.valid_from <= day) and day <= self.valid_until
+
+    def matches(self, product):
+        """Pattern match; every pattern the rule sets must hold"""
+        if not self.has_patterns:
+            return False
+        if self.name_all:
+            name = product.get('name', '').lower()
+            if not all(keyword in name for keyword in self.name_all):
+                return False
+        if self.tags and not self.tags & {tag.get('slug') for tag in product.get('tags', [])}:
+            return False
+        if self.categories and not self.categories & {cat.get('slug') for cat in product.get('categories', [])}:
+            return False
+        return True
+
+    def __repr__(self):
+        return f"<Promo {self.id} until {self.valid_until}>"
+
+
+class PromoEngine:
+    """Compiled promo rules with a product-id -> promos index.
+
+    ``is_excluded(product)`` marks fixed-price products, which never get a
+    promo. ``today`` is the clock (a callable returning a date).
+    """
+
+    def __init__(self, promos, is_excluded, today=date.today, maxsize=20000):
+        self.is_excluded = is_excluded
+        self.today = today
+        self.maxsize = maxsize
+        self.compiles = 0
+        self.hits = 0
+        self.misses = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.load(promos)
+
+    def on_change(self, callback):
+        """Call ``callback()`` after every recompile (config change or date boundary)"""
+        self._listeners.append(callback)
+
+    def load(self, promos):
+        """Compile a new ``promos`` config section"""
+        with self._lock:
+            self._rules = [Promo(promo_id, spec) for promo_id, spec in promos.items() if spec.get('active', True)]
+            self._compile()
+        self._notify()
+
+    def invalidate(self):
+        """Forget per-product results (e.g. after the discount exclusions change)"""
+        with self._lock:
+            self._compile()
+        self._notify()
+
+    def _compile(self):
+        day = self.today()
+        running = [promo for promo in self._rules if promo.running_on(day)]
+        by_id = {}
+        for promo in running:
+            for product_id in promo.product_ids:
+                by_id.setdefault(product_id, []).append(promo)
+        self._day = day
+        self._active = tuple(running)
+        self._patterns = tuple(promo for promo in running if promo.has_patterns)
+        self._by_id = {product_id: tuple(promos) for product_id, promos in by_id.items()}
+        self._index = {}
+        self._next_boundary = min(
+            [p.valid_from for p in self._rules if p.valid_from and p.valid_from > day] +
+            [p.valid_until + timedelta(days=1) for p in self._rules if p.valid_until >= day],
+            default=None)
+        self.compiles += 1
+
+    def _notify(self):
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("❌ Promo listener %s failed: %s", getattr(callback, '__name__', callback), e)
+
+    def check(self):
+        """Recompile if a promo started or ended since the last compile; cheap enough per request"""
+        boundary = self._next_boundary
+        if boundary is None or self.today() < boundary:
+            return False
+        with self._lock:
+            if self._next_boundary != boundary:
+                return False
+            self._compile()
+        logger.info("🎁 Promo window boundary %s crossed: %d active", boundary, len(self._active))
+        self._notify()
+        return True
+
+    def active(self):
+        """Promos running today, in config order"""
+        self.check()
+        return self._active
+
+    def for_product(self, product):
+        """Promos that apply to ``product`` today"""
+        self.check()
+        product_id = str(product.get('id', ''))
+        key = (product_id, product_version(product))
+        promos = self._index.get(key)
+        if promos is not None:
+            self.hits += 1
+            return promos
+        self.misses += 1
+        if self.is_excluded(product):
+            promos = ()
+        else:
+            promos = self._by_id.get(product_id, ())
+            matched = tuple(p for p in self._patterns if p not in promos and p.matches(product))
+            if matched:
+                promos = tuple(p for p in self._active if p in promos or p in matched)
+        index = self._index
+        if len(index) >= self.maxsize:
+            index.clear()
+        index[key] = promos
+        return promos
+
+    def stats(self):
+        return {
+            'rules': len(self._rules),
+            'active': [promo.id for promo in self._active],
+            'next_boundary': self._next_boundary.isoformat() if self._next_boundary else None,
+            'indexed_products': len(self._index),
+            'compiles': self.compiles,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,174 @@
+"""
+Render caches for WhatsApp screens.
+
+Screens are rendered once per (store, segment) and kept as precompiled
+templates. Dynamic values are marked with ``slot('name')`` while rendering
+and filled in later by joining the cached parts, so serving a cached screen
+is a dict lookup plus a join.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_SLOT_MARK = '\x00'
+
+
+def slot(name):
+    """Placeholder for a value filled in at serve time"""
+    return f"{_SLOT_MARK}{name}{_SLOT_MARK}"
+
+
+class Template:
+    """Rendered text split into literal parts and named slots"""
+
+    __slots__ = ('parts', 'slots', 'text')
+
+    def __init__(self, text):
+        chunks = text.split(_SLOT_MARK)
+        # Even chunks are literals, odd chunks are slot names
+        self.parts = chunks
+        self.slots = tuple(chunks[1::2])
+        self.text = text if not self.slots else None
+
+    def fill(self, values):
+        if self.text is not None:
+            return self.text
+        parts = list(self.parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = str(values.get(parts[i], ''))
+        return ''.join(parts)
+
+
+class ScreenCache:
+    """Per-(store, segment) cache of rendered screens"""
+
+    def __init__(self):
+        self._renderers = {}
+        self._templates = {}
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def register(self, name, renderer, per_store=False, per_segment=False):
+        """Register a screen renderer.
+
+        The renderer is called with ``store_id`` and/or ``segment`` keyword
+        arguments depending on the flags.
+        """
+        self._renderers[name] = (renderer, per_store, per_segment)
+
+    def render(self, name, store_id=None, segment=None, **values):
+        """Serve a screen from cache, rendering it on first use"""
+        renderer, per_store, per_segment = self._renderers[name]
+        key = (name, store_id if per_store else None, segment if per_segment else None)
+        template = self._templates.get(key)
+        if template is None:
+            template = self._build(key, renderer, per_store, per_segment)
+        return template.fill(values)
+
+    @staticmethod
+    def _render(key, renderer, per_store, per_segment):
+        name, store_id, segment = key
+        kwargs = {}
+        if per_store:
+            kwargs['store_id'] = store_id
+        if per_segment:
+            kwargs['segment'] = segment
+        return Template(renderer(**kwargs))
+
+    def _build(self, key, renderer, per_store, per_segment):
+        template = self._render(key, renderer, per_store, per_segment)
+        with self._lock:
+            self._templates[key] = template
+        return template
+
+    def warm(self, store_ids, segments=(None,)):
+        """Render every registered screen for every store and segment"""
+        for name, (renderer, per_store, per_segment) in self._renderers.items():
+            for store_id in (store_ids if per_store else (None,)):
+                for segment in (segments if per_segment else (None,)):
+                    self._build((name, store_id, segment), renderer, per_store, per_segment)
+        logger.info("Screen cache warmed: %d templates", len(self._templates))
+
+    def refresh(self, names, store_ids, segments=(None,)):
+        """Re-render only the ``names`` screens and swap them in at once"""
+        fresh = {}
+        for name in names:
+            renderer, per_store, per_segment = self._renderers[name]
+            for store_id in (store_ids if per_store else (None,)):
+                for segment in (segments if per_segment else (None,)):
+                    key = (name, store_id, segment)
+                    fresh[key] = self._render(key, renderer, per_store, per_segment)
+        with self._lock:
+            templates = {key: t for key, t in self._templates.items() if key[0] not in names}
+            templates.update(fresh)
+            self._templates = templates
+            self.version += 1
+        logger.info("Screen cache refreshed: %s (%d templates)", ', '.join(names), len(fresh))
+
+    def invalidate(self):
+        """Drop all rendered screens (e.g. after a config change)"""
+        with self._lock:
+            self._templates = {}
+            self.version += 1
+
+    def __len__(self):
+        return len(self._templates)
+
+
+def product_version(product):
+    """Version stamp of a WooCommerce product for cache keys"""
+    modified = product.get('date_modified_gmt') or product.get('date_modified')
+    if modified:
+        return modified
+    # Not every endpoint returns dates; fall back to the rendered fields
+    return (product.get('name'), product.get('price'), product.get('stock_status'))
+
+
+class FragmentCache:
+    """Bounded cache of per-product list fragments.
+
+    Keyed by (product id, product version, list type), so an edited product
+    in WooCommerce gets a new key and the old fragment ages out (least
+    recently used entries are evicted first once ``maxsize`` is reached).
+    """
+
+    def __init__(self, maxsize=20000):
+        self.maxsize = maxsize
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, product, list_type, renderer):
+        """Serve a product's fragment, rendering it on a miss"""
+        key = (product.get('id'), product_version(product), list_type)
+        fragment = self._fragments.get(key)
+        if fragment is not None:
+            self.hits += 1
+            with self._lock:
+                try:
+                    self._fragments.move_to_end(key)
+                except KeyError:
+                    pass  # evicted or invalidated meanwhile
+            return fragment
+
+        self.misses += 1
+        fragment = renderer(product)
+        with self._lock:
+            self._fragments[key] = fragment
+            if len(self._fragments) > self.maxsize:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def invalidate(self):
+        """Drop all fragments (e.g. after promo or exclusion rules change)"""
+        with self._lock:
+            self._fragments = OrderedDict()
+
+    def stats(self):
+        return {'size': len(self._fragments), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._fragments)
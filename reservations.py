@@ -0,0 +1,297 @@
+"""
+Drive-through reservations.
+
+``OrderIdAllocator`` issues ids like ``DT-2Y8H7K-3``: a base32 tick count
+(seconds since 2024, never repeating within a shard: a burst borrows the
+next seconds and the last tick is persisted) followed by the shard. The
+shard is ``ORDER_ID_SHARD`` (e.g. the dyno number) plus a worker slot
+claimed with an exclusive lock on a file in a shared directory, so two
+live processes never share one and ids are unique across workers.
+
+``ReservationRegistry`` keeps holds in a SQLite file (WAL) next to the slot
+locks, keyed by normalised order id (forgiving of case, dashes and O/0
+mix-ups) and indexed by store and expiry. Every worker on the host sees the
+same holds, so staff can look up and collect an order whichever worker
+serves them, and holds survive restarts. Each worker runs a sweeper that
+wakes at the earliest expiry (or every ``poll`` seconds, for holds added
+elsewhere); a conditional UPDATE makes exactly one worker expire, collect
+or cancel a hold and report it to its ``on_change`` listener. 
+``RESERVATIONS_DB`` overrides the path; the workers of a host must share
+one local file (SQLite does not belong on a network share).
+"""
+import fcntl
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Crockford base32: no I, L, O or U to misread
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+_DECODE = {'O': '0', 'I': '1', 'L': '1'}
+EPOCH = 1704067200  # 2024-01-01 UTC
+MAX_SLOTS = len(ALPHABET)
+
+HELD = 'held'
+COLLECTED = 'collected'
+EXPIRED = 'expired'
+CANCELLED = 'cancelled'
+
+
+def encode(number):
+    digits = []
+    while True:
+        number, digit = divmod(number, len(ALPHABET))
+        digits.append(ALPHABET[digit])
+        if not number:
+            return ''.join(reversed(digits))
+
+
+def normalize_order_id(order_id):
+    """Canonical lookup key: 'dt-2y8h7k-3', 'DT 2Y8H7K 3' and 'DT-2Y8H7K-3' match"""
+    text = ''.join(ch for ch in str(order_id).upper() if ch.isalnum())
+    return ''.join(_DECODE.get(ch, ch) for ch in text)
+
+
+class OrderIdAllocator:
+    """Unique, time-ordered order ids for one worker process"""
+
+    def __init__(self, prefix='DT', host_shard=None, directory=None):
+        self.prefix = prefix
+        self.host_shard = host_shard if host_shard is not None else os.environ.get('ORDER_ID_SHARD', '')
+        self.directory = directory or os.environ.get('ORDER_ID_DIR') or tempfile.gettempdir()
+        self._lock = threading.Lock()
+        self._slot = None
+        self._file = None
+        self._last = 0
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The slot lock belongs to the parent; claim our own on first use
+        self._lock = threading.Lock()
+        self._slot = None
+        self._file = None
+
+    def _claim_slot(self):
+        for slot in range(MAX_SLOTS):
+            path = os.path.join(self.directory, f"order-ids-{self.prefix}{self.host_shard}-{slot}.lock")
+            handle = open(path, 'a+')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                continue
+            handle.seek(0)
+            saved = handle.read().strip()
+            self._last = int(saved) if saved.isdigit() else 0
+            self._file = handle
+            self._slot = slot
+            logger.info("🎫 Order id shard %s%s claimed", self.host_shard, ALPHABET[slot])
+            return
+        raise RuntimeError(f"All {MAX_SLOTS} order id slots in {self.directory} are taken")
+
+    @property
+    def shard(self):
+        return None if self._slot is None else f"{self.host_shard}{ALPHABET[self._slot]}"
+
+    def next(self):
+        with self._lock:
+            if self._slot is None:
+                self._claim_slot()
+            self._last = max(self._last + 1, int(time.time()) - EPOCH)
+            self._file.seek(0)
+            self._file.truncate()
+            self._file.write(str(self._last))
+            self._file.flush()
+            return f"{self.prefix}-{encode(self._last)}-{self.shard}"
+
+
+class Reservation:
+    __slots__ = ('order_id', 'store_id', 'phone', 'product_id', 'product_name', 'price',
+                 'created', 'expires', 'status', 'order_key')
+
+    def __init__(self, order_id, store_id, phone, product_id, product_name, price, created, expires, order_key=None):
+        self.order_id = order_id
+        self.store_id = store_id
+        self.phone = phone
+        self.product_id = product_id
+        self.product_name = product_name
+        self.price = price
+        self.created = created
+        self.expires = expires
+        self.status = HELD
+        self.order_key = order_key
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ReservationRegistry:
+    """Holds in a SQLite file shared by the workers, expired by a sweeper in each.
+
+    ``on_change(reservation)`` runs after every status change (expiry,
+    collection, cancellation), in the worker that made the change.
+    """
+
+    COLUMNS = Reservation.__slots__
+
+    def __init__(self, allocator, path=None, on_change=None, retention=24 * 3600, poll=30.0, clock=time.time):
+        self.allocator = allocator
+        self.path = path or os.path.join(allocator.directory, f"reservations-{allocator.prefix}.sqlite3")
+        self.on_change = on_change
+        self.retention = retention
+        self.poll = poll
+        self.clock = clock
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._next_due = None
+        self._sweeper = None
+        self.expired = 0
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The parent's connections stay with the parent (see _db)
+        self._cond = threading.Condition()
+        self._next_due = None
+        self._sweeper = None
+
+    def _db(self):
+        """This thread's connection (autocommit, WAL), opened on first use"""
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(f"CREATE TABLE IF NOT EXISTS reservations (key TEXT PRIMARY KEY, "
+                       f"{', '.join(self.COLUMNS)}, finished REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS reservations_store ON reservations (store_id, expires)")
+            db.execute("CREATE INDEX IF NOT EXISTS reservations_due ON reservations (status, expires)")
+            self._local.db = db
+            self._local.pid = os.getpid()
+            self._ensure_sweeper()
+        return db
+
+    def _select(self, where, params):
+        rows = self._db().execute(f"SELECT {', '.join(self.COLUMNS)} FROM reservations WHERE {where}", params)
+        return [self._reservation(row) for row in rows]
+
+    @staticmethod
+    def _reservation(row):
+        values = dict(zip(ReservationRegistry.COLUMNS, row))
+        status = values.pop('status')
+        reservation = Reservation(**values)
+        reservation.status = status
+        return reservation
+
+    def add(self, store_id, phone, product_id, product_name, price, hold_seconds, order_key=None):
+        """Hold a product for ``hold_seconds``; returns the new Reservation"""
+        now = self.clock()
+        reservation = Reservation(self.allocator.next(), store_id, phone, product_id, product_name, price,
+                                  now, now + hold_seconds, order_key)
+        self._db().execute(
+            f"INSERT INTO reservations (key, {', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * (len(self.COLUMNS) + 1))})",
+            (normalize_order_id(reservation.order_id), *(getattr(reservation, name) for name in self.COLUMNS)))
+        with self._cond:
+            if self._next_due is None or reservation.expires < self._next_due:
+                self._next_due = reservation.expires
+                self._cond.notify()
+        return reservation
+
+    def attach_order(self, order_id, order_key):
+        """Remember the queued order behind a hold"""
+        self._db().execute("UPDATE reservations SET order_key = ? WHERE key = ?",
+                           (order_key, normalize_order_id(order_id)))
+
+    def get(self, order_id):
+        found = self._select("key = ?", (normalize_order_id(order_id),))
+        return found[0] if found else None
+
+    def for_store(self, store_id, status=HELD):
+        """The store's reservations with ``status`` (all when None), soonest expiry first"""
+        if status is None:
+            return self._select("store_id = ? ORDER BY expires", (store_id,))
+        return self._select("store_id = ? AND status = ? ORDER BY expires", (store_id, status))
+
+    def _set_status(self, order_id, status):
+        # Only one worker's update can match a held row; that worker reports the change
+        changed = self._db().execute("UPDATE reservations SET status = ?, finished = ? WHERE key = ? AND status = ?",
+                                     (status, self.clock(), normalize_order_id(order_id), HELD)).rowcount
+        if not changed:
+            return None
+        reservation = self.get(order_id)
+        self._changed(reservation)
+        return reservation
+
+    def collect(self, order_id):
+        """Mark a hold as picked up; None if unknown or no longer held"""
+        return self._set_status(order_id, COLLECTED)
+
+    def cancel(self, order_id):
+        return self._set_status(order_id, CANCELLED)
+
+    def sweep(self, now=None):
+        """Expire due holds and forget finished ones past retention; returns the expired reservations"""
+        now = self.clock() if now is None else now
+        db = self._db()
+        expired = []
+        for (key,) in db.execute("SELECT key FROM reservations WHERE status = ? AND expires <= ?",
+                                 (HELD, now)).fetchall():
+            if db.execute("UPDATE reservations SET status = ?, finished = ? WHERE key = ? AND status = ?",
+                          (EXPIRED, now, key, HELD)).rowcount:
+                expired.extend(self._select("key = ?", (key,)))
+        db.execute("DELETE FROM reservations WHERE status != ? AND finished <= ?", (HELD, now - self.retention))
+        self.expired += len(expired)
+        for reservation in expired:
+            logger.info("⌛ Reservation %s expired (%s)", reservation.order_id, reservation.store_id)
+            self._changed(reservation)
+        return expired
+
+    def _earliest(self):
+        return self._db().execute("SELECT MIN(expires) FROM reservations WHERE status = ?", (HELD,)).fetchone()[0]
+
+    def _changed(self, reservation):
+        if self.on_change is not None:
+            try:
+                self.on_change(reservation)
+            except Exception as e:
+                logger.error("❌ Reservation listener failed: %s", e)
+
+    def _ensure_sweeper(self):
+        # Started on first use, so a preloading master never owns the thread
+        with self._cond:
+            if self._sweeper is None or not self._sweeper.is_alive():
+                self._sweeper = threading.Thread(target=self._run, name='reservation-sweeper', daemon=True)
+                self._sweeper.start()
+
+    def _run(self):
+        # Holds added by other workers are seen within ``poll`` seconds
+        while True:
+            try:
+                self.sweep()
+                due = self._earliest()
+            except sqlite3.Error as e:
+                logger.error("❌ Reservation sweep failed: %s", e)
+                due = None
+            with self._cond:
+                if due is not None and (self._next_due is None or due < self._next_due):
+                    self._next_due = due
+                timeout = self.poll if self._next_due is None else min(self.poll, self._next_due - self.clock())
+                if timeout > 0:
+                    self._cond.wait(timeout)
+                self._next_due = None
+
+    def stats(self):
+        counts = dict(self._db().execute("SELECT status, COUNT(*) FROM reservations GROUP BY status").fetchall())
+        earliest = self._earliest()
+        return {
+            'shard': self.allocator.shard,
+            'path': self.path,
+            'tracked': sum(counts.values()),
+            'by_status': counts,
+            'expired_total': self.expired,
+            'next_expiry_in': round(earliest - self.clock(), 1) if earliest is not None else None,
+        }
@@ -0,0 +1,354 @@
+"""
+Snapshot and restore of in-memory state (customers, sessions) across restarts.
+
+A snapshot file is a fixed header, one pickled record per entry, and an
+index at the end::
+
+    header   magic 'CSSNAP', format version, pickle protocol, created,
+             index offset, index length, index CRC32
+    records  pickle(value) for every entry of every table
+    index    pickle({table: (keys, offsets, lengths, stamps)})
+
+On boot ``SnapshotStore.restore()`` memory-maps every snapshot in the
+directory and reads only the indexes (again in each forked worker, so a
+respawned worker sees what its predecessor saved); a record is unpickled the first time
+its key is used (``SnapshotDict``), so boot time hardly depends on the
+number of customers. Each process saves its own ``state-<pid>.snap``
+periodically, on SIGTERM and at exit (write, fsync, rename), and only when
+its tables were used since the last save. Entries it never touched are
+copied over as raw bytes. When several files hold the same key (one per
+gunicorn worker), the most recently used copy wins; files from the
+previous boot are removed once this boot has saved a file of its own,
+unless the process that wrote them is still running.
+
+Snapshots are trusted local files (pickle); keep SNAPSHOT_DIR private.
+"""
+import itertools
+import logging
+import mmap
+import os
+import pickle
+import signal
+import struct
+import threading
+import time
+import zlib
+from collections.abc import MutableMapping
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CSSNAP'
+FORMAT_VERSION = 1
+PROTOCOL = 5
+HEADER = struct.Struct('<6sHBdQQI')
+FILE_PREFIX = 'state-'
+FILE_SUFFIX = '.snap'
+
+
+_MISSING = object()
+
+
+class SnapshotError(Exception):
+    """Unreadable or incompatible snapshot file"""
+
+
+class SnapshotDict(MutableMapping):
+    """Dict whose restored entries are decoded on first use"""
+
+    def __init__(self):
+        self._live = {}
+        self._stamps = {}
+        # Restored entries: key -> slot in the parallel arrays below
+        self._stored = {}
+        self._buffers = []
+        self._offsets = []
+        self._lengths = []
+        self._stored_stamps = []
+        self._decode_lock = threading.Lock()
+        self.touched = False
+
+    def load(self, buffer, keys, offsets, lengths, stamps):
+        """Make one snapshot's entries available; the most recently used copy of a key wins"""
+        base = len(self._offsets)
+        self._buffers.extend(itertools.repeat(buffer, len(keys)))
+        self._offsets.extend(offsets)
+        self._lengths.extend(lengths)
+        self._stored_stamps.extend(stamps)
+        slots = range(base, base + len(keys))
+        if not self._stored and not self._live:
+            self._stored = dict(zip(keys, slots))
+            return
+        for key, slot in zip(keys, slots):
+            if key in self._live:
+                continue
+            current = self._stored.get(key)
+            if current is None or self._stored_stamps[slot] > self._stored_stamps[current]:
+                self._stored[key] = slot
+
+    def unload(self):
+        """Forget every entry (before restoring again in a forked process)"""
+        with self._decode_lock:
+            self._live, self._stamps, self._stored = {}, {}, {}
+            self._buffers, self._offsets, self._lengths, self._stored_stamps = [], [], [], []
+        self.touched = False
+
+    def _stored_bytes(self, slot):
+        offset = self._offsets[slot]
+        return self._buffers[slot][offset:offset + self._lengths[slot]]
+
+    def __getitem__(self, key):
+        try:
+            value = self._live[key]
+        except KeyError:
+            with self._decode_lock:
+                value = self._live.get(key, _MISSING)
+                if value is _MISSING:
+                    value = self._live[key] = pickle.loads(self._stored_bytes(self._stored[key]))
+                    # Live before stored goes, so the key never looks missing
+                    del self._stored[key]
+        self._stamps[key] = time.time()
+        self.touched = True
+        return value
+
+    def __setitem__(self, key, value):
+        self._live[key] = value
+        self._stored.pop(key, None)
+        self._stamps[key] = time.time()
+        self.touched = True
+
+    def __delitem__(self, key):
+        if key in self._live:
+            del self._live[key]
+        else:
+            del self._stored[key]
+        self._stamps.pop(key, None)
+        self.touched = True
+
+    def __contains__(self, key):
+        return key in self._live or key in self._stored
+
+    def __iter__(self):
+        return iter(list(self._live) + list(self._stored))
+
+    def __len__(self):
+        return len(self._live) + len(self._stored)
+
+    def records(self):
+        """(key, pickled value, stamp) for every entry, without decoding stored ones"""
+        for key, slot in list(self._stored.items()):
+            yield key, self._stored_bytes(slot), self._stored_stamps[slot]
+        for key in list(self._live):
+            if key not in self._live:
+                continue
+            for attempt in range(3):
+                try:
+                    data = pickle.dumps(self._live[key], protocol=PROTOCOL)
+                    break
+                except RuntimeError:
+                    # Changed by a request thread while pickling; take it again
+                    if attempt == 2:
+                        raise
+            yield key, data, self._stamps.get(key, 0.0)
+
+    def stats(self):
+        return {'entries': len(self), 'decoded': len(self._live), 'stored': len(self._stored)}
+
+
+def write_snapshot(path, tables):
+    """Write ``{name: SnapshotDict}`` to ``path`` atomically; returns bytes written"""
+    tmp = f"{path}.tmp"
+    index = {}
+    with open(tmp, 'wb') as handle:
+        handle.write(b'\0' * HEADER.size)
+        offset = HEADER.size
+        for name, table in tables.items():
+            keys, offsets, lengths, stamps = [], [], [], []
+            for key, data, stamp in table.records():
+                handle.write(data)
+                keys.append(key)
+                offsets.append(offset)
+                lengths.append(len(data))
+                stamps.append(stamp)
+                offset += len(data)
+            index[name] = (keys, offsets, lengths, stamps)
+        index_data = pickle.dumps(index, protocol=PROTOCOL)
+        handle.write(index_data)
+        handle.seek(0)
+        handle.write(HEADER.pack(MAGIC, FORMAT_VERSION, PROTOCOL, time.time(), offset, len(index_data),
+                                 zlib.crc32(index_data)))
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp, path)
+    return offset + len(index_data)
+
+
+def read_snapshot(path):
+    """Map ``path``; returns (buffer, {table: (keys, offsets, lengths, stamps)})"""
+    with open(path, 'rb') as handle:
+        size = os.fstat(handle.fileno()).st_size
+        if size < HEADER.size:
+            raise SnapshotError(f"{path}: truncated")
+        buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, protocol, _, index_offset, index_length, crc = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise SnapshotError(f"{path}: not a snapshot")
+    if version != FORMAT_VERSION or protocol > pickle.HIGHEST_PROTOCOL:
+        raise SnapshotError(f"{path}: format {version}/pickle {protocol} not supported")
+    index_data = buffer[index_offset:index_offset + index_length]
+    if len(index_data) != index_length or zlib.crc32(index_data) != crc:
+        raise SnapshotError(f"{path}: index damaged")
+    return buffer, pickle.loads(index_data)
+
+
+def _writer_running(path):
+    """Whether the process named in a snapshot's file name is still alive (another worker)"""
+    pid = os.path.basename(path)[len(FILE_PREFIX):-len(FILE_SUFFIX)]
+    if not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SnapshotStore:
+    """Periodic, SIGTERM and exit-time snapshots of named SnapshotDicts"""
+
+    def __init__(self, directory, tables, interval=300.0):
+        self.directory = directory
+        self.tables = tables
+        self.interval = interval
+        self.enabled = bool(directory)
+        self.saves = 0
+        self.last_save = None
+        self.restored = {}
+        self.restore_seconds = None
+        self._restored_paths = []
+        self._restored_pid = None
+        self._lock = threading.Lock()
+        self._saver = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._saver = None
+
+    def _path(self):
+        return os.path.join(self.directory, f"{FILE_PREFIX}{os.getpid()}{FILE_SUFFIX}")
+
+    def restore(self):
+        """Load the index of every snapshot in the directory (entries decode lazily).
+
+        Runs once per process: a forked worker drops what its parent loaded
+        and reads the files present now, including those of exited workers.
+        """
+        if self._restored_pid == os.getpid():
+            return self.restored
+        if not self.enabled or not os.path.isdir(self.directory):
+            return {}
+        if self._restored_pid is not None:
+            for table in self.tables.values():
+                table.unload()
+            self._restored_paths = []
+        self._restored_pid = os.getpid()
+        started = time.perf_counter()
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX)):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                buffer, index = read_snapshot(path)
+            except (OSError, ValueError, SnapshotError, pickle.UnpicklingError) as e:
+                logger.error("❌ Snapshot %s skipped: %s", path, e)
+                continue
+            self._restored_paths.append(path)
+            for table, columns in index.items():
+                if table in self.tables:
+                    self.tables[table].load(buffer, *columns)
+        self.restored = {name: len(table) for name, table in self.tables.items()}
+        self.restore_seconds = time.perf_counter() - started
+        logger.info("💾 Restored %s from %d snapshot(s) in %.0f ms", self.restored, len(self._restored_paths),
+                    self.restore_seconds * 1000)
+        return self.restored
+
+    def save(self, reason='periodic'):
+        """Write this process's snapshot if its tables were used since the last one"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if not any(table.touched for table in self.tables.values()):
+                return None
+            for table in self.tables.values():
+                table.touched = False
+            started = time.perf_counter()
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                size = write_snapshot(self._path(), self.tables)
+            except Exception as e:
+                for table in self.tables.values():
+                    table.touched = True
+                logger.error("❌ Snapshot (%s) failed: %s", reason, e)
+                return None
+            self.saves += 1
+            self.last_save = time.time()
+            # Everything the previous boot left is now in our file
+            stale, self._restored_paths = self._restored_paths, []
+            for path in stale:
+                if path != self._path() and not _writer_running(path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        logger.info("💾 Snapshot (%s): %d bytes in %.0f ms", reason, size, (time.perf_counter() - started) * 1000)
+        return size
+
+    def start(self):
+        """Restore if this process has not yet, then start periodic saves (cheap to call on every request)"""
+        if not self.enabled or (self._saver is not None and self._saver.is_alive()):
+            return
+        self.restore()
+        with self._lock:
+            if self._saver is None or not self._saver.is_alive():
+                # Started on first use, so a preloading master never owns the thread
+                self._saver = threading.Thread(target=self._run, name='snapshot', daemon=True)
+                self._saver.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.save()
+
+    def install_sigterm(self):
+        """Save on SIGTERM, then let the previous handler run.
+
+        Servers that install their own handlers (gunicorn workers, uvicorn)
+        replace this; they exit normally, so the exit-time save covers them.
+        """
+        if not self.enabled or threading.current_thread() is not threading.main_thread():
+            return
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def on_sigterm(signum, frame):
+            self.save('sigterm')
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, on_sigterm)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'directory': self.directory,
+            'tables': {name: table.stats() for name, table in self.tables.items()},
+            'restored': self.restored,
+            'restore_ms': round(self.restore_seconds * 1000, 1) if self.restore_seconds is not None else None,
+            'saves': self.saves,
+            'last_save': self.last_save,
+        }
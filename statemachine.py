@@ -0,0 +1,219 @@
+"""
+Declarative conversation state machine.
+
+States, global commands and allowed transitions are declared once and
+compiled into plain dicts, so routing a message costs one dict lookup for
+global commands and one for the state handler. Messages that miss the exact
+command table go through the typo-tolerant command lexicon before reaching
+the state handler.
+
+A handler that raises one of ``degrade_on`` (e.g. the request deadline ran
+out) is answered by its degraded handler instead, with the session state
+rolled back so the customer can simply resend.
+"""
+import logging
+import threading
+import time
+
+from lexicon import Lexicon
+
+logger = logging.getLogger(__name__)
+
+
+class StateMachineError(ValueError):
+    """Raised at startup when the declared machine is inconsistent"""
+
+
+class StateMachine:
+    """Compiled dispatch table for WhatsApp conversation states"""
+
+    def __init__(self, default_state, observer=None, degrade_on=(), degraded=None, on_degraded=None):
+        self.default_state = default_state
+        # Optional callback(key, seconds) for every handler/command run
+        self.observer = observer
+        # Exceptions answered by a degraded handler (per state, else ``degraded``)
+        self.degrade_on = tuple(degrade_on)
+        self.degraded = degraded
+        # Optional callback(key, exception) for every degraded reply
+        self.on_degraded = on_degraded
+        self._states = {}
+        self._commands = []
+        self._routes = {}
+        self._lexicon = Lexicon()
+        self._free_text = frozenset()
+        self._handlers = {}
+        self._degraded = {}
+        self._transitions = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.compiled = False
+
+    # ----------------------------------------
+    # Declaration
+    # ----------------------------------------
+    def state(self, name, handler, transitions=(), free_text=False, degraded=None):
+        """Declare a state, its handler and the states it may move to.
+
+        ``free_text`` states take arbitrary customer input (search terms,
+        names, complaints), so only accent/Greeklish-folded command matches
+        apply there, never edit-distance guesses. ``degraded`` overrides the
+        machine-wide degraded handler for this state.
+        """
+        if name in self._states:
+            raise StateMachineError(f"State '{name}' declared twice")
+        self._states[name] = {'handler': handler, 'transitions': tuple(transitions), 'free_text': free_text,
+                              'degraded': degraded}
+
+    def command(self, words, handler, target=None, degraded=None):
+        """Declare a global command that works from every state"""
+        self._commands.append({'words': tuple(words), 'handler': handler, 'target': target,
+                               'degraded': degraded})
+
+    # ----------------------------------------
+    # Compilation
+    # ----------------------------------------
+    def compile(self):
+        """Validate declarations and build the lookup tables"""
+        if self.default_state not in self._states:
+            raise StateMachineError(f"Default state '{self.default_state}' is not declared")
+
+        routes = {}
+        lexicon = Lexicon()
+        for index, cmd in enumerate(self._commands):
+            if cmd['target'] is not None and cmd['target'] not in self._states:
+                raise StateMachineError(
+                    f"Command {cmd['words'][0]!r} targets unknown state '{cmd['target']}'")
+            for word in cmd['words']:
+                key = word.lower()
+                if key in routes:
+                    raise StateMachineError(f"Command word {word!r} declared twice")
+                routes[key] = cmd
+                lexicon.add(word, index)
+
+        transitions = {}
+        for name, spec in self._states.items():
+            unknown = [t for t in spec['transitions'] if t not in self._states]
+            if unknown:
+                raise StateMachineError(f"State '{name}' has transitions to unknown states: {unknown}")
+            # Staying put and jumping to a global command target are always allowed
+            allowed = set(spec['transitions']) | {name}
+            allowed.update(cmd['target'] for cmd in self._commands if cmd['target'])
+            transitions[name] = frozenset(allowed)
+
+        reachable = {self.default_state}
+        reachable.update(cmd['target'] for cmd in self._commands if cmd['target'])
+        for spec in self._states.values():
+            reachable.update(spec['transitions'])
+        for name in self._states:
+            if name not in reachable:
+                logger.warning("State '%s' is not reachable from any transition", name)
+
+        self._routes = routes
+        self._lexicon = lexicon
+        self._free_text = frozenset(name for name, spec in self._states.items() if spec['free_text'])
+        self._handlers = {name: spec['handler'] for name, spec in self._states.items()}
+        self._degraded = {name: spec['degraded'] or self.degraded for name, spec in self._states.items()}
+        self._transitions = transitions
+        self._stats = {name: [0, 0.0, 0.0] for name in self._states}
+        for cmd in self._commands:
+            self._stats[f"cmd:{cmd['words'][0]}"] = [0, 0.0, 0.0]
+        self.compiled = True
+        return self
+
+    # ----------------------------------------
+    # Runtime
+    # ----------------------------------------
+    def lookup_command(self, msg_lower):
+        """Return the global command for an already lowercased message"""
+        return self._routes.get(msg_lower)
+
+    def match_command(self, msg, state=None):
+        """Resolve misspelled, unaccented or Greeklish commands locally"""
+        index = self._lexicon.lookup(msg, fuzzy=state not in self._free_text)
+        return None if index is None else self._commands[index]
+
+    def dispatch(self, msg, customer, session):
+        """Route one message and return the reply text"""
+        state = session.get('state', self.default_state)
+        cmd = self.lookup_command(msg.lower())
+        if cmd is None:
+            cmd = self.match_command(msg, state)
+        if cmd is not None:
+            return self.run_command(cmd, msg, customer, session)
+
+        handler = self._handlers.get(state)
+        if handler is None:
+            state = self.default_state
+            handler = self._handlers[state]
+
+        started = time.perf_counter()
+        try:
+            return handler(msg, customer, session)
+        except self.degrade_on as e:
+            return self._degrade(state, self._degraded.get(state), e, state, msg, customer, session)
+        finally:
+            self._record(state, time.perf_counter() - started)
+            new_state = session.get('state', state)
+            if new_state not in self._transitions[state]:
+                logger.warning("Undeclared transition %s -> %s", state, new_state)
+
+    def run_command(self, cmd, msg, customer, session):
+        """Run a global command and apply its target state"""
+        started = time.perf_counter()
+        previous = session.get('state', self.default_state)
+        try:
+            if cmd['target'] is not None:
+                session['state'] = cmd['target']
+            return cmd['handler'](msg, customer, session)
+        except self.degrade_on as e:
+            fallback = cmd['degraded'] or self.degraded
+            return self._degrade(f"cmd:{cmd['words'][0]}", fallback, e, previous, msg, customer, session)
+        finally:
+            self._record(f"cmd:{cmd['words'][0]}", time.perf_counter() - started)
+
+    def _degrade(self, key, fallback, exc, state, msg, customer, session):
+        """Answer with ``fallback`` after rolling the session back to ``state``"""
+        if fallback is None:
+            raise exc
+        session['state'] = state
+        if self.on_degraded is not None:
+            self.on_degraded(key, exc)
+        return fallback(msg, customer, session)
+
+    def _record(self, key, elapsed):
+        with self._lock:
+            entry = self._stats[key]
+            entry[0] += 1
+            entry[1] += elapsed
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+        if self.observer is not None:
+            self.observer(key, elapsed)
+
+    def stats(self):
+        """Per-state invocation counts and handler latency"""
+        with self._lock:
+            snapshot = {key: list(value) for key, value in self._stats.items()}
+        return {
+            key: {
+                'count': count,
+                'total_ms': round(total * 1000, 3),
+                'avg_ms': round(total * 1000 / count, 3) if count else 0.0,
+                'max_ms': round(worst * 1000, 3),
+            }
+            for key, (count, total, worst) in snapshot.items()
+        }
+
+    def handler_name(self, key):
+        """Function name behind a state or 'cmd:<word>' stats key"""
+        if key.startswith('cmd:'):
+            for cmd in self._commands:
+                if cmd['words'][0] == key[4:]:
+                    return cmd['handler'].__name__
+            return None
+        handler = self._handlers.get(key)
+        return handler.__name__ if handler else None
+
+    @property
+    def states(self):
+        return tuple(self._states)
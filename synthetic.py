@@ -0,0 +1,74 @@
+"""
+Synthetic WooCommerce catalog for load tests and benchmarks.
+
+Products look like the ones panes.gr returns from ``wc/v3/products``:
+Greek/brand names, string prices, stock status, tags and categories,
+including discount-excluded formula/Solgar items and promo products.
+"""
+import random
+from datetime import datetime, timedelta
+
+BRANDS = {
+    'baby': ['Pampers', 'Babylino', 'Huggies', 'Libero'],
+    'adult': ['Kera', 'TENA', 'EasyPants', 'Seni', 'iD'],
+    'pet': ['EasyPet', 'Trixie', 'Pet Pads'],
+    'formula': ['Humana', 'NAN', 'Nestle NAN', 'Aptamil'],
+    'general': ['Softex', 'Zewa', 'Ariel', 'Skip', 'Klinex'],
+    'vitamins': ['Solgar', 'Lamberts', 'Centrum'],
+    'wipes': ['Pampers', 'Babylino', 'Huggies'],
+    'care': ['Sudocrem', 'Bepanthol', 'Mustela'],
+    'bed': ['Kera Bed', 'TENA Bed', 'Seni Soft'],
+}
+LINES = {
+    'baby': ['Premium Care Jumbo Pack', 'Active Baby Πάνες', 'Sensitive Πάνες', 'Pants Βρακάκι'],
+    'adult': ['Πάνες Ενηλίκων Νύχτας', 'Βρακάκι Ακράτειας', 'Slip Super', 'Pants 30τεμ'],
+    'pet': ['Πάνες Εκπαίδευσης Σκύλου', 'Training Pads', 'Άμμος Γάτας'],
+    'formula': ['1 βρεφικό γάλα 1ης ηλικίας', '2 βρεφικό γάλα 2ης ηλικίας', '3 γάλα 3ης ηλικίας'],
+    'general': ['Χαρτί Υγείας 12 ρολά', 'Χαρτί Κουζίνας', 'Απορρυπαντικό Ρούχων', 'Καθαριστικό'],
+    'vitamins': ['Βιταμίνη C 1000mg', 'Βιταμίνη D3', 'Πολυβιταμίνες'],
+    'wipes': ['Aqua Harmonie Μωρομάντηλα 48τεμ', 'Μωρομάντηλα Sensitive', 'Μαντηλάκια Καθαρισμού'],
+    'care': ['Κρέμα Αλλαγής Πάνας', 'Baby Care Κρέμα', 'Αλοιφή'],
+    'bed': ['Υποσέντονα XL 75×90 30τμχ', 'Υποσέντονα 60×90', 'Υποσέντονα Super'],
+}
+CATEGORY_NAMES = {
+    'baby': 'Βρεφικές Πάνες', 'adult': 'Πάνες Ενηλίκων', 'pet': 'Pet Πάνες & Τροφές',
+    'formula': 'Βρεφικό Γάλα', 'general': 'Χαρτικά', 'vitamins': 'Βιταμίνες',
+    'wipes': 'Μαντηλάκια', 'care': 'Sudocrem & Φροντίδα', 'bed': 'Υποσέντονα',
+}
+SIZES = ['Νο1', 'Νο2', 'Νο3', 'Νο4', 'Νο5', 'Νο6', 'S', 'M', 'L', 'XL']
+KIND_WEIGHTS = [('baby', 30), ('adult', 25), ('pet', 8), ('formula', 8), ('general', 10),
+                ('vitamins', 4), ('wipes', 8), ('care', 4), ('bed', 3)]
+PROMO_IDS = [1446701, 1446694, 1446698, 1446845, 1211051]
+
+
+def generate_catalog(size, seed=42):
+    """Return ``size`` synthetic WooCommerce product dicts"""
+    rng = random.Random(seed)
+    kinds = [kind for kind, weight in KIND_WEIGHTS for _ in range(weight)]
+    category_ids = {kind: i for i, kind in enumerate(CATEGORY_NAMES, 100)}
+    base_date = datetime(2025, 6, 1)
+    products = []
+    for i in range(size):
+        kind = rng.choice(kinds)
+        name = f"{rng.choice(BRANDS[kind])} {rng.choice(LINES[kind])}"
+        if kind in ('baby', 'adult'):
+            name += f" {rng.choice(SIZES)}"
+        price = rng.uniform(2.5, 65.0)
+        tags = []
+        if rng.random() < 0.35:
+            tags.append({'id': 1, 'name': 'B2B', 'slug': 'b2b'})
+        if kind not in ('formula', 'vitamins') and rng.random() < 0.4:
+            tags.append({'id': 2, 'name': 'Subscribe', 'slug': 'subscribe'})
+        product_id = PROMO_IDS[i] if i < len(PROMO_IDS) else 200000 + i
+        products.append({
+            'id': product_id,
+            'name': name,
+            'sku': f"SKU-{product_id}",
+            'price': f"{price:.2f}",
+            'regular_price': f"{price * 1.1:.2f}",
+            'stock_status': 'instock' if rng.random() < 0.85 else 'outofstock',
+            'date_modified': (base_date + timedelta(minutes=rng.randint(0, 200000))).isoformat(),
+            'tags': tags,
+            'categories': [{'id': category_ids[kind], 'name': CATEGORY_NAMES[kind], 'slug': kind}],
+        })
+    return products
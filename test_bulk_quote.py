@@ -0,0 +1,50 @@
+"""Behaviour of the pasted-list parser in bulk_quote.py"""
+import pytest
+
+from bulk_quote import MAX_QUANTITY, parse_line, parse_lines
+
+
+@pytest.mark.parametrize('line, expected', [
+    # The module docstring's examples
+    ('SKU123 x 10', ('SKU123', 10)),
+    ('10 x Pampers Premium Care Jumbo 4', ('Pampers Premium Care Jumbo 4', 10)),
+    ('Kera Bed XL - 5 τεμ', ('Kera Bed XL', 5)),
+    # Other separators and units
+    ('Pampers Jumbo 4 × 3', ('Pampers Jumbo 4', 3)),
+    ('Pampers Jumbo 4: 2', ('Pampers Jumbo 4', 2)),
+    ('Kera Bed XL -5', ('Kera Bed XL', 5)),
+    ('5 τεμ Kera Bed XL', ('Kera Bed XL', 5)),
+    ('SKU123 7', ('SKU123', 7)),
+    ('- Pampers Jumbo 4 x 2', ('Pampers Jumbo 4', 2)),
+])
+def test_quantities(line, expected):
+    assert parse_line(line) == expected
+
+
+@pytest.mark.parametrize('line', [
+    'Kera Bed Υποσέντονα XL 75×90 30τμχ',
+    'Kera Bed XL 75x90',
+    'Υποσέντονα 60×90',
+    'Pampers Jumbo 4',
+    'Μωρομάντηλα 72 τμχ',
+])
+def test_numbers_in_product_names_are_not_quantities(line):
+    assert parse_line(line) == (line, 1)
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('Kera Bed Υποσέντονα XL 75×90 30τμχ x 4', ('Kera Bed Υποσέντονα XL 75×90 30τμχ', 4)),
+    ('Kera Bed Υποσέντονα XL 75×90 30τμχ - 2 τεμ', ('Kera Bed Υποσέντονα XL 75×90 30τμχ', 2)),
+    ('Kera Bed XL 75x90 * 3', ('Kera Bed XL 75x90', 3)),
+])
+def test_catalog_names_with_a_quantity(line, expected):
+    assert parse_line(line) == expected
+
+
+def test_quantity_is_capped():
+    assert parse_line('SKU123 x 99999') == ('SKU123', MAX_QUANTITY)
+
+
+def test_parse_lines_skips_blank_and_zero_lines():
+    text = 'SKU123 x 10\n\n   \nKera Bed XL - 0 τεμ\nKera Bed XL 75x90\n'
+    assert parse_lines(text) == [('SKU123', 10), ('Kera Bed XL 75x90', 1)]
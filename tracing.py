@@ -0,0 +1,112 @@
+"""
+Slow-request tracer.
+
+Every /webhook request carries a lightweight trace (session state before
+and after, handler, and one span per upstream call with its start offset
+and duration). Requests slower than the threshold are kept in a bounded
+in-memory ring and appended to a size-rotated JSONL file; everything else
+is dropped when the request ends.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('whatsapp_trace', default=None)
+
+
+class Trace:
+    """Timeline of one webhook request"""
+
+    __slots__ = ('started', 'wall', 'attrs', 'spans')
+
+    def __init__(self, **attrs):
+        self.started = time.perf_counter()
+        self.wall = datetime.now().isoformat(timespec='milliseconds')
+        self.attrs = attrs
+        self.spans = []
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def to_dict(self, duration_ms):
+        return {'time': self.wall, 'duration_ms': round(duration_ms, 1), **self.attrs, 'spans': self.spans}
+
+
+class SlowRequestTracer:
+    """Keeps traces of requests slower than ``threshold_ms``"""
+
+    def __init__(self, threshold_ms=2000, ring_size=200, path=None, max_bytes=5 * 1024 * 1024, backups=3):
+        self.threshold_ms = threshold_ms
+        self.ring = deque(maxlen=ring_size)
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._file = logging.getLogger('whatsapp.slowtrace')
+            self._file.propagate = False
+            self._file.setLevel(logging.INFO)
+            self._file.addHandler(handler)
+        self.recorded = 0
+
+    def begin(self, **attrs):
+        """Start tracing the current request"""
+        trace = Trace(**attrs)
+        _current.set(trace)
+        return trace
+
+    def annotate(self, **attrs):
+        """Attach attributes (state_after, handler, ...) to the current trace"""
+        trace = _current.get()
+        if trace is not None:
+            trace.attrs.update(attrs)
+
+    def record_span(self, dependency, operation, started, seconds, error, attrs):
+        """Upstream hook: add one span to the current trace"""
+        trace = _current.get()
+        if trace is None:
+            return
+        span = {
+            'dependency': dependency,
+            'operation': operation,
+            'start_ms': round((started - trace.started) * 1000, 1),
+            'duration_ms': round(seconds * 1000, 1),
+        }
+        if attrs:
+            span.update(attrs)
+        if error:
+            span['error'] = error
+        trace.spans.append(span)
+
+    def finish(self):
+        """End the current trace, keeping it if the request was slow"""
+        trace = _current.get()
+        if trace is None:
+            return None
+        _current.set(None)
+        duration_ms = trace.elapsed_ms()
+        if duration_ms < self.threshold_ms:
+            return None
+        record = trace.to_dict(duration_ms)
+        with self._lock:
+            self.ring.append(record)
+            self.recorded += 1
+        if self._file is not None:
+            try:
+                self._file.info(json.dumps(record, ensure_ascii=False, default=str))
+            except Exception as e:
+                logger.warning("Could not write slow trace: %s", e)
+        return record
+
+    def recent(self, limit=50):
+        with self._lock:
+            records = list(self.ring)
+        return records[-limit:][::-1]
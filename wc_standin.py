@@ -0,0 +1,64 @@
+"""
+Local stand-in for WooCommerce's order endpoints.
+
+Mounted under ``/dev/woocommerce`` when ``WC_ORDERS_STANDIN=1``, it answers
+``POST /wp-json/wc/v3/orders/batch`` and ``GET /wp-json/wc/v3/orders`` the
+way WooCommerce does, keeping orders in memory, so the order queue can be
+exercised offline by pointing the orders client at it. ``fail_next`` makes
+the next batches fail, to try out retries.
+"""
+import itertools
+import threading
+from datetime import datetime, timezone
+
+from flask import Blueprint, jsonify, request
+
+PREFIX = '/dev/woocommerce'
+
+blueprint = Blueprint('wc_standin', __name__, url_prefix=f"{PREFIX}/wp-json/wc/v3")
+
+orders = []
+_ids = itertools.count(90001)
+_lock = threading.Lock()
+_failures = {'remaining': 0}
+
+
+def fail_next(batches=1):
+    """Answer the next ``batches`` batch requests with a 503"""
+    _failures['remaining'] = batches
+
+
+def _validate(payload):
+    if not payload.get('line_items'):
+        return {'code': 'woocommerce_rest_required_product_reference', 'message': 'line_items is required',
+                'data': {'status': 400}}
+    return None
+
+
+@blueprint.route('/orders/batch', methods=['POST'])
+def batch():
+    with _lock:
+        if _failures['remaining'] > 0:
+            _failures['remaining'] -= 1
+            return jsonify({'code': 'standin_unavailable', 'message': 'Injected failure'}), 503
+        body = request.get_json(silent=True) or {}
+        created = []
+        for payload in body.get('create', []):
+            error = _validate(payload)
+            if error:
+                created.append({'id': 0, 'error': error})
+                continue
+            order = dict(payload, id=next(_ids), date_created_gmt=datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S'))
+            orders.append(order)
+            created.append(order)
+    return jsonify({'create': created})
+
+
+@blueprint.route('/orders', methods=['GET'])
+def list_orders():
+    after = request.args.get('after')
+    per_page = int(request.args.get('per_page', 10))
+    start = (max(int(request.args.get('page', 1)), 1) - 1) * per_page
+    with _lock:
+        found = [order for order in orders if not after or order['date_created_gmt'] >= after[:19]]
+    return jsonify(list(reversed(found))[start:start + per_page])